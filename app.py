@@ -10,7 +10,6 @@ from flask import Flask, render_template, request, jsonify, send_file, Response
 from werkzeug.utils import secure_filename
 import numpy as np
 import pandas as pd
-import joblib
 from tensorflow.keras.models import load_model
 from datetime import datetime
 import os
@@ -18,75 +17,252 @@ import uuid
 import json
 import threading
 import queue
-import subprocess
-import shutil
+import time
 
 # Importar classificadores LLM
 import llm_classifier
+import classificacao_lote
+import fila_uploads
+import cache_classificacao
+import transacoes_processadas
+import armazenamento
+import treinamento
+import pipeline_features
+import aprendizado_online
+import quantizacao
 
 # Inicializar Flask app
 app = Flask(__name__)
 
 # Variáveis globais para modelos de categoria e subcategoria
 modelo_categoria = None
-scaler_X_categoria = None
-label_encoder_categoria = None
-tfidf_categoria = None
-
 modelo_subcategoria = None
-scaler_X_subcategoria = None
-label_encoder_subcategoria = None
-tfidf_subcategoria = None
-categoria_encoder_subcategoria = None
-categoria_onehot_subcategoria = None
-tags_encoder_subcategoria = None
-tags_onehot_subcategoria = None
+
+# Transformadores ajustados dos dois modelos (TF-IDF, normalizadores, encoders)
+pipeline = None
+
+# Tamanho do lote usado em modelo.predict nas classificações em lote
+TAMANHO_LOTE_PREDICAO = 1024
+
+# Modelo usado no estágio ML: 'keras' (padrão), 'online' (naive Bayes que
+# aprende a cada correção) ou 'auto' (keras; online quando não há modelo keras)
+MODO_ML = os.getenv('MODO_ML', 'keras').lower()
+classificador_online = aprendizado_online.ClassificadorOnline()
+
+# Pesos dos modelos Keras: '' (float32, padrão), 'int8' ou 'float16' - usa o
+# arquivo exportado por quantizacao.py quando ele corresponde ao .h5 atual
+MODELO_QUANTIZADO = os.getenv('MODELO_QUANTIZADO', '').lower()
+
+# Tamanhos de lote das predições de aquecimento: 1 (/api/classify/*) e os
+# lotes dos uploads (até TAMANHO_LOTE_PREDICAO linhas por chamada)
+TAMANHOS_AQUECIMENTO = [
+    int(tamanho) for tamanho in os.getenv('TAMANHOS_AQUECIMENTO', f'1,32,{TAMANHO_LOTE_PREDICAO}').split(',')
+    if tamanho.strip()
+]
+
+# Prontidão do worker para o balanceador de carga (/ready): 'frio' até os
+# modelos serem carregados, 'aquecendo' durante as predições de aquecimento,
+# 'quente' depois e 'falhou' (com o motivo em 'erro') se o aquecimento deu
+# erro ou o estágio ML de MODO_ML ficou sem modelo; tempos de carga por
+# artefato e de aquecimento por lote
+prontidao = {
+    'estado': 'frio',
+    'iniciado_em': datetime.now().isoformat(),
+    'pronto_em': None,
+    'erro': None,
+    'artefatos': {},
+    'aquecimento': {},
+}
+_lock_inicializacao = threading.Lock()
+
+def usar_online():
+    """
+    Se o estágio ML deve usar o classificador online
+    """
+    if not classificador_online.disponivel:
+        return False
+    return MODO_ML == 'online' or (MODO_ML == 'auto' and modelo_categoria is None)
+
+def ml_disponivel():
+    return modelo_categoria is not None or usar_online()
+
+def inicializar_online():
+    """
+    Carrega o estado do classificador online ou o monta a partir das despesas
+    """
+    inicio = time.perf_counter()
+    try:
+        if not classificador_online.carregar() and armazenamento.existem_despesas():
+            classificador_online.treinar_da_base(armazenamento.ler_despesas_tipadas())
+        if classificador_online.disponivel:
+            print(f"✓ Classificador online pronto ({len(classificador_online.categoria.classes_)} categorias, "
+                  f"{len(classificador_online.subcategoria.classes_)} subcategorias)")
+        registrar_artefato('online', inicio, classificador_online.disponivel)
+    except Exception as e:
+        print(f"⚠ Classificador online não disponível: {e}")
+        registrar_artefato('online', inicio, False, e)
+
+def aprender_online(despesa):
+    """
+    Passa uma despesa adicionada/corrigida para o classificador online
+    (nunca interrompe a requisição)
+    """
+    try:
+        classificador_online.aprender(
+            despesa.get('descricao', ''), despesa.get('categoria'),
+            despesa.get('subcategoria'), despesa.get('tags', '')
+        )
+    except Exception as e:
+        print(f"Erro no aprendizado online: {e}")
+
+def carregar_modelo(caminho):
+    """
+    Modelo Keras do caminho ou, com MODELO_QUANTIZADO, a versão quantizada
+    exportada dele (se estiver atualizada)
+    """
+    if MODELO_QUANTIZADO:
+        quantizado = quantizacao.carregar_se_atual(caminho, MODELO_QUANTIZADO)
+        if quantizado is not None:
+            print(f"✓ Usando pesos {MODELO_QUANTIZADO} de {caminho}")
+            return quantizado
+        print(f"⚠ Sem exportação {MODELO_QUANTIZADO} atualizada de {caminho} "
+              f"(python quantizacao.py --formato {MODELO_QUANTIZADO}); usando float32")
+    
+    modelo = load_model(caminho, compile=False)
+    modelo.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    return modelo
+
+def registrar_artefato(nome, inicio, carregado, erro=None):
+    """
+    Tempo de carga de um artefato (segundos desde inicio) para o /ready
+    """
+    prontidao['artefatos'][nome] = {
+        'carregado': carregado,
+        'segundos': round(time.perf_counter() - inicio, 4),
+    }
+    if erro:
+        prontidao['artefatos'][nome]['erro'] = str(erro)
+
+def aquecer_modelos(modelo_cat=None, modelo_sub=None, features=None):
+    """
+    Predições de aquecimento em cada tamanho de TAMANHOS_AQUECIMENTO, pelo
+    mesmo caminho das classificações (features do pipeline + predict com
+    TAMANHO_LOTE_PREDICAO), para o primeiro usuário não pagar o tracing do
+    TensorFlow e as inicializações preguiçosas
+    
+    Sem argumentos, aquece os modelos em uso.
+    
+    Retorno: {'categoria': {tamanho: segundos}, 'subcategoria': {...}}
+    """
+    if features is None:
+        modelo_cat, modelo_sub, features = modelo_categoria, modelo_subcategoria, pipeline
+    
+    tempos = {}
+    for tamanho in TAMANHOS_AQUECIMENTO:
+        descricoes = ['aquecimento'] * tamanho
+        if modelo_cat is not None:
+            inicio = time.perf_counter()
+            X = pipeline_features.features_categoria(features, descricoes)
+            modelo_cat.predict(X, batch_size=TAMANHO_LOTE_PREDICAO, verbose=0)
+            tempos.setdefault('categoria', {})[str(tamanho)] = round(time.perf_counter() - inicio, 4)
+        if modelo_sub is not None:
+            inicio = time.perf_counter()
+            categorias = [features.categoria_encoder.classes_[0]] * tamanho
+            X = pipeline_features.features_subcategoria(features, descricoes, [0.0] * tamanho, categorias, [''] * tamanho)
+            modelo_sub.predict(X, batch_size=TAMANHO_LOTE_PREDICAO, verbose=0)
+            tempos.setdefault('subcategoria', {})[str(tamanho)] = round(time.perf_counter() - inicio, 4)
+    return tempos
 
 def carregar_modelo_e_recursos():
     """
-    Carrega ambos os modelos (categoria e subcategoria) e seus recursos
+    Carrega ambos os modelos (categoria e subcategoria) e o pipeline de features
+    e faz as predições de aquecimento (o worker só fica pronto no /ready depois)
     """
-    global modelo_categoria, scaler_X_categoria, label_encoder_categoria, tfidf_categoria
-    global modelo_subcategoria, scaler_X_subcategoria, label_encoder_subcategoria, tfidf_subcategoria
-    global categoria_encoder_subcategoria, categoria_onehot_subcategoria
-    global tags_encoder_subcategoria, tags_onehot_subcategoria
+    global modelo_categoria, modelo_subcategoria, pipeline
+    
+    prontidao['estado'] = 'frio'
+    
+    # Carregar pipeline de features (artefato único ou .pkl do formato antigo)
+    inicio = time.perf_counter()
+    try:
+        pipeline = pipeline_features.carregar()
+        print("✓ Pipeline de features carregado com sucesso!")
+        registrar_artefato('pipeline', inicio, True)
+    except FileNotFoundError:
+        pipeline = pipeline_features.carregar_legado()
+        registrar_artefato('pipeline', inicio, pipeline.categoria_disponivel or pipeline.subcategoria_disponivel)
+    except Exception as e:
+        print(f"⚠ Pipeline de features inválido: {e}")
+        pipeline = pipeline_features.PipelineFeatures()
+        registrar_artefato('pipeline', inicio, False, e)
     
     # Carregar modelo de CATEGORIA
+    inicio = time.perf_counter()
     try:
-        modelo_categoria = load_model('data/saved_models/category_model.h5', compile=False)
-        modelo_categoria.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
-        scaler_X_categoria = joblib.load('data/saved_models/category_scaler_X.pkl')
-        label_encoder_categoria = joblib.load('data/saved_models/category_label_encoder.pkl')
-        tfidf_categoria = joblib.load('data/saved_models/category_tfidf.pkl')
+        if not pipeline.categoria_disponivel:
+            raise FileNotFoundError('recursos do modelo de categoria não encontrados')
+        modelo_categoria = carregar_modelo('data/saved_models/category_model.h5')
         print("✓ Modelo de CATEGORIA carregado com sucesso!")
+        registrar_artefato('categoria', inicio, True)
     except Exception as e:
         print(f"⚠ Modelo de categoria não disponível: {e}")
         modelo_categoria = None
+        registrar_artefato('categoria', inicio, False, e)
     
     # Carregar modelo de SUBCATEGORIA
+    inicio = time.perf_counter()
     try:
-        modelo_subcategoria = load_model('data/saved_models/subcategoria_model.h5', compile=False)
-        modelo_subcategoria.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
-        scaler_X_subcategoria = joblib.load('data/saved_models/subcategoria_scaler_X.pkl')
-        label_encoder_subcategoria = joblib.load('data/saved_models/subcategoria_label_encoder.pkl')
-        tfidf_subcategoria = joblib.load('data/saved_models/subcategoria_tfidf.pkl')
-        categoria_encoder_subcategoria = joblib.load('data/saved_models/subcategoria_categoria_encoder.pkl')
-        categoria_onehot_subcategoria = joblib.load('data/saved_models/subcategoria_categoria_onehot.pkl')
-        # Carregar recursos de tags (pode não existir em modelos antigos)
-        try:
-            tags_encoder_subcategoria = joblib.load('data/saved_models/subcategoria_tags_encoder.pkl')
-            tags_onehot_subcategoria = joblib.load('data/saved_models/subcategoria_tags_onehot.pkl')
-        except:
-            tags_encoder_subcategoria = None
-            tags_onehot_subcategoria = None
+        if not pipeline.subcategoria_disponivel:
+            raise FileNotFoundError('recursos do modelo de subcategoria não encontrados')
+        modelo_subcategoria = carregar_modelo('data/saved_models/subcategoria_model.h5')
+        if pipeline.tags_encoder is None or pipeline.tags_onehot is None:
             print("⚠ Recursos de tags não encontrados (modelo antigo?)")
         print("✓ Modelo de SUBCATEGORIA carregado com sucesso!")
+        registrar_artefato('subcategoria', inicio, True)
     except Exception as e:
         print(f"⚠ Modelo de subcategoria não disponível: {e}")
         modelo_subcategoria = None
+        registrar_artefato('subcategoria', inicio, False, e)
+    
+    # Aquecer nos tamanhos de lote servidos
+    prontidao['estado'] = 'aquecendo'
+    try:
+        prontidao['aquecimento'] = aquecer_modelos()
+        if prontidao['aquecimento']:
+            print(f"✓ Modelos aquecidos (lotes de {', '.join(map(str, TAMANHOS_AQUECIMENTO))})")
+    except Exception as e:
+        print(f"⚠ Erro no aquecimento dos modelos: {e}")
+        prontidao['aquecimento'] = {}
+        prontidao.update(estado='falhou', erro=f'aquecimento: {e}')
     
     return modelo_categoria, modelo_subcategoria
 
+def concluir_prontidao():
+    """
+    Estado final depois de carregar tudo: 'quente' se o aquecimento passou e
+    o estágio ML de MODO_ML tem modelo, senão 'falhou'
+    """
+    if prontidao['estado'] == 'falhou':
+        return
+    if not ml_disponivel():
+        prontidao.update(estado='falhou', erro=f"nenhum modelo disponível para MODO_ML={MODO_ML}")
+        return
+    prontidao.update(estado='quente', erro=None, pronto_em=datetime.now().isoformat())
+
+def inicializar():
+    """
+    Carrega e aquece os modelos e o classificador online (uma vez por processo)
+    
+    Chamada por main() e, sob um servidor WSGI (gunicorn etc.), na importação
+    do módulo, já que main() não roda.
+    """
+    with _lock_inicializacao:
+        if prontidao['estado'] != 'frio':
+            return
+        carregar_modelo_e_recursos()
+        inicializar_online()
+        concluir_prontidao()
+
 def classificar_categoria_ml(descricao, valor, data_despesa=None):
     """
     Classifica a CATEGORIA (7 classes) da despesa usando Machine Learning
@@ -94,44 +270,20 @@ def classificar_categoria_ml(descricao, valor, data_despesa=None):
     Parâmetros:
     - descricao: descrição da despesa
     - valor: valor da despesa
-    - data_despesa: data da despesa (opcional)
+    - data_despesa: data da despesa (opcional, não usado pelo modelo atual)
     
     Retorno: {"categoria": "...", "confianca": 0.0-1.0}
     """
-    global modelo_categoria, scaler_X_categoria, label_encoder_categoria, tfidf_categoria
-    
-    if modelo_categoria is None:
-        return None
-    
     try:
-        # Se não tem data, usar data atual
-        if data_despesa is None:
-            data_despesa = datetime.now()
-        else:
-            data_despesa = pd.to_datetime(data_despesa)
-        
-        # Extrair features de texto (TF-IDF) - ÚNICA FEATURE
-        text_features = tfidf_categoria.transform([descricao]).toarray()
-        
-        # Usar apenas descrição
-        features = text_features
-        
-        # Normalizar features
-        features_normalized = scaler_X_categoria.transform(features)
-        
-        # Fazer previsão
-        predicao = modelo_categoria.predict(features_normalized, verbose=0)
-        
-        # Pegar categoria com maior probabilidade
-        categoria_idx = np.argmax(predicao[0])
-        confianca = float(predicao[0][categoria_idx])
-        categoria = label_encoder_categoria.inverse_transform([categoria_idx])[0]
+        resultado = classificar_categoria_ml_lote([descricao])
+        if resultado is None:
+            return None
         
         return {
-            "categoria": categoria,
-            "confianca": confianca
+            "categoria": resultado['categoria'].iloc[0],
+            "confianca": float(resultado['confianca'].iloc[0])
         }
-        
+    
     except Exception as e:
         print(f"Erro na classificação ML de categoria: {e}")
         return None
@@ -150,13 +302,6 @@ def classificar_subcategoria_ml(descricao, valor, data_despesa=None, categoria=N
     
     Retorno: {"subcategoria": "...", "confianca": 0.0-1.0}
     """
-    global modelo_subcategoria, scaler_X_subcategoria, label_encoder_subcategoria, tfidf_subcategoria
-    global categoria_encoder_subcategoria, categoria_onehot_subcategoria
-    global tags_encoder_subcategoria, tags_onehot_subcategoria
-    
-    if modelo_subcategoria is None:
-        return None
-    
     try:
         # Se não tem categoria, tentar classificar primeiro
         if categoria is None:
@@ -166,61 +311,99 @@ def classificar_subcategoria_ml(descricao, valor, data_despesa=None, categoria=N
             else:
                 categoria = 'CATEGORIZAR'  # Default
         
-        # Extrair features de texto (TF-IDF)
-        text_features = tfidf_subcategoria.transform([descricao]).toarray()
-        
-        # Features numéricas
-        numeric_features = np.array([[valor]])
-        
-        # Features de categoria (one-hot)
-        try:
-            categoria_encoded = categoria_encoder_subcategoria.transform([categoria])[0]
-            categoria_features = categoria_onehot_subcategoria.transform(categoria_encoded.reshape(-1, 1))
-        except:
-            # Se categoria não está no encoder, usar zeros
-            categoria_features = np.zeros((1, len(categoria_encoder_subcategoria.classes_)))
-        
-        # Features de tags (one-hot)
-        if tags_encoder_subcategoria is not None and tags_onehot_subcategoria is not None:
-            try:
-                tags_processed = str(tags).strip() if tags else ''
-                tags_encoded = tags_encoder_subcategoria.transform([tags_processed])[0]
-                tags_features = tags_onehot_subcategoria.transform(tags_encoded.reshape(-1, 1))
-            except:
-                # Se tag não está no encoder, usar zeros
-                tags_features = np.zeros((1, len(tags_encoder_subcategoria.classes_)))
-        else:
-            # Modelo antigo sem tags - usar zeros
-            tags_features = np.zeros((1, 1))  # Placeholder
-        
-        # Combinar TODAS as features (sem temporais, com tags)
-        features = np.hstack([
-            text_features, 
-            numeric_features, 
-            categoria_features,
-            tags_features
-        ])
-        
-        # Normalizar features
-        features_normalized = scaler_X_subcategoria.transform(features)
-        
-        # Fazer previsão
-        predicao = modelo_subcategoria.predict(features_normalized, verbose=0)
-        
-        # Pegar subcategoria com maior probabilidade
-        subcategoria_idx = np.argmax(predicao[0])
-        confianca = float(predicao[0][subcategoria_idx])
-        subcategoria = label_encoder_subcategoria.inverse_transform([subcategoria_idx])[0]
+        resultado = classificar_subcategoria_ml_lote([descricao], [valor], [categoria], [tags])
+        if resultado is None:
+            return None
         
         return {
-            "subcategoria": subcategoria,
-            "confianca": confianca
+            "subcategoria": resultado['subcategoria'].iloc[0],
+            "confianca": float(resultado['confianca'].iloc[0])
         }
-        
+    
     except Exception as e:
         print(f"Erro na classificação ML de subcategoria: {e}")
         return None
 
+def classificar_categoria_ml_lote(descricoes, texto=None):
+    """
+    Classifica a CATEGORIA de várias despesas com uma única chamada ao modelo
+    
+    - texto: TF-IDF das descrições já calculado (quando o pipeline é compartilhado)
+    
+    Retorno: DataFrame com colunas categoria, confianca (mesma ordem da entrada)
+    ou None se o modelo não estiver carregado
+    """
+    if usar_online():
+        resultado = classificador_online.classificar_lote(descricoes)
+        return resultado[['categoria', 'confianca']]
+    
+    # Referências locais: uma troca de modelos no meio da chamada não mistura versões
+    modelo, features = modelo_categoria, pipeline
+    if modelo is None:
+        return None
+    
+    features_normalized = pipeline_features.features_categoria(features, descricoes, texto)
+    predicao = modelo.predict(features_normalized, batch_size=TAMANHO_LOTE_PREDICAO, verbose=0)
+    
+    categoria_idx = np.argmax(predicao, axis=1)
+    return pd.DataFrame({
+        'categoria': features.label_encoder_categoria.inverse_transform(categoria_idx),
+        'confianca': predicao[np.arange(len(categoria_idx)), categoria_idx].astype(float)
+    })
+
+def classificar_subcategoria_ml_lote(descricoes, valores, categorias, tags=None, texto=None):
+    """
+    Classifica a SUBCATEGORIA de várias despesas com uma única chamada ao modelo
+    (features montadas pelo mesmo código do treinamento, para o lote inteiro)
+    
+    Retorno: DataFrame com colunas subcategoria, confianca ou None sem modelo
+    """
+    if usar_online():
+        return classificador_online.classificar_subcategoria_lote(descricoes, categorias, tags)
+    
+    modelo, features = modelo_subcategoria, pipeline
+    if modelo is None:
+        return None
+    
+    features_normalized = pipeline_features.features_subcategoria(
+        features, descricoes, valores, categorias, tags, texto
+    )
+    predicao = modelo.predict(features_normalized, batch_size=TAMANHO_LOTE_PREDICAO, verbose=0)
+    
+    subcategoria_idx = np.argmax(predicao, axis=1)
+    return pd.DataFrame({
+        'subcategoria': features.label_encoder_subcategoria.inverse_transform(subcategoria_idx),
+        'confianca': predicao[np.arange(len(subcategoria_idx)), subcategoria_idx].astype(float)
+    })
+
+def classificar_ml_lote(descricoes, valores, tags=None, datas=None):
+    """
+    Estágio ML do pipeline em lote: categoria e depois subcategoria (usando a
+    categoria prevista como feature), cada uma em uma única passada
+    (datas não são usadas pelos modelos atuais)
+    
+    Com o TF-IDF compartilhado pelos dois modelos, as descrições são vetorizadas uma vez.
+    """
+    if usar_online():
+        return classificador_online.classificar_lote(descricoes, tags)
+    
+    features = pipeline
+    texto = None
+    if features is not None and features.tfidf_compartilhado:
+        texto = features.tfidf_categoria.transform(list(descricoes))
+    
+    resultado = classificar_categoria_ml_lote(descricoes, texto)
+    if resultado is None:
+        return None
+    
+    resultado_sub = classificar_subcategoria_ml_lote(
+        descricoes, valores, resultado['categoria'].tolist(), tags, texto
+    )
+    if resultado_sub is not None:
+        resultado['subcategoria'] = resultado_sub['subcategoria'].to_numpy()
+        resultado['confianca_subcategoria'] = resultado_sub['confianca'].to_numpy()
+    return resultado
+
 
 # Rotas da aplicação
 @app.route('/')
@@ -284,7 +467,7 @@ def api_classify_ml():
             resposta['confianca_subcategoria'] = 0.0
         
         return jsonify(resposta)
-        
+    
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -323,7 +506,7 @@ def api_classify_llm():
             'metodo': 'llm',
             'provider': resultado['provider']
         })
-        
+    
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -358,7 +541,7 @@ def api_classify_hybrid():
         categoria_ml = None
         confianca_categoria_ml = 0.0
         
-        if modelo_categoria is not None:
+        if ml_disponivel():
             try:
                 resultado_ml_cat = classificar_categoria_ml(descricao, valor, data_despesa)
                 if resultado_ml_cat:
@@ -371,7 +554,7 @@ def api_classify_hybrid():
         subcategoria_ml = None
         confianca_subcategoria_ml = 0.0
         
-        if modelo_subcategoria is not None and categoria_ml:
+        if (modelo_subcategoria is not None or usar_online()) and categoria_ml:
             try:
                 resultado_ml_sub = classificar_subcategoria_ml(descricao, valor, data_despesa, categoria_ml, tags=data.get('tags', ''))
                 if resultado_ml_sub:
@@ -414,7 +597,7 @@ def api_classify_hybrid():
         }
         
         return jsonify(resposta)
-        
+    
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -450,9 +633,6 @@ def api_add_expense():
                 'message': 'Descrição e valor são obrigatórios'
             })
         
-        # Ler CSV existente
-        df = pd.read_csv('data/expenses.csv')
-        
         # Adicionar nova linha (ordem correta: data,descricao,valor,tags,subcategoria,categoria)
         nova_despesa = pd.DataFrame([{
             'data': data_despesa,
@@ -463,20 +643,19 @@ def api_add_expense():
             'categoria': categoria
         }])
         
-        df = pd.concat([df, nova_despesa], ignore_index=True)
-        
-        # Garantir ordem correta das colunas ao salvar
-        colunas_ordenadas = ['data', 'descricao', 'valor', 'tags', 'subcategoria', 'categoria']
-        df = df[colunas_ordenadas]
+        def adicionar(df):
+            df = pd.concat([df, nova_despesa], ignore_index=True)
+            return df[armazenamento.COLUNAS_DESPESAS], None
         
-        # Salvar
-        df.to_csv('data/expenses.csv', index=False)
+        # Gravação com lock, agrupada com outras alterações simultâneas
+        armazenamento.alterar_despesas(adicionar)
+        aprender_online(nova_despesa.iloc[0].to_dict())
         
         return jsonify({
             'status': 'success',
             'message': 'Despesa adicionada com sucesso!'
         })
-        
+    
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -509,16 +688,8 @@ def api_get_expenses():
         sort_by = request.args.get('sort_by', 'data')
         sort_order = request.args.get('sort_order', 'desc')
         
-        # Carregar dados
-        df = pd.read_csv('data/expenses.csv')
-        
-        # Garantir ordem correta das colunas
-        colunas_ordenadas = ['data', 'descricao', 'valor', 'tags', 'subcategoria', 'categoria']
-        df = df[colunas_ordenadas]
-        
-        # Converter data para datetime se necessário
-        if 'data' in df.columns:
-            df['data'] = pd.to_datetime(df['data'], errors='coerce')
+        # Carregar dados tipados (na ordem correta das colunas; data já em datetime)
+        df = armazenamento.ler_despesas_tipadas(colunas=armazenamento.COLUNAS_DESPESAS)
         
         # Aplicar filtros
         if search:
@@ -549,10 +720,6 @@ def api_get_expenses():
             ascending = (sort_order == 'asc')
             df = df.sort_values(sort_by, ascending=ascending, na_position='last')
         
-        # Converter data de volta para string para JSON
-        if 'data' in df.columns:
-            df['data'] = df['data'].dt.strftime('%Y-%m-%d').fillna('')
-        
         # Paginar
         total = len(df)
         total_pages = (total + limit - 1) // limit if total > 0 else 1
@@ -560,16 +727,23 @@ def api_get_expenses():
         end = start + limit
         df_page = df.iloc[start:end] if total > 0 else df
         
-        # Converter para JSON
+        # Converter para JSON (só a página volta para texto / float64)
+        df_page = df_page.assign(
+            data=df_page['data'].dt.strftime('%Y-%m-%d').fillna(''),
+            valor=df_page['valor'].astype('float64').round(2)
+        )
+        for coluna in armazenamento.COLUNAS_CATEGORICAS:
+            df_page[coluna] = df_page[coluna].astype(object)
         expenses = df_page.to_dict('records')
         
-        # Estatísticas (sobre dados filtrados, não paginados)
-        total_valor = float(df['valor'].sum()) if len(df) > 0 else 0.0
-        media = float(df['valor'].mean()) if len(df) > 0 else 0.0
+        # Estatísticas (sobre dados filtrados, não paginados; soma em float64)
+        valores = df['valor'].astype('float64')
+        total_valor = round(float(valores.sum()), 2) if len(df) > 0 else 0.0
+        media = float(valores.mean()) if len(df) > 0 else 0.0
         count = len(df)
         
         # Gastos por categoria
-        por_categoria = df.groupby('categoria')['valor'].sum().to_dict() if len(df) > 0 else {}
+        por_categoria = valores.groupby(df['categoria'], observed=True).sum().round(2).to_dict() if len(df) > 0 else {}
         
         return jsonify({
             'status': 'success',
@@ -587,7 +761,7 @@ def api_get_expenses():
                 'por_categoria': por_categoria
             }
         })
-        
+    
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -599,19 +773,18 @@ def api_manage_expense(index):
     """
     Editar ou excluir despesa por índice
     """
-    try:
-        df = pd.read_csv('data/expenses.csv')
-        
+    def validar_indice(df):
         if index < 0 or index >= len(df):
-            return jsonify({
-                'status': 'error',
-                'message': 'Índice inválido'
-            }), 400
-        
+            raise IndexError('Índice inválido')
+    
+    try:
         if request.method == 'DELETE':
             # Excluir despesa
-            df = df.drop(df.index[index]).reset_index(drop=True)
-            df.to_csv('data/expenses.csv', index=False)
+            def excluir(df):
+                validar_indice(df)
+                return df.drop(df.index[index]).reset_index(drop=True), None
+            
+            armazenamento.alterar_despesas(excluir)
             
             return jsonify({
                 'status': 'success',
@@ -622,32 +795,45 @@ def api_manage_expense(index):
             # Editar despesa
             data = request.get_json()
             
-            # Atualizar campos
-            if 'data' in data:
-                df.at[index, 'data'] = data['data']
-            if 'descricao' in data:
-                df.at[index, 'descricao'] = data['descricao']
-            if 'valor' in data:
-                df.at[index, 'valor'] = float(data['valor'])
-            if 'categoria' in data:
-                df.at[index, 'categoria'] = data['categoria']
-            if 'subcategoria' in data:
-                df.at[index, 'subcategoria'] = data.get('subcategoria', '')
-            if 'tags' in data:
-                df.at[index, 'tags'] = data.get('tags', '')
+            def editar(df):
+                validar_indice(df)
+                df = df.copy()
+                
+                # Atualizar campos
+                if 'data' in data:
+                    df.at[index, 'data'] = data['data']
+                if 'descricao' in data:
+                    df.at[index, 'descricao'] = data['descricao']
+                if 'valor' in data:
+                    df.at[index, 'valor'] = float(data['valor'])
+                if 'categoria' in data:
+                    df.at[index, 'categoria'] = data['categoria']
+                if 'subcategoria' in data:
+                    df.at[index, 'subcategoria'] = data.get('subcategoria', '')
+                if 'tags' in data:
+                    df.at[index, 'tags'] = data.get('tags', '')
+                
+                # Garantir ordem correta das colunas
+                df = df[armazenamento.COLUNAS_DESPESAS]
+                return df, df.iloc[index].to_dict()
             
-            # Garantir ordem correta das colunas
-            colunas_ordenadas = ['data', 'descricao', 'valor', 'tags', 'subcategoria', 'categoria']
-            df = df[colunas_ordenadas]
+            expense = armazenamento.alterar_despesas(editar)
             
-            df.to_csv('data/expenses.csv', index=False)
+            # Correção de categoria/subcategoria: atualizar o classificador online
+            if 'categoria' in data or 'subcategoria' in data:
+                aprender_online(expense)
             
             return jsonify({
                 'status': 'success',
                 'message': 'Despesa atualizada com sucesso',
-                'expense': df.iloc[index].to_dict()
+                'expense': expense
             })
     
+    except IndexError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -667,7 +853,8 @@ def api_find_expense():
                 'message': 'Dados não fornecidos'
             }), 400
         
-        df = pd.read_csv('data/expenses.csv')
+        # Só as colunas usadas na busca
+        df = armazenamento.ler_despesas(colunas=['data', 'descricao', 'valor'])
         
         # Buscar despesa que corresponde aos dados
         mask = pd.Series([True] * len(df))
@@ -716,16 +903,8 @@ def api_export_expenses():
         valor_min = request.args.get('valor_min', type=float)
         valor_max = request.args.get('valor_max', type=float)
         
-        # Carregar e filtrar dados
-        df = pd.read_csv('data/expenses.csv')
-        
-        # Garantir ordem correta das colunas
-        colunas_ordenadas = ['data', 'descricao', 'valor', 'tags', 'subcategoria', 'categoria']
-        df = df[colunas_ordenadas]
-        
-        # Converter data para datetime se necessário
-        if 'data' in df.columns:
-            df['data'] = pd.to_datetime(df['data'], errors='coerce')
+        # Carregar dados tipados (na ordem correta das colunas) e filtrar
+        df = armazenamento.ler_despesas_tipadas(colunas=armazenamento.COLUNAS_DESPESAS)
         
         # Aplicar filtros
         if search:
@@ -752,13 +931,12 @@ def api_export_expenses():
             df = df[df['valor'] <= valor_max]
         
         # Converter data de volta para string
-        if 'data' in df.columns:
-            df['data'] = df['data'].dt.strftime('%Y-%m-%d').fillna('')
+        df = df.assign(data=df['data'].dt.strftime('%Y-%m-%d').fillna(''))
         
         # Gerar arquivo CSV temporário
         filename = f'expenses_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
         filepath = os.path.join('data', filename)
-        df.to_csv(filepath, index=False)
+        armazenamento.exportar_csv(filepath, df)
         
         return send_file(filepath, as_attachment=True, download_name=filename, mimetype='text/csv')
     
@@ -782,10 +960,91 @@ def transactions_page():
     """
     return render_template('transactions.html')
 
+def processar_upload(job, progresso):
+    """
+    Processa um CSV enviado (executado pelos workers de fila_uploads)
+    
+    Lê e classifica o arquivo em chunks, acrescentando cada chunk ao CSV
+    processado, e salva os metadados.
+    Retorno: metadados do arquivo processado
+    """
+    file_id = job['file_id']
+    filename = job['original_filename']
+    input_path = job['input_path']
+    output_path = job['output_path']
+    
+    # Ler, classificar e gravar em chunks (memória limitada ao tamanho do chunk).
+    # Cada chunk concluído vira checkpoint: um job retomado após reinício
+    # continua do último chunk gravado.
+    # Linhas já classificadas em uploads anteriores (mesma versão) saem do cache
+    versao = job.get('versao')
+    cache = cache_classificacao.CacheLinhas(versao) if versao else None
+    
+    progresso('Lendo arquivo...')
+    resumo = classificacao_lote.classificar_csv_em_chunks(
+        input_path,
+        output_path,
+        classificador_ml=classificar_ml_lote if ml_disponivel() else None,
+        progresso=progresso,
+        versao=versao,
+        cache=cache,
+        on_bad_lines='skip'
+    )
+    
+    # Cópia em Parquet para a consulta paginada de /api/transactions
+    progresso('Gerando arquivo de consulta (Parquet)...')
+    caminho_parquet = transacoes_processadas.converter_para_parquet(output_path)
+    
+    # Salvar metadados
+    metadata = {
+        'file_id': file_id,
+        'original_filename': filename,
+        'processed_filename': os.path.basename(output_path),
+        'processed_parquet': os.path.basename(caminho_parquet),
+        'total_rows': resumo['total_rows'],
+        'processed_rows': resumo['processed_rows'],
+        'unique_rows': resumo['unique_rows'],
+        'cached_rows': resumo.get('cached_rows', 0),
+        'dedupe_ratio': round(resumo['dedupe_ratio'], 2),
+        'versao_classificacao': versao
+    }
+    
+    with open(f'data/uploads/{file_id}_metadata.json', 'w') as f:
+        json.dump(metadata, f)
+    
+    return metadata
+
+def _upload_reaproveitavel(chave):
+    """
+    Job já registrado para a chave de conteúdo, se ainda servir (na fila, em
+    execução ou concluído com o arquivo processado presente); senão None
+    """
+    file_id = cache_classificacao.buscar_upload(chave)
+    if file_id is None:
+        return None
+    
+    job = fila_uploads.carregar_estado(file_id)
+    if job is not None:
+        if job['status'] in fila_uploads.STATUS_PENDENTES:
+            return job
+        if job['status'] == 'completed' and os.path.exists(job['output_path']):
+            return job
+    
+    # Upload com erro, cancelado ou removido: processar de novo
+    cache_classificacao.remover_upload(chave)
+    return None
+
 @app.route('/api/upload-csv', methods=['POST'])
 def api_upload_csv():
     """
-    Upload e processamento de CSV em lote
+    Upload de CSV para processamento em lote
+    
+    O arquivo é salvo e colocado na fila; o processamento acontece em segundo
+    plano. Acompanhe por /api/upload/progress/<file_id> ou /api/upload/status/<file_id>.
+    
+    Um arquivo com o mesmo conteúdo de um upload anterior (e a mesma versão
+    dos modelos/providers) não é reprocessado: a resposta traz o file_id do
+    upload existente, com cached=True.
     """
     try:
         if 'file' not in request.files:
@@ -810,143 +1069,142 @@ def api_upload_csv():
         
         file.save(input_path)
         
-        # Processar CSV
-        df = pd.read_csv(input_path, encoding='utf-8', on_bad_lines='skip')
-        
-        # Detectar colunas
-        col_descricao = None
-        col_valor = None
-        col_data = None
+        # Mesmo conteúdo + mesma versão da classificação = mesmo resultado
+        versao = cache_classificacao.versao_classificacao()
+        chave = cache_classificacao.chave_upload(cache_classificacao.hash_arquivo(input_path), versao)
+        existente = _upload_reaproveitavel(chave)
+        if existente is not None:
+            os.remove(input_path)
+            return jsonify({
+                'status': 'success',
+                'file_id': existente['file_id'],
+                'job_status': existente['status'],
+                'cached': True,
+                'metadata': existente.get('resultado'),
+                'message': 'Arquivo já enviado anteriormente: resultado reaproveitado.'
+            })
         
-        for col in df.columns:
-            col_upper = col.upper()
-            if 'DESCRI' in col_upper or 'DESCRICAO' in col_upper:
-                col_descricao = col
-            if 'VALOR' in col_upper:
-                col_valor = col
-            if 'DATA' in col_upper or 'DATE' in col_upper:
-                col_data = col
+        # Validar apenas o cabeçalho antes de enfileirar
+        try:
+            colunas = pd.read_csv(input_path, encoding='utf-8', nrows=0).columns
+        except UnicodeDecodeError:
+            colunas = pd.read_csv(input_path, encoding='latin-1', nrows=0).columns
+        col_descricao, col_valor, _ = classificacao_lote.detectar_colunas(colunas)
         
         if not col_descricao or not col_valor:
+            os.remove(input_path)
             return jsonify({
                 'status': 'error',
                 'message': 'Colunas de descrição e valor não encontradas'
             })
         
-        # Processar cada linha
-        resultados_ml_cat = []
-        resultados_ml_sub = []
-        resultados_llm = []
-        resultados_openai = []
-        confianca_ml_cat = []
-        confianca_ml_sub = []
-        confianca_llm = []
-        confianca_openai = []
-        
-        total = len(df)
-        for idx, row in df.iterrows():
-            descricao = str(row[col_descricao]) if pd.notna(row[col_descricao]) else ""
-            valor = float(row[col_valor]) if pd.notna(row[col_valor]) else 0.0
-            data = row[col_data] if col_data and pd.notna(row[col_data]) else None
-            
-            if not descricao or valor <= 0:
-                resultados_ml_cat.append("")
-                resultados_ml_sub.append("")
-                resultados_llm.append("")
-                resultados_openai.append("")
-                confianca_ml_cat.append(0.0)
-                confianca_ml_sub.append(0.0)
-                confianca_llm.append(0.0)
-                confianca_openai.append(0.0)
-                continue
-            
-            # ML - Categoria
-            resultado_ml_cat = None
-            if modelo_categoria is not None:
-                try:
-                    resultado_ml_cat = classificar_categoria_ml(descricao, valor, data)
-                    resultados_ml_cat.append(resultado_ml_cat['categoria'] if resultado_ml_cat else "")
-                    confianca_ml_cat.append(resultado_ml_cat['confianca'] if resultado_ml_cat else 0.0)
-                except:
-                    resultados_ml_cat.append("")
-                    confianca_ml_cat.append(0.0)
-            else:
-                resultados_ml_cat.append("")
-                confianca_ml_cat.append(0.0)
-            
-            # ML - Subcategoria (usando categoria como feature)
-            resultado_ml_sub = None
-            if modelo_subcategoria is not None and resultado_ml_cat:
-                try:
-                    resultado_ml_sub = classificar_subcategoria_ml(
-                        descricao, valor, data, resultado_ml_cat.get('categoria'), tags=row.get('tags', '')
-                    )
-                    resultados_ml_sub.append(resultado_ml_sub['subcategoria'] if resultado_ml_sub else "")
-                    confianca_ml_sub.append(resultado_ml_sub['confianca'] if resultado_ml_sub else 0.0)
-                except:
-                    resultados_ml_sub.append("")
-                    confianca_ml_sub.append(0.0)
-            else:
-                resultados_ml_sub.append("")
-                confianca_ml_sub.append(0.0)
-            
-            # LLM (todos)
-            try:
-                resultado_llm = llm_classifier.classificar_com_llm(descricao)
-                resultados_llm.append(resultado_llm.get('categoria', ''))
-                confianca_llm.append(resultado_llm.get('confianca', 0.0))
-            except:
-                resultados_llm.append("")
-                confianca_llm.append(0.0)
-            
-            # OpenAI específico
-            try:
-                from providers import openai as openai_provider
-                resultado_openai = openai_provider.classificar_categoria(descricao)
-                resultados_openai.append(resultado_openai.get('categoria', ''))
-                confianca_openai.append(resultado_openai.get('confianca', 0.0))
-            except:
-                resultados_openai.append(resultado_llm.get('categoria', '') if resultado_llm else "")
-                confianca_openai.append(resultado_llm.get('confianca', 0.0) if resultado_llm else 0.0)
-        
-        # Adicionar colunas
-        df['Categoria_ML'] = resultados_ml_cat
-        df['Confianca_ML'] = [c for c in confianca_ml_cat]
-        df['Subcategoria_ML'] = resultados_ml_sub
-        df['Confianca_Subcategoria_ML'] = [c for c in confianca_ml_sub]
-        df['Categoria_LLM'] = resultados_llm
-        df['Confianca_LLM'] = [c for c in confianca_llm]
-        df['Categoria_OpenAI'] = resultados_openai
-        df['Confianca_OpenAI'] = [c for c in confianca_openai]
-        
-        # Salvar resultado
-        df.to_csv(output_path, index=False, encoding='utf-8-sig')
-        
-        # Salvar metadados
-        metadata = {
-            'file_id': file_id,
-            'original_filename': filename,
-            'processed_filename': f'{file_id}_processado_{filename}',
-            'total_rows': total,
-            'processed_rows': len([r for r in resultados_ml_cat if r])
-        }
-        
-        with open(f'data/uploads/{file_id}_metadata.json', 'w') as f:
-            json.dump(metadata, f)
+        fila_uploads.iniciar_workers(processar_upload)
+        job = fila_uploads.enfileirar(
+            file_id,
+            original_filename=filename,
+            input_path=input_path,
+            output_path=output_path,
+            versao=versao
+        )
+        cache_classificacao.registrar_upload(chave, file_id)
         
         return jsonify({
             'status': 'success',
             'file_id': file_id,
-            'total_rows': total,
-            'message': f'{total} transações processadas com sucesso!'
+            'job_status': job['status'],
+            'cached': False,
+            'message': 'Arquivo recebido! Processamento iniciado em segundo plano.'
         })
-        
+    
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': f'Erro ao processar CSV: {str(e)}'
         })
 
+@app.route('/api/upload/status/<file_id>')
+def api_upload_status(file_id):
+    """
+    Estado do processamento de um upload
+    """
+    job = fila_uploads.carregar_estado(file_id)
+    if job is None:
+        return jsonify({
+            'status': 'error',
+            'message': 'Upload não encontrado'
+        }), 404
+    
+    return jsonify({
+        'status': 'success',
+        'job': job
+    })
+
+@app.route('/api/upload/cancel/<file_id>', methods=['POST'])
+def api_upload_cancel(file_id):
+    """
+    Cancela o processamento de um upload (na fila ou em execução)
+    """
+    if not fila_uploads.cancelar(file_id):
+        return jsonify({
+            'status': 'error',
+            'message': 'Upload não encontrado ou já finalizado'
+        }), 400
+    
+    return jsonify({
+        'status': 'success',
+        'message': 'Cancelamento solicitado'
+    })
+
+@app.route('/api/upload/progress/<file_id>')
+def api_upload_progress(file_id):
+    """
+    Stream de progresso do processamento usando Server-Sent Events (SSE)
+    """
+    def generate():
+        job = fila_uploads.carregar_estado(file_id)
+        
+        if not job:
+            yield f"data: {json.dumps({'error': 'Upload não encontrado'})}\n\n"
+            return
+        
+        # Enviar status inicial
+        yield f"data: {json.dumps({'status': job['status'], 'line': 'Conectado ao stream de progresso...'})}\n\n"
+        
+        # None: job de outro processo (ou já terminado), acompanhado pelo estado em disco
+        eventos = fila_uploads.assinar(file_id)
+        
+        # Stream de progresso
+        try:
+            while True:
+                try:
+                    try:
+                        if eventos is None:
+                            time.sleep(1)
+                            raise queue.Empty
+                        evento = eventos.get(timeout=1)
+                        yield f"data: {json.dumps(evento)}\n\n"
+                    except queue.Empty:
+                        # Se não há eventos, verificar status
+                        job = fila_uploads.carregar_estado(file_id)
+                        if job['status'] in fila_uploads.STATUS_FINAIS:
+                            yield f"data: {json.dumps({'status': job['status'], 'completed': True, 'error': job.get('error'), 'resultado': job.get('resultado')})}\n\n"
+                            break
+                        # Continuar esperando
+                        yield f"data: {json.dumps({'heartbeat': True})}\n\n"
+                        continue
+                
+                except Exception as e:
+                    yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                    break
+        finally:
+            if eventos is not None:
+                fila_uploads.cancelar_assinatura(file_id, eventos)
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 @app.route('/api/download-csv/<file_id>')
 def api_download_csv(file_id):
     """
@@ -968,29 +1226,79 @@ def api_download_csv(file_id):
 @app.route('/api/transactions/<file_id>')
 def api_get_transactions(file_id):
     """
-    Retorna transações processadas
+    Retorna transações processadas, paginadas
+    
+    Parâmetros (query string):
+    - pagina, por_pagina: paginação (padrão 1 e 100, máximo 1000 por página)
+    - ordenar_por, ordem: coluna e 'asc'/'desc'
+    - categoria, subcategoria, busca, confianca_min: filtros
+    - colunas: lista separada por vírgula (padrão: todas)
+    - formato: 'registros' (padrão), 'colunas' (JSON colunar) ou 'arrow' (Arrow IPC)
     """
     try:
         # Buscar metadados
         with open(f'data/uploads/{file_id}_metadata.json', 'r') as f:
             metadata = json.load(f)
-        
-        # Ler CSV processado
-        df = pd.read_csv(f"data/uploads/{metadata['processed_filename']}")
-        
-        # Converter para JSON
-        transactions = df.to_dict('records')
-        
-        return jsonify({
-            'status': 'success',
-            'transactions': transactions,
-            'metadata': metadata
-        })
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': f'Erro ao buscar transações: {str(e)}'
         }), 404
+    
+    try:
+        pagina = request.args.get('pagina', 1, type=int)
+        por_pagina = request.args.get('por_pagina', transacoes_processadas.POR_PAGINA_PADRAO, type=int)
+        colunas = request.args.get('colunas')
+        formato = request.args.get('formato', 'registros')
+        
+        tabela, total = transacoes_processadas.consultar(
+            f"data/uploads/{metadata['processed_filename']}",
+            pagina=pagina,
+            por_pagina=por_pagina,
+            ordenar_por=request.args.get('ordenar_por') or None,
+            ordem=request.args.get('ordem', 'asc'),
+            colunas=colunas.split(',') if colunas else None,
+            categoria=request.args.get('categoria') or None,
+            subcategoria=request.args.get('subcategoria') or None,
+            busca=request.args.get('busca') or None,
+            confianca_min=request.args.get('confianca_min', type=float)
+        )
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Erro ao buscar transações: {str(e)}'
+        }), 500
+    
+    por_pagina = max(1, min(por_pagina, transacoes_processadas.POR_PAGINA_MAX))
+    paginacao = {
+        'pagina': max(1, pagina),
+        'por_pagina': por_pagina,
+        'total': total,
+        'total_paginas': (total + por_pagina - 1) // por_pagina
+    }
+    
+    if formato == 'arrow':
+        return Response(transacoes_processadas.para_ipc(tabela), mimetype='application/vnd.apache.arrow.stream', headers={
+            'X-Total-Count': str(total),
+            'X-Pagina': str(paginacao['pagina']),
+            'X-Total-Paginas': str(paginacao['total_paginas'])
+        })
+    
+    resposta = {
+        'status': 'success',
+        'metadata': metadata,
+        'paginacao': paginacao
+    }
+    if formato == 'colunas':
+        resposta['columns'] = tabela.to_pydict()
+    else:
+        resposta['transactions'] = tabela.to_pylist()
+    return jsonify(resposta)
 
 @app.route('/status')
 def status():
@@ -1005,7 +1313,8 @@ def status():
     if modelo_categoria is not None:
         status_info['modelos']['categoria'] = {
             'carregado': True,
-            'categorias': list(label_encoder_categoria.classes_)
+            'pesos': getattr(modelo_categoria, 'formato', 'float32'),
+            'categorias': list(pipeline.label_encoder_categoria.classes_)
         }
     else:
         status_info['modelos']['categoria'] = {'carregado': False}
@@ -1013,11 +1322,19 @@ def status():
     if modelo_subcategoria is not None:
         status_info['modelos']['subcategoria'] = {
             'carregado': True,
-            'total_subcategorias': len(label_encoder_subcategoria.classes_)
+            'pesos': getattr(modelo_subcategoria, 'formato', 'float32'),
+            'total_subcategorias': len(pipeline.label_encoder_subcategoria.classes_)
         }
     else:
         status_info['modelos']['subcategoria'] = {'carregado': False}
     
+    status_info['modelos']['online'] = {
+        'carregado': classificador_online.disponivel,
+        'em_uso': usar_online(),
+        'atualizacoes': classificador_online.atualizacoes
+    }
+    status_info['modo_ml'] = MODO_ML
+    
     if not status_info['modelos']['categoria']['carregado'] and not status_info['modelos']['subcategoria']['carregado']:
         status_info['status'] = 'warning'
         status_info['message'] = 'Modelos ML não carregados (apenas LLM disponível)'
@@ -1026,6 +1343,17 @@ def status():
     
     return jsonify(status_info)
 
+@app.route('/ready')
+def ready():
+    """
+    Prontidão para o balanceador de carga (diferente de /status): 200 só
+    depois que os modelos foram carregados e aquecidos, 503 enquanto o worker
+    está frio ou aquecendo e quando a inicialização falhou; inclui o tempo de
+    carga de cada artefato
+    """
+    pronto = prontidao['estado'] == 'quente'
+    return jsonify(dict(prontidao, pronto=pronto)), 200 if pronto else 503
+
 # ============================================
 # SISTEMA DE TREINAMENTO DE MODELOS
 # ============================================
@@ -1034,30 +1362,29 @@ def status():
 training_sessions = {}
 training_lock = threading.Lock()
 
-def executar_com_output(comando, progress_queue, session_id=None):
+def instalar_modelos(recursos):
     """
-    Executa comando e captura output linha por linha
+    Troca os modelos em uso pelos recém-treinados, sem reiniciar o servidor
+    
+    Os globais são substituídos em uma única atualização do dicionário do
+    módulo e as funções de classificação copiam as referências no início, então
+    cada classificação usa só os modelos antigos ou só os novos. Os modelos
+    novos são aquecidos antes da troca (se o aquecimento falhar, a exceção sobe
+    e os antigos continuam em uso), então o worker continua pronto.
     """
-    try:
-        process = subprocess.Popen(
-            comando,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1,
-            shell=True,
-            cwd=os.getcwd()
-        )
-        
-        for line in iter(process.stdout.readline, ''):
-            if line:
-                progress_queue.put(line.strip())
-        
-        process.wait()
-        return process.returncode
-    except Exception as e:
-        progress_queue.put(f"ERRO ao executar comando: {str(e)}")
-        return 1
+    aquecimento = aquecer_modelos(
+        recursos['categoria']['modelo'], recursos['subcategoria']['modelo'], recursos['pipeline']
+    )
+    globals().update({
+        'modelo_categoria': recursos['categoria']['modelo'],
+        'modelo_subcategoria': recursos['subcategoria']['modelo'],
+        'pipeline': recursos['pipeline'],
+    })
+    prontidao['aquecimento'] = aquecimento
+    # Worker que subiu sem modelos fica pronto com os recém-treinados
+    if prontidao['estado'] == 'falhou':
+        prontidao['estado'] = 'aquecendo'
+        concluir_prontidao()
 
 def executar_treinamento(session_id, arquivo_csv):
     """
@@ -1072,57 +1399,28 @@ def executar_treinamento(session_id, arquivo_csv):
         session['progress'].put(f"Arquivo: {arquivo_csv}")
         session['progress'].put("")
         
-        # Backup do expenses.csv original
+        # Backup das despesas atuais (exportado em CSV)
         expenses_backup = 'data/expenses_backup.csv'
-        if os.path.exists('data/expenses.csv'):
-            shutil.copy('data/expenses.csv', expenses_backup)
-            session['progress'].put("✓ Backup do expenses.csv criado")
+        if armazenamento.existem_despesas():
+            armazenamento.exportar_csv(expenses_backup)
+            session['progress'].put("✓ Backup das despesas criado")
         
-        # Copiar arquivo enviado para expenses.csv
-        shutil.copy(arquivo_csv, 'data/expenses.csv')
-        session['progress'].put("✓ Arquivo de treinamento copiado para data/expenses.csv")
+        # Importar arquivo enviado como base de despesas
+        armazenamento.importar_csv(arquivo_csv)
+        session['progress'].put(f"✓ Arquivo de treinamento importado para {armazenamento.caminho_despesas()}")
         session['progress'].put("")
         
-        # Treinar modelo de CATEGORIA
-        session['progress'].put("=" * 50)
-        session['progress'].put("TREINANDO MODELO DE CATEGORIAS")
-        session['progress'].put("=" * 50)
-        
-        comando_categoria = "python train_model_categoria.py"
-        returncode = executar_com_output(comando_categoria, session['progress'], session_id)
-        
-        if returncode == 0:
-            session['progress'].put("✓ Modelo de CATEGORIAS treinado com sucesso!")
-        else:
-            session['progress'].put("✗ Erro ao treinar modelo de CATEGORIAS")
-            session['status'] = 'error'
-            session['error'] = 'Erro ao treinar modelo de categorias'
-            return
-        
-        session['progress'].put("")
-        
-        # Treinar modelo de SUBCATEGORIA
-        session['progress'].put("=" * 50)
-        session['progress'].put("TREINANDO MODELO DE SUBCATEGORIAS")
-        session['progress'].put("=" * 50)
-        
-        comando_subcategoria = "python train_model_subcategoria.py"
-        returncode = executar_com_output(comando_subcategoria, session['progress'], session_id)
-        
-        if returncode == 0:
-            session['progress'].put("✓ Modelo de SUBCATEGORIAS treinado com sucesso!")
-        else:
-            session['progress'].put("✗ Erro ao treinar modelo de SUBCATEGORIAS")
-            session['status'] = 'error'
-            session['error'] = 'Erro ao treinar modelo de subcategorias'
-            return
+        # Treinar os dois modelos neste processo (dados lidos e vetorizados uma vez)
+        recursos = treinamento.treinar_modelos(progresso=session['progress'].put)
+        instalar_modelos(recursos)
         
         session['progress'].put("")
         session['progress'].put("=" * 50)
         session['progress'].put("✓ TREINAMENTO CONCLUÍDO COM SUCESSO!")
         session['progress'].put("=" * 50)
-        session['progress'].put("Os modelos foram salvos em data/saved_models/")
-        session['progress'].put("Recarregue a página para usar os novos modelos.")
+        session['progress'].put(f"Acurácia categoria: {recursos['categoria']['acuracia'] * 100:.2f}% | "
+                                f"subcategoria: {recursos['subcategoria']['acuracia'] * 100:.2f}%")
+        session['progress'].put("Os novos modelos já estão em uso.")
         
         # Restaurar backup se necessário
         if os.path.exists(expenses_backup):
@@ -1132,7 +1430,7 @@ def executar_treinamento(session_id, arquivo_csv):
         
         session['status'] = 'completed'
         session['completed_at'] = datetime.now().isoformat()
-        
+    
     except Exception as e:
         session['progress'].put(f"ERRO CRÍTICO: {str(e)}")
         session['status'] = 'error'
@@ -1140,8 +1438,37 @@ def executar_treinamento(session_id, arquivo_csv):
         
         # Restaurar backup se necessário
         if os.path.exists(expenses_backup):
-            shutil.copy(expenses_backup, 'data/expenses.csv')
-            session['progress'].put("✓ expenses.csv restaurado do backup")
+            armazenamento.importar_csv(expenses_backup)
+            session['progress'].put("✓ Despesas restauradas do backup")
+
+def executar_treinamento_incremental(session_id):
+    """
+    Ajusta os modelos atuais com as despesas novas/editadas (ou faz o
+    treinamento completo quando o incremental não se aplica)
+    """
+    session = training_sessions.get(session_id)
+    if not session:
+        return
+    
+    try:
+        session['progress'].put("=== INICIANDO TREINAMENTO INCREMENTAL ===")
+        recursos = treinamento.treinar_incremental(progresso=session['progress'].put)
+        
+        session['progress'].put("")
+        if recursos is None:
+            session['progress'].put("✓ Modelos já estão atualizados")
+        else:
+            instalar_modelos(recursos)
+            session['progress'].put("✓ TREINAMENTO CONCLUÍDO COM SUCESSO!")
+            session['progress'].put("Os novos modelos já estão em uso.")
+        
+        session['status'] = 'completed'
+        session['completed_at'] = datetime.now().isoformat()
+    
+    except Exception as e:
+        session['progress'].put(f"ERRO CRÍTICO: {str(e)}")
+        session['status'] = 'error'
+        session['error'] = str(e)
 
 @app.route('/train')
 def train_page():
@@ -1276,7 +1603,7 @@ def train_upload():
                     'status': 'error',
                     'message': 'Coluna "valor" deve conter apenas números'
                 }), 400
-            
+        
         except pd.errors.EmptyDataError:
             return jsonify({
                 'status': 'error',
@@ -1366,6 +1693,41 @@ def train_start(session_id):
         'session_id': session_id
     })
 
+@app.route('/api/train/incremental', methods=['POST'])
+def train_incremental():
+    """
+    Inicia o treinamento incremental com as despesas atuais
+    (progresso em /api/train/progress/<session_id>)
+    """
+    with training_lock:
+        if any(s['status'] == 'running' for s in training_sessions.values()):
+            return jsonify({
+                'status': 'error',
+                'message': 'Treinamento já está em execução'
+            }), 400
+        
+        session_id = str(uuid.uuid4())
+        session = {
+            'status': 'running',
+            'progress': queue.Queue(),
+            'arquivo': None,
+            'thread': None,
+            'started_at': datetime.now().isoformat(),
+            'completed_at': None,
+            'error': None
+        }
+        training_sessions[session_id] = session
+        
+        thread = threading.Thread(target=executar_treinamento_incremental, args=(session_id,), daemon=True)
+        thread.start()
+        session['thread'] = thread
+    
+    return jsonify({
+        'status': 'success',
+        'message': 'Treinamento incremental iniciado',
+        'session_id': session_id
+    })
+
 @app.route('/api/train/progress/<session_id>')
 def train_progress(session_id):
     """
@@ -1396,7 +1758,7 @@ def train_progress(session_id):
                     # Continuar esperando
                     yield f"data: {json.dumps({'heartbeat': True})}\n\n"
                     continue
-                    
+            
             except Exception as e:
                 yield f"data: {json.dumps({'error': str(e)})}\n\n"
                 break
@@ -1408,13 +1770,11 @@ def train_progress(session_id):
 
 def main():
     """Função principal"""
-    global modelo_categoria, modelo_subcategoria
-    
     print("=== SISTEMA DE GESTÃO FINANCEIRA ===\n")
     
-    # Carregar modelos e recursos
+    # Carregar e aquecer modelos e recursos (inclui o classificador online)
     print("Carregando modelos ML (categoria + subcategoria)...")
-    modelo_categoria, modelo_subcategoria = carregar_modelo_e_recursos()
+    inicializar()
     
     if modelo_categoria is None:
         print("⚠ Modelo de CATEGORIA não disponível")
@@ -1424,8 +1784,22 @@ def main():
         print("⚠ Modelo de SUBCATEGORIA não disponível")
         print("Execute 'python train_model_subcategoria.py' para treinar\n")
     
-    if modelo_categoria is None and modelo_subcategoria is None:
+    if usar_online():
+        print("✓ Estágio ML usando o classificador online (MODO_ML)\n")
+    elif modelo_categoria is None and modelo_subcategoria is None:
         print("⚠ Usando apenas LLM (sem modelos ML)\n")
+    if prontidao['estado'] == 'falhou':
+        print(f"⚠ /ready responde 503: {prontidao['erro']}\n")
+    
+    # Workers da fila de uploads (apenas no processo que atende as requisições,
+    # não no processo monitor do reloader)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        fila_uploads.iniciar_workers(processar_upload)
+        
+        # Classificações por linha de versões antigas dos modelos não servem mais
+        removidas = cache_classificacao.CacheLinhas(cache_classificacao.versao_classificacao()).limpar_versoes_antigas()
+        if removidas:
+            print(f"✓ Cache de classificação: {removidas} linha(s) de versões antigas removida(s)")
     
     # Iniciar servidor Flask
     print("\n" + "="*50)
@@ -1433,12 +1807,14 @@ def main():
     print("="*50)
     print("🌐 Acesse: http://localhost:5000")
     print("📊 Status: http://localhost:5000/status")
+    print("🚦 Prontidão: http://localhost:5000/ready")
     print("🔧 APIs disponíveis:")
     print("   - POST /api/classify/ml (Machine Learning)")
     print("   - POST /api/classify/llm (LLM)")
     print("   - POST /api/classify/hybrid (ML + LLM)")
     print("   - POST /api/expense (Adicionar despesa)")
     print("   - GET /api/expenses (Listar despesas)")
+    print("   - POST /api/upload-csv (Processar CSV em segundo plano)")
     print("\nPressione Ctrl+C para parar o servidor")
     print("="*50)
     
@@ -1446,4 +1822,7 @@ def main():
 
 if __name__ == "__main__":
     main()
+else:
+    # Servidor WSGI (ex.: gunicorn app:app): main() não roda
+    inicializar()
 
@@ -0,0 +1,301 @@
+"""
+Aprendizado Online
+==================
+Classificador leve que aprende a cada correção feita na interface, sem job
+de treinamento: naive Bayes multinomial sobre features de hashing.
+
+- HashingVectorizer não tem vocabulário para ajustar, então qualquer texto
+  novo já tem features
+- cada exemplo só soma contagens nas colunas (poucas) do próprio texto:
+  a atualização custa microssegundos e classes novas viram uma linha nova
+- as probabilidades são calculadas só nas colunas presentes no lote
+
+A subcategoria usa a categoria (uma das 7) como feature extra, como no modelo
+Keras. As correções chegam de api_add_expense e api_manage_expense (PUT); o
+estado é salvo em data/saved_models/online.joblib a cada SALVAR_A_CADA
+atualizações e, sem estado salvo, é montado a partir das despesas.
+
+No arquivo as contagens ficam esparsas (cada classe toca poucas colunas do
+hashing); a gravação acontece fora do lock das classificações.
+"""
+
+import os
+import threading
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+
+import rotulos
+
+CAMINHO_ESTADO = 'data/saved_models/online.joblib'
+
+N_FEATURES = 2 ** 16
+ALPHA = 0.1
+SALVAR_A_CADA = 50
+
+class NaiveBayesOnline:
+    """
+    Naive Bayes multinomial com contagens densas por classe (float32)
+    
+    Diferente do MultinomialNB do scikit-learn, aceita classes novas a
+    qualquer momento e não recalcula as log-probabilidades de todas as
+    features a cada partial_fit.
+    """
+    
+    def __init__(self, n_features=N_FEATURES, alpha=ALPHA):
+        self.n_features = n_features
+        self.alpha = alpha
+        self.classes_ = []
+        self._indice = {}
+        self.contagens = np.zeros((0, n_features), dtype=np.float32)
+        self.totais = np.zeros(0)
+        self.exemplos = np.zeros(0)
+    
+    def _linha(self, classe):
+        linha = self._indice.get(classe)
+        if linha is None:
+            linha = len(self.classes_)
+            self._indice[classe] = linha
+            self.classes_.append(classe)
+            if linha == len(self.contagens):
+                # Crescer com folga para não realocar a cada classe nova
+                capacidade = max(4, 2 * len(self.contagens))
+                contagens = np.zeros((capacidade, self.n_features), dtype=np.float32)
+                contagens[:linha] = self.contagens
+                self.contagens = contagens
+                self.totais = np.concatenate([self.totais, np.zeros(capacidade - linha)])
+                self.exemplos = np.concatenate([self.exemplos, np.zeros(capacidade - linha)])
+        return linha
+    
+    def partial_fit(self, X, y):
+        """
+        Soma os exemplos (X esparso CSR, y rótulos) às contagens
+        """
+        for i, classe in enumerate(y):
+            linha = self._linha(classe)
+            inicio, fim = X.indptr[i], X.indptr[i + 1]
+            self.contagens[linha, X.indices[inicio:fim]] += X.data[inicio:fim]
+            self.totais[linha] += X.data[inicio:fim].sum()
+            self.exemplos[linha] += 1
+        return self
+    
+    def fit_lote(self, X, y):
+        """
+        Mesmo que partial_fit, somando por classe (base inteira de uma vez)
+        """
+        y = np.asarray(y, dtype=object)
+        for classe in pd.unique(y):
+            linha = self._linha(classe)
+            selecao = X[y == classe]
+            self.contagens[linha] += np.asarray(selecao.sum(axis=0)).ravel()
+            self.totais[linha] += selecao.sum()
+            self.exemplos[linha] += selecao.shape[0]
+        return self
+    
+    def estado(self):
+        """
+        Cópia compacta do modelo para salvar (contagens em CSR, só as não nulas)
+        """
+        n = len(self.classes_)
+        return {
+            'n_features': self.n_features,
+            'alpha': self.alpha,
+            'classes': list(self.classes_),
+            'contagens': sparse.csr_matrix(self.contagens[:n]),
+            'totais': self.totais[:n].copy(),
+            'exemplos': self.exemplos[:n].copy(),
+        }
+    
+    @classmethod
+    def de_estado(cls, estado):
+        """
+        Modelo a partir de estado() (ou de um NaiveBayesOnline salvo inteiro,
+        formato antigo)
+        """
+        if isinstance(estado, cls):
+            return estado
+        modelo = cls(estado['n_features'], estado['alpha'])
+        modelo.classes_ = list(estado['classes'])
+        modelo._indice = {classe: i for i, classe in enumerate(modelo.classes_)}
+        modelo.contagens = estado['contagens'].toarray().astype(np.float32)
+        modelo.totais = np.asarray(estado['totais'], dtype=float)
+        modelo.exemplos = np.asarray(estado['exemplos'], dtype=float)
+        return modelo
+    
+    def predict_proba(self, X):
+        """
+        Probabilidades (linhas de X × classes_), usando só as colunas presentes em X
+        """
+        n = len(self.classes_)
+        colunas = np.unique(X.indices)
+        log_prob = np.log(self.contagens[:n, colunas] + self.alpha)
+        log_denominador = np.log(self.totais[:n] + self.alpha * self.n_features)
+        log_prior = np.log(self.exemplos[:n] / self.exemplos[:n].sum())
+        
+        X_colunas = X[:, colunas]
+        scores = (X_colunas @ log_prob.T
+                  - np.asarray(X_colunas.sum(axis=1)) * log_denominador
+                  + log_prior)
+        scores = np.asarray(scores)
+        scores -= scores.max(axis=1, keepdims=True)
+        prob = np.exp(scores)
+        return prob / prob.sum(axis=1, keepdims=True)
+
+def _token(prefixo, valor):
+    return f"{prefixo}_{str(valor).strip().lower().replace(' ', '_')}"
+
+def rotulo_categoria(categoria, tags):
+    """
+    Uma das 7 categorias (mesma regra de rotulos.rotular_categoria)
+    """
+    if categoria in rotulos.CATEGORIAS_VALIDAS:
+        return categoria
+    return rotulos.mapear_tags_para_categoria(tags)
+
+class ClassificadorOnline:
+    """
+    Categoria e subcategoria aprendidas online; seguro para várias threads
+    """
+    
+    def __init__(self, caminho=CAMINHO_ESTADO):
+        self.caminho = caminho
+        self.vetorizador = HashingVectorizer(
+            n_features=N_FEATURES, alternate_sign=False, norm=None, ngram_range=(1, 2)
+        )
+        self.categoria = NaiveBayesOnline()
+        self.subcategoria = NaiveBayesOnline()
+        self.atualizacoes = 0
+        self._pendentes = 0
+        self._lock = threading.Lock()
+        self._lock_gravacao = threading.Lock()
+    
+    @property
+    def disponivel(self):
+        return len(self.categoria.classes_) > 0
+    
+    def _textos_subcategoria(self, descricoes, categorias, tags):
+        tags = tags if tags is not None else [''] * len(descricoes)
+        return [
+            f"{descricao} {_token('cat', categoria)} {_token('tag', tag if isinstance(tag, str) else '')}"
+            for descricao, categoria, tag in zip(descricoes, categorias, tags)
+        ]
+    
+    def aprender(self, descricao, categoria, subcategoria=None, tags=''):
+        """
+        Atualiza com uma despesa corrigida/adicionada
+        """
+        categoria = rotulo_categoria(categoria, tags)
+        X_categoria = self.vetorizador.transform([str(descricao)])
+        subcategoria = str(subcategoria).strip() if subcategoria else ''
+        X_subcategoria = None
+        if subcategoria and subcategoria != 'DESCONHECIDO':
+            X_subcategoria = self.vetorizador.transform(self._textos_subcategoria([str(descricao)], [categoria], [tags]))
+        
+        with self._lock:
+            self.categoria.partial_fit(X_categoria, [categoria])
+            if X_subcategoria is not None:
+                self.subcategoria.partial_fit(X_subcategoria, [subcategoria])
+            self.atualizacoes += 1
+            self._pendentes += 1
+            salvar = self._pendentes >= SALVAR_A_CADA
+        if salvar:
+            self.salvar()
+    
+    def treinar_da_base(self, base):
+        """
+        Monta as contagens a partir de todas as despesas (mesmos rótulos dos
+        scripts de treinamento)
+        """
+        df_categoria = rotulos.rotular_categoria(base)
+        df_subcategoria = rotulos.rotular_subcategoria(base)
+        categorias = df_categoria['categoria'].astype(object)
+        
+        X_categoria = self.vetorizador.transform(df_categoria['descricao'].astype(str))
+        X_subcategoria = self.vetorizador.transform(self._textos_subcategoria(
+            df_subcategoria['descricao'].astype(str).tolist(),
+            categorias.loc[df_subcategoria.index].tolist(),
+            df_subcategoria['tags'].astype(object).tolist()
+        ))
+        
+        with self._lock:
+            self.categoria = NaiveBayesOnline().fit_lote(X_categoria, categorias.to_numpy())
+            self.subcategoria = NaiveBayesOnline().fit_lote(
+                X_subcategoria, df_subcategoria['subcategoria'].astype(object).to_numpy()
+            )
+        self.salvar()
+    
+    def classificar_lote(self, descricoes, tags=None):
+        """
+        Retorno: DataFrame com categoria, confianca, subcategoria e
+        confianca_subcategoria (formato de classificar_ml_lote) ou None sem dados
+        """
+        if not self.disponivel:
+            return None
+        
+        descricoes = [str(descricao) for descricao in descricoes]
+        with self._lock:
+            prob = self.categoria.predict_proba(self.vetorizador.transform(descricoes))
+        indices = np.argmax(prob, axis=1)
+        resultado = pd.DataFrame({
+            'categoria': [self.categoria.classes_[i] for i in indices],
+            'confianca': prob[np.arange(len(indices)), indices]
+        })
+        
+        resultado_sub = self.classificar_subcategoria_lote(descricoes, resultado['categoria'].tolist(), tags)
+        if resultado_sub is not None:
+            resultado['subcategoria'] = resultado_sub['subcategoria'].to_numpy()
+            resultado['confianca_subcategoria'] = resultado_sub['confianca'].to_numpy()
+        return resultado
+    
+    def classificar_subcategoria_lote(self, descricoes, categorias, tags=None):
+        """
+        Retorno: DataFrame com subcategoria, confianca ou None sem dados
+        """
+        if not self.subcategoria.classes_:
+            return None
+        
+        X = self.vetorizador.transform(self._textos_subcategoria([str(d) for d in descricoes], categorias, tags))
+        with self._lock:
+            prob = self.subcategoria.predict_proba(X)
+        indices = np.argmax(prob, axis=1)
+        return pd.DataFrame({
+            'subcategoria': [self.subcategoria.classes_[i] for i in indices],
+            'confianca': prob[np.arange(len(indices)), indices]
+        })
+    
+    def salvar(self):
+        """
+        Grava uma cópia esparsa do estado; só a cópia é feita com o lock, então
+        as classificações não esperam o disco
+        """
+        with self._lock:
+            estado = {
+                'categoria': self.categoria.estado(),
+                'subcategoria': self.subcategoria.estado(),
+                'atualizacoes': self.atualizacoes,
+            }
+            self._pendentes = 0
+        
+        with self._lock_gravacao:
+            os.makedirs(os.path.dirname(self.caminho), exist_ok=True)
+            temporario = f'{self.caminho}.tmp'
+            joblib.dump(estado, temporario)
+            os.replace(temporario, self.caminho)
+    
+    def carregar(self):
+        """
+        Lê o estado salvo; retorna False se não existir
+        """
+        if not os.path.exists(self.caminho):
+            return False
+        estado = joblib.load(self.caminho)
+        categoria = NaiveBayesOnline.de_estado(estado['categoria'])
+        subcategoria = NaiveBayesOnline.de_estado(estado['subcategoria'])
+        with self._lock:
+            self.categoria = categoria
+            self.subcategoria = subcategoria
+            self.atualizacoes = estado['atualizacoes']
+        return True
@@ -0,0 +1,423 @@
+"""
+Armazenamento das Despesas
+==========================
+Formato em disco das despesas (data/expenses.*), configurável pela variável
+FORMATO_ARMAZENAMENTO:
+
+- parquet (padrão): colunar, comprimido, leitura só das colunas pedidas
+- feather: Arrow IPC, leitura mais rápida, arquivos um pouco maiores
+- csv: o formato antigo (sem conversão)
+
+Nos formatos binários, categoria/subcategoria/tags são gravadas com
+dictionary encoding (cada valor distinto é armazenado uma vez).
+
+O CSV continua como formato de importação/exportação: se data/expenses.csv
+for mais recente que o arquivo principal (ex.: foi substituído por um CSV
+convertido ou enviado para treinamento), ele é importado na próxima leitura.
+
+Para leitura/análise, ler_despesas_tipadas devolve o DataFrame já tipado
+(categorias como category, data como datetime64[ns], valor compacto). Ele vem
+de um snapshot imutável em Arrow IPC (data/expenses.arrow), regenerado a cada
+gravação e trocado atomicamente (os.replace). Cada processo abre o snapshot
+com memory map somente leitura: as colunas numéricas e de data apontam para
+as páginas do arquivo, compartilhadas entre os workers. Texto (descricao) e
+as colunas category são copiados para estruturas do pandas em cada processo
+(nas category, só os códigos e os valores distintos; texto object ocupa a
+base inteira por worker).
+
+No Windows um arquivo mapeado não pode ser substituído, então lá o snapshot
+é lido para a memória (sem memory map) e o os.replace funciona mesmo com
+outros processos lendo.
+
+Gravações: todo read-modify-write acontece com um lock de arquivo (advisory,
+entre processos) em data/expenses.lock, e os arquivos são escritos em
+temporário e renomeados. As alterações passam por alterar_despesas, que as
+entrega a uma thread de escrita (group commit): as alterações que chegam
+enquanto uma gravação está em andamento são aplicadas juntas, com uma única
+leitura e uma única regravação do arquivo.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+FORMATOS = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'csv': '.csv',
+}
+FORMATO = os.getenv('FORMATO_ARMAZENAMENTO', 'parquet').lower()
+
+CAMINHO_DESPESAS_CSV = 'data/expenses.csv'
+CAMINHO_SNAPSHOT = 'data/expenses.arrow'
+CAMINHO_LOCK = 'data/expenses.lock'
+
+COLUNAS_DESPESAS = ['data', 'descricao', 'valor', 'tags', 'subcategoria', 'categoria']
+COLUNAS_CATEGORICAS = ['categoria', 'subcategoria', 'tags']
+
+# Maior erro aceito ao guardar valor em float32 (abaixo de meio centavo)
+TOLERANCIA_VALOR = 0.005
+
+# Snapshot aberto neste processo: {'chave': (inode, mtime_ns, tamanho), 'df': DataFrame}
+_cache_tipado = {}
+_lock_cache = threading.Lock()
+
+# Máximo de alterações aplicadas numa mesma gravação
+TAMANHO_MAXIMO_GRUPO = 256
+
+_fila_escrita = queue.Queue()
+_escritor = None
+_lock_escritor = threading.Lock()
+
+def _temporario(caminho):
+    """
+    Nome de arquivo temporário exclusivo do processo/thread que está gravando
+    """
+    return f'{caminho}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+def bloqueio_despesas():
+    """
+    Lock exclusivo entre processos para read-modify-write das despesas
+    
+    Não é reentrante: não chamar de dentro de outro bloqueio_despesas (nem de
+    uma alteração passada para alterar_despesas).
+    """
+    return bloqueio_arquivo(CAMINHO_LOCK)
+
+@contextmanager
+def bloqueio_arquivo(caminho):
+    """
+    Lock exclusivo entre processos (advisory) no arquivo caminho
+    """
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with open(caminho, 'a+') as arquivo:
+        if fcntl is not None:
+            fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX)
+        else:
+            arquivo.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(arquivo.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK desiste após ~10s; continuar esperando
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(arquivo.fileno(), fcntl.LOCK_UN)
+            else:
+                arquivo.seek(0)
+                msvcrt.locking(arquivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+def caminho_despesas(formato=None):
+    """
+    Caminho do arquivo principal das despesas no formato configurado
+    """
+    formato = formato or FORMATO
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de armazenamento desconhecido: {formato} (use {', '.join(FORMATOS)})")
+    return os.path.splitext(CAMINHO_DESPESAS_CSV)[0] + FORMATOS[formato]
+
+def ler_arquivo(caminho, colunas=None):
+    """
+    Lê um arquivo de dados pelo formato da extensão (.parquet, .feather ou .csv)
+    
+    Colunas dictionary-encoded voltam como texto, com o mesmo dtype da leitura do CSV.
+    """
+    extensao = os.path.splitext(caminho)[1]
+    if extensao == '.parquet':
+        df = pd.read_parquet(caminho, columns=colunas)
+    elif extensao == '.feather':
+        df = pd.read_feather(caminho, columns=colunas)
+    else:
+        return pd.read_csv(caminho, usecols=colunas)
+    
+    for coluna in df.columns:
+        if isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            df[coluna] = df[coluna].astype(df[coluna].cat.categories.dtype)
+    return df
+
+def gravar_arquivo(df, caminho):
+    """
+    Grava o DataFrame pelo formato da extensão (em arquivo temporário e renomeia)
+    """
+    extensao = os.path.splitext(caminho)[1]
+    temporario = _temporario(caminho)
+    
+    if extensao == '.csv':
+        df.to_csv(temporario, index=False)
+    else:
+        df = df.reset_index(drop=True)
+        for coluna in COLUNAS_CATEGORICAS:
+            if coluna in df.columns:
+                df[coluna] = df[coluna].astype('category')
+        if extensao == '.parquet':
+            df.to_parquet(temporario, index=False, compression='zstd')
+        else:
+            df.to_feather(temporario, compression='zstd')
+    
+    os.replace(temporario, caminho)
+
+def _csv_mais_recente(caminho):
+    """
+    True se data/expenses.csv deve ser importado para o arquivo principal
+    """
+    if caminho == CAMINHO_DESPESAS_CSV or not os.path.exists(CAMINHO_DESPESAS_CSV):
+        return False
+    if not os.path.exists(caminho):
+        return True
+    return os.path.getmtime(CAMINHO_DESPESAS_CSV) > os.path.getmtime(caminho)
+
+def existem_despesas():
+    """
+    True se há despesas salvas (no arquivo principal ou em data/expenses.csv)
+    """
+    return os.path.exists(caminho_despesas()) or os.path.exists(CAMINHO_DESPESAS_CSV)
+
+def ler_despesas(colunas=None):
+    """
+    Carrega as despesas do arquivo principal
+    
+    - colunas: lista de colunas a ler (None = todas)
+    """
+    caminho = caminho_despesas()
+    _importar_csv_mais_recente(caminho)
+    return ler_arquivo(caminho, colunas)
+
+def valor_compacto(valores):
+    """
+    Valores em float32 quando isso não altera nenhum centavo; senão float64
+    """
+    valores = pd.to_numeric(valores, errors='coerce').astype('float64')
+    compactos = valores.astype('float32')
+    erro = np.abs(compactos.to_numpy(dtype='float64') - valores.to_numpy())
+    if np.nanmax(erro, initial=0.0) < TOLERANCIA_VALOR:
+        return compactos
+    return valores
+
+def tipar_despesas(df):
+    """
+    Aplica o schema tipado às despesas
+    
+    - categoria, subcategoria, tags: category
+    - data: datetime64[ns] (datas inválidas viram NaT)
+    - valor: valor_compacto
+    """
+    df = df.copy()
+    for coluna in COLUNAS_CATEGORICAS:
+        if coluna in df.columns:
+            df[coluna] = df[coluna].astype('category')
+    if 'data' in df.columns:
+        df['data'] = pd.to_datetime(df['data'], errors='coerce').astype('datetime64[ns]')
+    if 'valor' in df.columns:
+        df['valor'] = valor_compacto(df['valor'])
+    return df
+
+def gerar_snapshot(df=None):
+    """
+    Gera o snapshot tipado (Arrow IPC sem compressão, para memory map) e o
+    troca atomicamente pelo anterior
+    
+    Processos que já mapearam o snapshot antigo continuam lendo o arquivo
+    antigo (o inode continua válido) até abrirem o novo.
+    
+    - df: despesas já carregadas (None = ler do arquivo principal)
+    """
+    if df is None:
+        df = ler_arquivo(caminho_despesas())
+    tabela = pa.Table.from_pandas(tipar_despesas(df), preserve_index=False)
+    
+    temporario = _temporario(CAMINHO_SNAPSHOT)
+    with pa.OSFile(temporario, 'wb') as destino:
+        with pa.ipc.new_file(destino, tabela.schema) as writer:
+            writer.write_table(tabela)
+    os.replace(temporario, CAMINHO_SNAPSHOT)
+
+def _snapshot_atualizado(caminho):
+    """
+    True se o snapshot existe e não é mais antigo que o arquivo principal
+    """
+    if not os.path.exists(CAMINHO_SNAPSHOT):
+        return False
+    return os.path.getmtime(CAMINHO_SNAPSHOT) >= os.path.getmtime(caminho)
+
+def ler_despesas_tipadas(colunas=None):
+    """
+    Despesas com o schema tipado (tipar_despesas), lidas do snapshot mapeado
+    em memória (colunas numéricas e de data sem cópia)
+    
+    O snapshot é reaberto só quando é trocado; as chamadas seguintes
+    reaproveitam o mesmo DataFrame. O retorno compartilha os dados com o
+    snapshot: substituir colunas é seguro, alterar valores no lugar
+    (ex.: df.at[...] = ...) não.
+    
+    - colunas: lista de colunas (None = todas)
+    """
+    caminho = caminho_despesas()
+    _importar_csv_mais_recente(caminho)
+    if not _snapshot_atualizado(caminho):
+        with bloqueio_despesas():
+            if not _snapshot_atualizado(caminho):
+                gerar_snapshot()
+    
+    info = os.stat(CAMINHO_SNAPSHOT)
+    chave = (info.st_ino, info.st_mtime_ns, info.st_size)
+    with _lock_cache:
+        if _cache_tipado.get('chave') != chave:
+            if fcntl is not None:
+                # Colunas numéricas sem cópia: os buffers do Arrow apontam para o arquivo mapeado
+                with pa.memory_map(CAMINHO_SNAPSHOT, 'r') as origem:
+                    tabela = pa.ipc.open_file(origem).read_all()
+            else:
+                # Windows: o mapeamento impediria o os.replace do próximo snapshot
+                with pa.OSFile(CAMINHO_SNAPSHOT, 'rb') as origem:
+                    tabela = pa.ipc.open_file(origem).read_all()
+            _cache_tipado['df'] = tabela.to_pandas(split_blocks=True)
+            _cache_tipado['chave'] = chave
+        df = _cache_tipado['df']
+    
+    if colunas is not None:
+        return df[colunas]
+    return df.copy(deep=False)
+
+def _gravar(df):
+    """
+    Grava o arquivo principal e o snapshot (chamar com bloqueio_despesas)
+    """
+    gravar_arquivo(df, caminho_despesas())
+    gerar_snapshot(df)
+
+def _importar_csv_mais_recente(caminho):
+    """
+    Importa data/expenses.csv se ele for mais recente que o arquivo principal
+    """
+    if not _csv_mais_recente(caminho):
+        return
+    with bloqueio_despesas():
+        # Outro processo pode ter importado enquanto esperávamos o lock
+        if _csv_mais_recente(caminho):
+            _gravar(pd.read_csv(CAMINHO_DESPESAS_CSV))
+
+def _ler_para_escrita():
+    """
+    Estado atual das despesas para aplicar alterações (chamar com bloqueio_despesas)
+    """
+    caminho = caminho_despesas()
+    if _csv_mais_recente(caminho):
+        return pd.read_csv(CAMINHO_DESPESAS_CSV)
+    if os.path.exists(caminho):
+        return ler_arquivo(caminho)
+    return pd.DataFrame(columns=COLUNAS_DESPESAS)
+
+def _aplicar_grupo(grupo):
+    """
+    Aplica um grupo de alterações com uma leitura e uma gravação
+    
+    Cada alteração é isolada: se uma levanta exceção, só ela falha e as
+    demais seguem sobre o último estado válido.
+    """
+    resultados = []
+    with bloqueio_despesas():
+        df = _ler_para_escrita()
+        alterado = False
+        for alteracao, futuro in grupo:
+            try:
+                novo, resultado = alteracao(df)
+            except Exception as e:
+                resultados.append((futuro, e, None))
+                continue
+            if novo is not None:
+                df = novo
+                alterado = True
+            resultados.append((futuro, None, resultado))
+        
+        if alterado:
+            _gravar(df)
+    
+    for futuro, erro, resultado in resultados:
+        if erro is not None:
+            futuro.set_exception(erro)
+        else:
+            futuro.set_result(resultado)
+
+def _loop_escritor():
+    """
+    Thread de escrita: espera uma alteração e leva junto todas as que já
+    estiverem na fila
+    """
+    while True:
+        grupo = [_fila_escrita.get()]
+        while len(grupo) < TAMANHO_MAXIMO_GRUPO:
+            try:
+                grupo.append(_fila_escrita.get_nowait())
+            except queue.Empty:
+                break
+        
+        try:
+            _aplicar_grupo(grupo)
+        except Exception as e:
+            # Falha na leitura/gravação: o grupo inteiro falha
+            for _, futuro in grupo:
+                if not futuro.done():
+                    futuro.set_exception(e)
+
+def alterar_despesas(alteracao):
+    """
+    Aplica uma alteração às despesas e espera a gravação
+    
+    alteracao(df) -> (novo_df ou None se não alterou, resultado) roda na thread
+    de escrita, com o lock de arquivo, sobre o estado mais recente. Não deve
+    modificar df no lugar (use df.copy() antes de df.at[...]). Exceções
+    levantadas por ela são repassadas a quem chamou.
+    
+    Retorno: o resultado devolvido pela alteração
+    """
+    global _escritor
+    
+    with _lock_escritor:
+        if _escritor is None:
+            _escritor = threading.Thread(target=_loop_escritor, name='escritor-despesas', daemon=True)
+            _escritor.start()
+    
+    futuro = Future()
+    _fila_escrita.put((alteracao, futuro))
+    return futuro.result()
+
+def salvar_despesas(df):
+    """
+    Substitui as despesas pelo DataFrame (colunas na ordem padrão)
+    """
+    df = df[COLUNAS_DESPESAS]
+    alterar_despesas(lambda atual: (df, None))
+
+def importar_csv(caminho_csv):
+    """
+    Importa um CSV de despesas para o arquivo principal
+    """
+    df = pd.read_csv(caminho_csv)
+    alterar_despesas(lambda atual: (df, None))
+    return df
+
+def exportar_csv(caminho_csv, df=None):
+    """
+    Exporta as despesas (ou o DataFrame informado) para CSV
+    """
+    if df is None:
+        df = ler_despesas()
+    df.to_csv(caminho_csv, index=False)
+    return caminho_csv
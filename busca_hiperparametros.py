@@ -0,0 +1,299 @@
+"""
+Busca de Hiperparâmetros
+========================
+Avalia configurações dos modelos de categoria/subcategoria com validação
+cruzada (k-fold estratificado), em paralelo em um pool de processos.
+
+- espaço de busca: max_features do TF-IDF, larguras das camadas, dropout e
+  tamanho do lote
+- as features de cada fold (TF-IDF, encoders e normalizador ajustados só no
+  treino do fold) são calculadas uma vez por max_features e gravadas no
+  cache de treinamento (cache_treinamento.py); todos os trials com o mesmo
+  max_features, e as próximas buscas com os mesmos dados, reaproveitam
+- o early stopping de cada fold usa uma fatia das linhas de treino do fold
+  (a mesma para todos os trials), nunca o fold de validação em que a
+  acurácia é medida
+- leaderboard com acurácia média (e desvio), tamanho do modelo e latência de
+  inferência medida (1 despesa e por despesa em lote), para escolher o
+  modelo mais rápido que atinge a acurácia mínima
+
+Uso:
+    python busca_hiperparametros.py --modelo categoria --folds 5 --trials 20 --workers 4
+"""
+
+import argparse
+import itertools
+import os
+import random
+import time
+from concurrent.futures import as_completed
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.model_selection import StratifiedKFold
+from sklearn.preprocessing import LabelEncoder, OneHotEncoder, StandardScaler
+from tensorflow.keras.layers import Dense, Dropout
+from tensorflow.keras.models import Sequential
+
+import armazenamento
+import cache_treinamento
+import classificacao_lote
+import loop_treinamento
+import pipeline_features
+import train_model_categoria
+import train_model_subcategoria
+
+DIRETORIO_BUSCA = 'data/busca_hiperparametros'
+
+ESPACO = {
+    'max_features': [50, 100, 200],
+    'camadas': [(32,), (64, 32), (128, 64, 32)],
+    'dropout': [0.2, 0.3],
+    'lote': [16, 64, 256],
+}
+
+MODULOS = {
+    'categoria': train_model_categoria,
+    'subcategoria': train_model_subcategoria,
+}
+
+# Repetições na medição de latência
+REPETICOES_LATENCIA = 20
+TAMANHO_LOTE_LATENCIA = 1024
+
+def criar_mlp(input_dim, num_classes, camadas, dropout):
+    """
+    MLP com as larguras de camadas dadas (mesma forma dos modelos dos scripts)
+    """
+    modelo = Sequential()
+    for i, largura in enumerate(camadas):
+        if i == 0:
+            modelo.add(Dense(largura, activation='relu', input_dim=input_dim))
+        else:
+            modelo.add(Dense(largura, activation='relu'))
+        modelo.add(Dropout(dropout))
+    modelo.add(Dense(num_classes, activation='softmax'))
+    return modelo
+
+def carregar_dados(nome_modelo):
+    """
+    Despesas com os rótulos do modelo; descarta classes com menos exemplos
+    que o número de folds só na hora de dividir
+    
+    Retorno: (DataFrame, coluna do rótulo)
+    """
+    base = armazenamento.ler_despesas_tipadas().reset_index(drop=True)
+    df = MODULOS[nome_modelo].carregar_dados(base).reset_index(drop=True)
+    return df, nome_modelo
+
+def gerar_trials(quantidade, semente=42):
+    """
+    Combinações do espaço de busca (todas, ou uma amostra de `quantidade`)
+    """
+    combinacoes = [dict(zip(ESPACO, valores)) for valores in itertools.product(*ESPACO.values())]
+    if quantidade and quantidade < len(combinacoes):
+        combinacoes = random.Random(semente).sample(combinacoes, quantidade)
+    return combinacoes
+
+def _features_fold(nome_modelo, df, treino, validacao, max_features):
+    """
+    Ajusta os transformadores no treino do fold e monta as matrizes normalizadas
+    """
+    tfidf = TfidfVectorizer(max_features=max_features, stop_words=None).fit(df['descricao'].iloc[treino])
+    texto = tfidf.transform(df['descricao'])
+    
+    if nome_modelo == 'categoria':
+        X = texto.toarray()
+    else:
+        treino_df = df.iloc[treino]
+        tags = pipeline_features.normalizar_tags(df['tags'], len(df))
+        categoria_encoder = LabelEncoder().fit(treino_df['categoria'])
+        tags_encoder = LabelEncoder().fit(tags.iloc[treino])
+        pipeline = pipeline_features.PipelineFeatures(
+            tfidf_subcategoria=tfidf,
+            categoria_encoder=categoria_encoder,
+            categoria_onehot=OneHotEncoder(sparse_output=False).fit(
+                np.arange(len(categoria_encoder.classes_)).reshape(-1, 1)),
+            tags_encoder=tags_encoder,
+            tags_onehot=OneHotEncoder(sparse_output=False).fit(
+                np.arange(len(tags_encoder.classes_)).reshape(-1, 1)),
+        )
+        X = pipeline_features.matriz_subcategoria(
+            pipeline, df['descricao'], df['valor'], df['categoria'], tags, texto
+        )
+    
+    scaler = StandardScaler().fit(X[treino])
+    return scaler.transform(X[treino]), scaler.transform(X[validacao])
+
+def preparar_folds(nome_modelo, df, rotulo, folds, valores_max_features, progresso=print):
+    """
+    Features de todos os folds para cada max_features, no cache de
+    treinamento (reaproveitadas de buscas anteriores com os mesmos dados)
+    
+    Cada fold: (X_ajuste, X_parada, X_validacao, y_ajuste, y_parada, y_validacao)
+    
+    Retorno: ({max_features: chave no cache}, número de classes)
+    """
+    contagens = df[rotulo].astype(object).value_counts()
+    df = df[df[rotulo].astype(object).isin(contagens[contagens >= folds].index)].reset_index(drop=True)
+    if len(contagens) > df[rotulo].nunique():
+        progresso(f"   {len(contagens) - df[rotulo].nunique()} classe(s) com menos de {folds} exemplos ignoradas")
+    
+    label_encoder = LabelEncoder().fit(df[rotulo].astype(object))
+    y = label_encoder.transform(df[rotulo].astype(object))
+    divisao = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=42).split(np.zeros(len(y)), y))
+    
+    chaves = {}
+    for max_features in valores_max_features:
+        def calcular():
+            resultado = []
+            for treino, validacao in divisao:
+                X_treino, X_validacao = _features_fold(nome_modelo, df, treino, validacao, max_features)
+                X_ajuste, X_parada, y_ajuste, y_parada = loop_treinamento.separar_validacao(X_treino, y[treino])
+                resultado.append((X_ajuste, X_parada, X_validacao, y_ajuste, y_parada, y[validacao]))
+            return {'folds': resultado}
+        
+        _, chaves[max_features] = cache_treinamento.obter(
+            f'busca_{nome_modelo}', df[['descricao', 'valor', 'categoria', 'tags', rotulo]],
+            {'folds': folds, 'max_features': max_features}, calcular, progresso
+        )
+        progresso(f"   Features de {folds} folds prontas para max_features={max_features}")
+    return chaves, len(label_encoder.classes_)
+
+def _medir_latencia(modelo, X):
+    """
+    Latência mediana (ms) de uma despesa e (µs) por despesa em lote
+    """
+    uma = X[:1]
+    modelo.predict(uma, verbose=0)
+    tempos = []
+    for _ in range(REPETICOES_LATENCIA):
+        inicio = time.perf_counter()
+        modelo.predict(uma, verbose=0)
+        tempos.append(time.perf_counter() - inicio)
+    
+    lote = np.resize(X, (TAMANHO_LOTE_LATENCIA, X.shape[1]))
+    inicio = time.perf_counter()
+    modelo.predict(lote, batch_size=TAMANHO_LOTE_LATENCIA, verbose=0)
+    por_linha = (time.perf_counter() - inicio) / TAMANHO_LOTE_LATENCIA
+    return float(np.median(tempos) * 1000), por_linha * 1e6
+
+def avaliar_trial(trial, chave_folds, num_classes, epocas_maximas):
+    """
+    Treina e avalia um trial em todos os folds (roda em um processo worker)
+    
+    Os callbacks monitoram a fatia de parada; a acurácia é medida no fold de
+    validação, que o treino não vê.
+    """
+    acuracias = []
+    epocas = []
+    for X_treino, X_parada, X_validacao, y_treino, y_parada, y_validacao in cache_treinamento.carregar(chave_folds)['folds']:
+        modelo = criar_mlp(X_treino.shape[1], num_classes, trial['camadas'], trial['dropout'])
+        modelo.compile(optimizer='adam', loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+        _, relatorio = loop_treinamento.treinar(
+            modelo, X_treino, y_treino,
+            epocas_maximas=epocas_maximas,
+            lote_minimo=trial['lote'],
+            lote_maximo=trial['lote'],
+            verbose=0,
+            validacao=(X_parada, y_parada)
+        )
+        epocas.append(relatorio['epocas'])
+        predicoes = np.argmax(modelo.predict(X_validacao, verbose=0), axis=1)
+        acuracias.append(float(np.mean(predicoes == y_validacao)))
+    
+    latencia_ms, latencia_lote_us = _medir_latencia(modelo, X_validacao)
+    parametros = int(modelo.count_params())
+    return {
+        'max_features': trial['max_features'],
+        'camadas': '-'.join(map(str, trial['camadas'])),
+        'dropout': trial['dropout'],
+        'lote': trial['lote'],
+        'acuracia': float(np.mean(acuracias)),
+        'desvio': float(np.std(acuracias)),
+        'epocas_media': float(np.mean(epocas)),
+        'parametros': parametros,
+        'tamanho_kb': parametros * 4 / 1024,
+        'latencia_ms': latencia_ms,
+        'latencia_lote_us': latencia_lote_us,
+    }
+
+def buscar(nome_modelo, folds=5, trials=20, workers=None, epocas_maximas=None, progresso=print):
+    """
+    Executa a busca e retorna o leaderboard (DataFrame ordenado por acurácia)
+    """
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    epocas_maximas = epocas_maximas or MODULOS[nome_modelo].EPOCAS
+    
+    progresso(f"1. Carregando dados ({nome_modelo})...")
+    df, rotulo = carregar_dados(nome_modelo)
+    
+    combinacoes = gerar_trials(trials)
+    progresso(f"2. Preparando features dos folds ({len(combinacoes)} trials, {folds} folds)...")
+    chaves, num_classes = preparar_folds(
+        nome_modelo, df, rotulo, folds, sorted({trial['max_features'] for trial in combinacoes}), progresso
+    )
+    
+    progresso(f"3. Avaliando trials em {workers} processo(s)...")
+    resultados = []
+    with classificacao_lote.pool_workers(workers) as executor:
+        futuros = [
+            executor.submit(avaliar_trial, trial, chaves[trial['max_features']], num_classes, epocas_maximas)
+            for trial in combinacoes
+        ]
+        for numero, futuro in enumerate(as_completed(futuros), 1):
+            resultado = futuro.result()
+            resultados.append(resultado)
+            progresso(f"   [{numero}/{len(futuros)}] mf={resultado['max_features']} camadas={resultado['camadas']} "
+                      f"dropout={resultado['dropout']} lote={resultado['lote']} → "
+                      f"acurácia {resultado['acuracia']:.4f} ± {resultado['desvio']:.4f}")
+    
+    return pd.DataFrame(resultados).sort_values(
+        ['acuracia', 'latencia_ms'], ascending=[False, True]
+    ).reset_index(drop=True)
+
+def recomendar(leaderboard, acuracia_minima):
+    """
+    Trial mais rápido (latência de uma despesa) com acurácia >= acuracia_minima, ou None
+    """
+    aprovados = leaderboard[leaderboard['acuracia'] >= acuracia_minima]
+    if aprovados.empty:
+        return None
+    return aprovados.sort_values(['latencia_ms', 'tamanho_kb']).iloc[0]
+
+def main():
+    parser = argparse.ArgumentParser(description='Busca de hiperparâmetros com validação cruzada')
+    parser.add_argument('--modelo', choices=list(MODULOS), default='categoria')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--trials', type=int, default=20,
+                        help='trials sorteados do espaço de busca (0 = todas as combinações)')
+    parser.add_argument('--workers', type=int, default=None, help='processos (padrão: núcleos - 1)')
+    parser.add_argument('--epocas', type=int, default=None, help='máximo de épocas por fold')
+    parser.add_argument('--acuracia-minima', type=float, default=None,
+                        help='recomenda o modelo mais rápido com pelo menos essa acurácia')
+    args = parser.parse_args()
+    
+    print(f"=== BUSCA DE HIPERPARÂMETROS ({args.modelo.upper()}) ===\n")
+    leaderboard = buscar(args.modelo, args.folds, args.trials, args.workers, args.epocas)
+    
+    os.makedirs(DIRETORIO_BUSCA, exist_ok=True)
+    caminho = os.path.join(DIRETORIO_BUSCA, f'leaderboard_{args.modelo}.csv')
+    leaderboard.to_csv(caminho, index=False)
+    
+    print("\n=== LEADERBOARD ===")
+    print(leaderboard.to_string(index=False, float_format=lambda valor: f'{valor:.4f}'))
+    print(f"\n📁 Leaderboard salvo em {caminho}")
+    
+    if args.acuracia_minima is not None:
+        escolhido = recomendar(leaderboard, args.acuracia_minima)
+        if escolhido is None:
+            print(f"\n⚠ Nenhum trial atingiu acurácia {args.acuracia_minima:.4f}")
+        else:
+            print(f"\n💡 Mais rápido com acurácia >= {args.acuracia_minima:.4f}: "
+                  f"max_features={escolhido['max_features']} camadas={escolhido['camadas']} "
+                  f"dropout={escolhido['dropout']} lote={escolhido['lote']} "
+                  f"({escolhido['acuracia']:.4f}, {escolhido['latencia_ms']:.2f} ms, {escolhido['tamanho_kb']:.0f} KB)")
+
+if __name__ == "__main__":
+    main()
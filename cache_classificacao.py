@@ -0,0 +1,196 @@
+"""
+Cache de Classificação
+======================
+Reaproveita classificações já feitas:
+
+- por upload: o hash do conteúdo do arquivo + versão da classificação aponta
+  para o upload que já foi (ou está sendo) processado com esse conteúdo
+- por linha: cada chave de deduplicação (descrição, valor, tags) já
+  classificada fica em um SQLite, então extratos que se sobrepõem só
+  classificam as linhas novas
+
+A versão da classificação muda quando os modelos salvos, o código de
+classificação/providers, os providers configurados ou o modo do estágio ML
+mudam; entradas de outra versão nunca são reaproveitadas.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+from classificacao_lote import COLUNAS_RESULTADO as COLUNAS
+
+DIRETORIO_CACHE = 'data/uploads/cache'
+CAMINHO_CACHE_LINHAS = os.path.join(DIRETORIO_CACHE, 'linhas.sqlite')
+
+# Artefatos e código que definem o resultado da classificação
+ARTEFATOS_MODELO = 'data/saved_models/*'
+# Estado do classificador online (regravado a cada poucas correções): só
+# conta na versão quando é ele que classifica
+ESTADO_ONLINE = 'data/saved_models/online.joblib'
+MODELO_CATEGORIA = 'data/saved_models/category_model.h5'
+ARQUIVOS_CLASSIFICACAO = ['classificacao_lote.py', 'pipeline_features.py', 'quantizacao.py', 'llm_classifier.py', 'llm_fallback.py', 'providers/*.py']
+VARIAVEIS_PROVIDERS = ['OPENAI_API_KEY', 'ANTHROPIC_API_KEY', 'GOOGLE_API_KEY', 'GROQ_API_KEY', 'XAI_API_KEY']
+
+# Máximo de parâmetros por consulta (limite antigo do SQLite é 999)
+TAMANHO_CONSULTA = 500
+
+def versao_classificacao():
+    """
+    Identificador da versão atual da classificação
+    
+    Hash de: artefatos dos modelos (nome, tamanho, data de modificação),
+    conteúdo do código de classificação/providers, quais chaves de API estão
+    configuradas (só os nomes, nunca os valores), MODO_ML e MODELO_QUANTIZADO.
+    """
+    h = hashlib.sha256()
+    
+    # Mesma regra de app.usar_online: 'auto' cai no online sem modelo Keras
+    modo_ml = os.getenv('MODO_ML', 'keras').lower()
+    h.update(modo_ml.encode())
+    usa_online = modo_ml == 'online' or (modo_ml == 'auto' and not os.path.exists(MODELO_CATEGORIA))
+    
+    for caminho in sorted(glob.glob(ARTEFATOS_MODELO)):
+        if os.path.normpath(caminho) == os.path.normpath(ESTADO_ONLINE) and not usa_online:
+            continue
+        info = os.stat(caminho)
+        h.update(f'{os.path.basename(caminho)}:{info.st_size}:{info.st_mtime_ns}\n'.encode())
+    
+    for padrao in ARQUIVOS_CLASSIFICACAO:
+        for caminho in sorted(glob.glob(padrao)):
+            with open(caminho, 'rb') as f:
+                h.update(caminho.encode() + b'\n' + f.read())
+    
+    configuradas = [nome for nome in VARIAVEIS_PROVIDERS if os.getenv(nome)]
+    h.update(','.join(configuradas).encode())
+    
+    # Pesos quantizados mudam (pouco) as predições do estágio ML
+    h.update(os.getenv('MODELO_QUANTIZADO', '').lower().encode())
+    
+    return h.hexdigest()[:16]
+
+def hash_arquivo(caminho, tamanho_bloco=1 << 20):
+    """
+    SHA-256 do conteúdo do arquivo
+    """
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+def chave_upload(sha256_conteudo, versao):
+    """
+    Chave do cache de uploads: conteúdo + versão da classificação
+    """
+    return hashlib.sha256(f'{sha256_conteudo}:{versao}'.encode()).hexdigest()
+
+def _caminho_indice(chave):
+    return os.path.join(DIRETORIO_CACHE, f'upload_{chave}.json')
+
+def buscar_upload(chave):
+    """
+    file_id do upload registrado com essa chave (ou None)
+    """
+    try:
+        with open(_caminho_indice(chave), 'r') as f:
+            return json.load(f)['file_id']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def registrar_upload(chave, file_id):
+    """
+    Registra o upload como resultado da chave (escreve em temporário e renomeia)
+    """
+    os.makedirs(DIRETORIO_CACHE, exist_ok=True)
+    caminho = _caminho_indice(chave)
+    temporario = f'{caminho}.tmp'
+    with open(temporario, 'w') as f:
+        json.dump({'file_id': file_id}, f)
+    os.replace(temporario, caminho)
+
+def remover_upload(chave):
+    """
+    Remove a chave do índice (ex.: o upload registrado falhou)
+    """
+    try:
+        os.remove(_caminho_indice(chave))
+    except OSError:
+        pass
+
+class CacheLinhas:
+    """
+    Cache por linha das classificações, em SQLite, para uma versão da classificação
+    
+    Guarda só o caminho e a versão (cada operação abre a própria conexão), então
+    pode ser usado por várias threads e enviado para processos workers.
+    """
+    
+    def __init__(self, versao, caminho=CAMINHO_CACHE_LINHAS):
+        self.versao = versao
+        self.caminho = caminho
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with closing(self._conectar()) as conexao, conexao:
+            conexao.execute(
+                'CREATE TABLE IF NOT EXISTS linhas ('
+                'versao TEXT, chave TEXT, '
+                + ', '.join(f'{coluna} {"REAL" if coluna.startswith("Confianca") else "TEXT"}' for coluna in COLUNAS)
+                + ', PRIMARY KEY (versao, chave))'
+            )
+    
+    def _conectar(self):
+        conexao = sqlite3.connect(self.caminho, timeout=30)
+        conexao.execute('PRAGMA journal_mode=WAL')
+        return conexao
+    
+    def buscar(self, chaves):
+        """
+        Classificações em cache para as chaves
+        
+        Retorno: DataFrame indexado pela chave (só as encontradas) com COLUNAS
+        """
+        chaves = list(chaves)
+        partes = []
+        with closing(self._conectar()) as conexao, conexao:
+            for inicio in range(0, len(chaves), TAMANHO_CONSULTA):
+                lote = chaves[inicio:inicio + TAMANHO_CONSULTA]
+                partes.append(pd.read_sql_query(
+                    f'SELECT chave, {", ".join(COLUNAS)} FROM linhas '
+                    f'WHERE versao = ? AND chave IN ({", ".join("?" * len(lote))})',
+                    conexao, params=[self.versao] + lote
+                ))
+        
+        if not partes:
+            return pd.DataFrame(columns=COLUNAS)
+        return pd.concat(partes, ignore_index=True).set_index('chave')
+    
+    def gravar(self, chaves, resultado):
+        """
+        Grava as classificações (uma linha de resultado por chave)
+        """
+        if len(chaves) == 0:
+            return
+        registros = zip(
+            [self.versao] * len(chaves),
+            list(chaves),
+            *(resultado[coluna].tolist() for coluna in COLUNAS)
+        )
+        with closing(self._conectar()) as conexao, conexao:
+            conexao.executemany(
+                f'INSERT OR REPLACE INTO linhas VALUES ({", ".join("?" * (len(COLUNAS) + 2))})',
+                registros
+            )
+    
+    def limpar_versoes_antigas(self):
+        """
+        Remove entradas de outras versões da classificação
+        
+        Retorno: quantidade de linhas removidas
+        """
+        with closing(self._conectar()) as conexao, conexao:
+            return conexao.execute('DELETE FROM linhas WHERE versao != ?', (self.versao,)).rowcount
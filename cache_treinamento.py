@@ -0,0 +1,141 @@
+"""
+Cache de Dados de Treinamento
+=============================
+Guarda em disco o resultado da preparação dos dados de treinamento (rótulos
+mapeados, TF-IDF e demais transformadores ajustados, matrizes de treino/teste
+já normalizadas), para que treinos repetidos, trials da busca de
+hiperparâmetros e avaliações não refaçam o pré-processamento.
+
+A chave é o hash de:
+- nome da preparação (ex.: 'categoria', 'treinamento', 'busca')
+- conteúdo dos dados de entrada (hash por linha das despesas, com índice)
+- configuração das features (ex.: max_features, fold)
+- código que define as features (ARQUIVOS_FEATURES)
+
+Cada entrada é um .joblib sem compressão (arrays abertos com memory-map);
+são mantidas as MAXIMO_ENTRADAS usadas mais recentemente.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+import joblib
+import pandas as pd
+
+import pipeline_features
+
+DIRETORIO_CACHE = 'data/cache_treinamento'
+
+# Código que define os rótulos e as features (mudou, o cache não vale mais)
+ARQUIVOS_FEATURES = [
+    'rotulos.py', 'pipeline_features.py', 'train_model_categoria.py', 'train_model_subcategoria.py',
+    'treinamento.py', 'busca_hiperparametros.py',
+]
+
+MAXIMO_ENTRADAS = 20
+
+def impressao_dados(df):
+    """
+    Hash do conteúdo do DataFrame (colunas, tipos, índice e valores)
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps([[str(coluna), str(tipo)] for coluna, tipo in df.dtypes.items()]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+def versao_codigo():
+    """
+    Hash do conteúdo dos arquivos de ARQUIVOS_FEATURES
+    """
+    h = hashlib.sha256()
+    for caminho in ARQUIVOS_FEATURES:
+        if os.path.exists(caminho):
+            with open(caminho, 'rb') as f:
+                h.update(caminho.encode() + b'\n' + f.read())
+    return h.hexdigest()
+
+def chave(nome, df, config=None):
+    """
+    Chave da entrada para estes dados e configuração
+    """
+    partes = [nome, impressao_dados(df), json.dumps(config or {}, sort_keys=True, default=str), versao_codigo()]
+    return f"{nome}_{hashlib.sha256(':'.join(partes).encode()).hexdigest()[:24]}"
+
+def _caminho(chave):
+    return os.path.join(DIRETORIO_CACHE, f'{chave}.joblib')
+
+def carregar(chave):
+    """
+    Conteúdo da entrada (arrays com memory-map, somente leitura) ou None
+    """
+    caminho = _caminho(chave)
+    try:
+        conteudo = joblib.load(caminho, mmap_mode='r')
+    except (OSError, EOFError):
+        return None
+    # Marca como usada agora (a poda remove as mais antigas)
+    os.utime(caminho)
+    return conteudo
+
+def salvar(chave, conteudo):
+    """
+    Grava a entrada (temporário + rename) e poda o cache
+    """
+    os.makedirs(DIRETORIO_CACHE, exist_ok=True)
+    caminho = _caminho(chave)
+    temporario = f'{caminho}.{os.getpid()}.tmp'
+    joblib.dump(conteudo, temporario)
+    os.replace(temporario, caminho)
+    _podar()
+
+def _podar():
+    entradas = sorted(glob.glob(os.path.join(DIRETORIO_CACHE, '*.joblib')), key=os.path.getmtime, reverse=True)
+    for caminho in entradas[MAXIMO_ENTRADAS:]:
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+
+def obter(nome, df, config, calcular, progresso=print):
+    """
+    Conteúdo em cache para (nome, df, config) ou o resultado de calcular(),
+    que é gravado para as próximas vezes
+    
+    Retorno: (conteúdo, chave)
+    """
+    chave_entrada = chave(nome, df, config)
+    conteudo = carregar(chave_entrada)
+    if conteudo is not None:
+        progresso(f"✓ Dados preparados reaproveitados do cache ({chave_entrada})")
+        return conteudo, chave_entrada
+    
+    conteudo = calcular()
+    salvar(chave_entrada, conteudo)
+    return conteudo, chave_entrada
+
+def preparar_modelo(nome, base, carregar_dados, preparar_dados, config, diretorio):
+    """
+    carregar_dados + preparar_dados de um script de treinamento com cache; os
+    transformadores do modelo são gravados no pipeline salvo em diretorio
+    (mantendo os do outro modelo), como no preparar_dados sozinho
+    
+    Retorno: (X_treino, X_teste, y_treino, y_teste, label_encoder)
+    """
+    def calcular():
+        pipeline = pipeline_features.PipelineFeatures()
+        dados = preparar_dados(carregar_dados(base), pipeline=pipeline)
+        componentes = {
+            componente: getattr(pipeline, componente)
+            for componente in pipeline_features.COMPONENTES if getattr(pipeline, componente) is not None
+        }
+        return {'dados': dados, 'componentes': componentes}
+    
+    conteudo, _ = obter(nome, base, config, calcular)
+    
+    pipeline = pipeline_features.carregar_ou_criar(diretorio)
+    for componente, valor in conteudo['componentes'].items():
+        setattr(pipeline, componente, valor)
+    pipeline_features.salvar(pipeline, diretorio)
+    return conteudo['dados']
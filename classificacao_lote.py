@@ -0,0 +1,565 @@
+"""
+Classificação em Lote
+=====================
+Pipeline em estágios para classificar muitas transações de uma vez:
+
+1. ML (categoria + subcategoria) em uma única passada vetorizada
+2. Fallback local (palavras-chave) vetorizado
+3. IA externa apenas para as linhas que continuam com confiança baixa, em lotes
+
+Usado pelo upload de CSV (app.py) e por processar_csv.py em vez de classificar
+linha a linha. classificar_csv_em_chunks processa arquivos de qualquer tamanho
+com memória limitada ao tamanho do chunk.
+"""
+
+import codecs
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import llm_classifier
+
+# Colunas adicionadas ao CSV processado (mesmos nomes usados em transactions.html)
+COLUNAS_RESULTADO = [
+    'Categoria_ML', 'Confianca_ML',
+    'Subcategoria_ML', 'Confianca_Subcategoria_ML',
+    'Categoria_LLM', 'Confianca_LLM',
+    'Categoria_OpenAI', 'Confianca_OpenAI'
+]
+
+# Linhas lidas/classificadas por vez no modo streaming
+TAMANHO_CHUNK = 5000
+
+# Threads de TensorFlow/BLAS por processo worker (o paralelismo vem dos processos)
+VARIAVEIS_THREADS = ('TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS', 'OMP_NUM_THREADS')
+
+def detectar_colunas(colunas):
+    """
+    Detecta (flexível) as colunas de descrição, valor e data pelo nome
+    
+    Retorno: (col_descricao, col_valor, col_data) - None se não encontrada
+    """
+    col_descricao = None
+    col_valor = None
+    col_data = None
+    
+    for col in colunas:
+        col_upper = str(col).upper()
+        if 'DESCRI' in col_upper or 'DESCRICAO' in col_upper:
+            col_descricao = col
+        if 'VALOR' in col_upper:
+            col_valor = col
+        if 'DATA' in col_upper or 'DATE' in col_upper:
+            col_data = col
+    
+    return col_descricao, col_valor, col_data
+
+def chave_deduplicacao(descricoes, valores, tags, datas=None):
+    """
+    Chave normalizada usada para classificar cada transação repetida uma
+    única vez: linhas com a mesma chave têm as mesmas features nos modelos
+    
+    - descricao: minúsculas, sem espaços nas pontas e com espaços internos colapsados
+      (o TF-IDF já ignora caixa e espaços)
+    - valor: exato, em centavos (feature numérica dos modelos)
+    - tags: minúsculas, sem espaços nas pontas
+    - datas: mês e dia da semana, só para classificadores que usam a data
+      (ex.: processar_csv.classificar_ml_lote); data inválida conta como vazia
+    """
+    descricoes = pd.Series(descricoes, dtype=object).astype(str)
+    desc_norm = descricoes.str.lower().str.strip().str.replace(r'\s+', ' ', regex=True)
+    centavos = np.round(np.asarray(valores, dtype=float) * 100).astype(np.int64)
+    tags_norm = pd.Series(tags, dtype=object).fillna('').astype(str).str.lower().str.strip()
+    
+    chaves = desc_norm.to_numpy() + '|' + centavos.astype(str) + '|' + tags_norm.to_numpy()
+    if datas is not None:
+        datas = pd.to_datetime(pd.Series(list(datas)), errors='coerce')
+        periodo = (datas.dt.month * 10 + datas.dt.dayofweek).fillna(-1).astype(np.int64)
+        chaves = chaves + '|' + periodo.to_numpy().astype(str)
+    return chaves
+
+def _classificar_linhas(descricoes, valores, tags, datas, classificador_ml, threshold_confianca, progresso):
+    """
+    Classifica (em estágios) linhas já validadas; uma saída por entrada
+    """
+    resultado = _resultado_vazio(len(descricoes))
+    
+    # 1. ML - uma passada para todas as linhas
+    confianca_ml = None
+    if classificador_ml is not None:
+        try:
+            resultado_ml = classificador_ml(
+                descricoes.tolist(), valores.to_numpy(), tags.tolist(), datas
+            )
+        except Exception as e:
+            print(f"Erro na classificação ML em lote: {e}")
+            resultado_ml = None
+        
+        if resultado_ml is not None:
+            resultado['Categoria_ML'] = resultado_ml['categoria'].to_numpy()
+            resultado['Confianca_ML'] = resultado_ml['confianca'].to_numpy(dtype=float)
+            if 'subcategoria' in resultado_ml:
+                resultado['Subcategoria_ML'] = resultado_ml['subcategoria'].to_numpy()
+                resultado['Confianca_Subcategoria_ML'] = resultado_ml['confianca_subcategoria'].to_numpy(dtype=float)
+            confianca_ml = resultado_ml['confianca'].to_numpy(dtype=float)
+        
+        progresso(f"ML: {len(descricoes)} transações classificadas")
+    
+    # 2 + 3. Fallback vetorizado e escalonamento em lote só do que ficou com confiança baixa
+    resultado_llm = llm_classifier.classificar_com_llm_lote(
+        descricoes, threshold_confianca=threshold_confianca, confianca_ml=confianca_ml,
+        progresso=progresso
+    )
+    progresso(f"LLM: {len(descricoes)} transações classificadas")
+    resultado['Categoria_LLM'] = resultado_llm['categoria'].to_numpy()
+    resultado['Confianca_LLM'] = resultado_llm['confianca'].to_numpy(dtype=float)
+    
+    # A OpenAI já é o primeiro provider do escalonamento; não há mais chamada
+    # separada por linha - a coluna espelha o resultado LLM
+    resultado['Categoria_OpenAI'] = resultado['Categoria_LLM']
+    resultado['Confianca_OpenAI'] = resultado['Confianca_LLM']
+    
+    return resultado
+
+def _sem_progresso(mensagem):
+    """
+    Callback de progresso padrão (não faz nada)
+    """
+
+def _resultado_vazio(n):
+    """
+    DataFrame de resultado com n linhas vazias / confiança 0.0
+    """
+    return pd.DataFrame({
+        'Categoria_ML': '', 'Confianca_ML': 0.0,
+        'Subcategoria_ML': '', 'Confianca_Subcategoria_ML': 0.0,
+        'Categoria_LLM': '', 'Confianca_LLM': 0.0,
+        'Categoria_OpenAI': '', 'Confianca_OpenAI': 0.0
+    }, index=pd.RangeIndex(n))[COLUNAS_RESULTADO]
+
+def classificar_lote(descricoes, valores, tags=None, classificador_ml=None, threshold_confianca=0.7,
+                     datas=None, deduplicar=True, progresso=None, cache=None, datas_na_chave=False):
+    """
+    Classifica um lote de transações em estágios
+    
+    Parâmetros:
+    - descricoes: Series/lista de descrições
+    - valores: Series/lista de valores (não numéricos viram 0)
+    - tags: Series/lista de tags (opcional)
+    - classificador_ml: função (descricoes, valores, tags, datas) -> DataFrame com colunas
+      categoria, confianca, subcategoria, confianca_subcategoria (ou None sem modelo)
+    - threshold_confianca: abaixo disso a linha é escalada para IA externa
+    - datas: Series/lista de datas (opcional, repassada ao classificador ML)
+    - deduplicar: classificar cada chave_deduplicacao uma única vez e replicar o
+      resultado para todas as linhas com a mesma chave
+    - datas_na_chave: o classificador_ml usa a data (mês/dia da semana), então
+      ela entra na chave de deduplicação
+    - progresso: função chamada com uma mensagem ao fim de cada estágio
+      (pode levantar exceção para interromper o processamento)
+    - cache: cache por linha (cache_classificacao.CacheLinhas); chaves já em
+      cache não são reclassificadas e as novas são gravadas. Só com deduplicar
+    
+    Retorno: DataFrame com COLUNAS_RESULTADO, um registro por entrada (mesma ordem).
+    Linhas sem descrição ou com valor <= 0 ficam vazias / confiança 0.0.
+    Estatísticas da deduplicação ficam em resultado.attrs['deduplicacao'].
+    """
+    if progresso is None:
+        progresso = _sem_progresso
+    
+    descricoes = pd.Series(descricoes, dtype=object).reset_index(drop=True)
+    valores = pd.to_numeric(pd.Series(valores).reset_index(drop=True), errors='coerce').fillna(0.0)
+    if tags is None:
+        tags = pd.Series('', index=descricoes.index, dtype=object)
+    else:
+        tags = pd.Series(tags, dtype=object).reset_index(drop=True).fillna('')
+    if datas is not None:
+        datas = pd.Series(datas).reset_index(drop=True)
+    
+    descricoes = descricoes.where(descricoes.notna(), '').astype(str)
+    validos = ((descricoes != '') & (valores > 0)).to_numpy()
+    
+    resultado = _resultado_vazio(len(descricoes))
+    n_validas = int(validos.sum())
+    resultado.attrs['deduplicacao'] = {'linhas': n_validas, 'unicas': n_validas, 'taxa': 1.0, 'cache': 0}
+    
+    if n_validas == 0:
+        return resultado
+    
+    indices = np.flatnonzero(validos)
+    if deduplicar:
+        chaves = chave_deduplicacao(
+            descricoes[validos], valores[validos], tags[validos],
+            datas[validos] if datas is not None and datas_na_chave else None
+        )
+        codigos, unicas = pd.factorize(chaves)
+        # factorize numera as chaves na ordem da primeira ocorrência
+        _, primeira_ocorrencia = np.unique(codigos, return_index=True)
+        representantes = indices[primeira_ocorrencia]
+    else:
+        codigos = np.arange(n_validas)
+        representantes = indices
+    
+    n_unicas = len(representantes)
+    resultado.attrs['deduplicacao'] = {
+        'linhas': n_validas,
+        'unicas': n_unicas,
+        'taxa': n_validas / n_unicas,
+        'cache': 0
+    }
+    if deduplicar:
+        progresso(f"Deduplicação: {n_validas} linhas válidas -> {n_unicas} chaves únicas")
+        print(f"Deduplicação: {n_validas} linhas válidas -> {n_unicas} chaves únicas "
+              f"({n_validas / n_unicas:.1f}x menos classificações)")
+    
+    # Chaves já classificadas em outros uploads saem do cache
+    resultado_unicas = _resultado_vazio(n_unicas)
+    pendentes = np.ones(n_unicas, dtype=bool)
+    if cache is not None and deduplicar:
+        em_cache = cache.buscar(unicas)
+        if len(em_cache):
+            pendentes = ~pd.Index(unicas).isin(em_cache.index)
+            encontradas = unicas[~pendentes]
+            for coluna in COLUNAS_RESULTADO:
+                resultado_unicas.loc[~pendentes, coluna] = em_cache.loc[encontradas, coluna].to_numpy()
+            resultado.attrs['deduplicacao']['cache'] = int((~pendentes).sum())
+            progresso(f"Cache: {len(encontradas)} de {n_unicas} chaves já classificadas")
+    
+    if pendentes.any():
+        a_classificar = representantes[pendentes]
+        resultado_novas = _classificar_linhas(
+            descricoes.iloc[a_classificar].reset_index(drop=True),
+            valores.iloc[a_classificar].reset_index(drop=True),
+            tags.iloc[a_classificar].reset_index(drop=True),
+            datas.iloc[a_classificar].reset_index(drop=True) if datas is not None else None,
+            classificador_ml,
+            threshold_confianca,
+            progresso
+        )
+        for coluna in COLUNAS_RESULTADO:
+            resultado_unicas.loc[pendentes, coluna] = resultado_novas[coluna].to_numpy()
+        if cache is not None and deduplicar:
+            cache.gravar(unicas[pendentes], resultado_novas)
+    
+    # Replicar o resultado de cada chave para todas as linhas com essa chave
+    for coluna in COLUNAS_RESULTADO:
+        resultado.loc[validos, coluna] = resultado_unicas[coluna].to_numpy()[codigos]
+    return resultado
+
+def adicionar_colunas_resultado(df, resultado):
+    """
+    Formatação padrão da saída: adiciona COLUNAS_RESULTADO ao DataFrame
+    """
+    for coluna in COLUNAS_RESULTADO:
+        df[coluna] = resultado[coluna].to_numpy()
+    return df
+
+def inspecionar_csv(caminho, tamanho_bloco=1 << 20):
+    """
+    Passa uma vez pelo arquivo (em blocos, memória constante) para descobrir o
+    encoding (utf-8, senão latin-1), estimar o número de linhas de dados e
+    calcular o hash do conteúdo (usado pelos checkpoints)
+    
+    Retorno: (encoding, linhas_estimadas, sha256)
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    encoding = 'utf-8'
+    quebras = 0
+    ultimo = b''
+    sha256 = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        while True:
+            bloco = f.read(tamanho_bloco)
+            if not bloco:
+                break
+            sha256.update(bloco)
+            quebras += bloco.count(b'\n')
+            ultimo = bloco[-1:]
+            if encoding == 'utf-8':
+                try:
+                    decoder.decode(bloco)
+                except UnicodeDecodeError:
+                    encoding = 'latin-1'
+    
+    # Última linha sem quebra no final também conta; descontar o cabeçalho
+    linhas = quebras + (1 if ultimo and ultimo != b'\n' else 0)
+    return encoding, max(linhas - 1, 0), sha256.hexdigest()
+
+def _salvar_json_atomico(caminho, dados):
+    """
+    Grava JSON em arquivo temporário e renomeia (nunca deixa arquivo pela metade)
+    """
+    temporario = f'{caminho}.tmp'
+    with open(temporario, 'w') as f:
+        json.dump(dados, f)
+    os.replace(temporario, caminho)
+
+def _carregar_manifesto(dir_checkpoint, assinatura):
+    """
+    Carrega o manifesto de checkpoints se ele for da mesma execução
+    (mesmo arquivo de entrada e mesmos parâmetros); senão começa do zero
+    """
+    caminho = os.path.join(dir_checkpoint, 'manifest.json')
+    try:
+        with open(caminho, 'r') as f:
+            manifesto = json.load(f)
+        if manifesto.get('assinatura') == assinatura:
+            return manifesto
+    except (OSError, ValueError):
+        pass
+    
+    # Checkpoints de outra entrada/configuração não servem
+    shutil.rmtree(dir_checkpoint, ignore_errors=True)
+    os.makedirs(dir_checkpoint, exist_ok=True)
+    return {'assinatura': assinatura, 'chunks': {}, 'concluido': False, 'resumo': None}
+
+def _caminho_parte(dir_checkpoint, numero):
+    """
+    Arquivo com o resultado de um chunk
+    """
+    return os.path.join(dir_checkpoint, f'chunk_{numero:06d}.csv')
+
+def _juntar_partes(dir_checkpoint, numeros, output_path):
+    """
+    Concatena as partes (na ordem dos chunks) no arquivo de saída final
+    """
+    temporario = f'{output_path}.tmp'
+    with open(temporario, 'wb') as saida:
+        # BOM do utf-8-sig (mesmo formato de saída do modo sem checkpoint)
+        saida.write(codecs.BOM_UTF8)
+        for numero in sorted(numeros):
+            with open(_caminho_parte(dir_checkpoint, numero), 'rb') as parte:
+                shutil.copyfileobj(parte, saida)
+    os.replace(temporario, output_path)
+
+def pool_workers(workers, inicializador=None):
+    """
+    Pool de processos (spawn) com uma thread de TensorFlow/BLAS por processo
+    
+    As variáveis de VARIAVEIS_THREADS são definidas aqui, no processo
+    principal, e herdadas pelos filhos ao nascer: no inicializador já seria
+    tarde, porque o unpickling dos initargs e das tarefas importa NumPy e
+    TensorFlow antes. O processo principal já carregou essas bibliotecas e
+    não muda; valores já definidos no ambiente são mantidos.
+    """
+    for variavel in VARIAVEIS_THREADS:
+        os.environ.setdefault(variavel, '1')
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_inicializar_worker,
+        initargs=(inicializador,)
+    )
+
+def _inicializar_worker(inicializador):
+    """
+    Inicialização de cada processo worker: limita o TensorFlow (se já
+    importado) a uma thread e roda o inicializador do chamador
+    """
+    tf = sys.modules.get('tensorflow')
+    if tf is not None:
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(1)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except RuntimeError:
+            # Runtime já inicializado: valem as variáveis herdadas de pool_workers
+            pass
+    if inicializador is not None:
+        inicializador()
+
+def _classificar_chunk(chunk, colunas_detectadas, classificador_ml, formatar, threshold_confianca,
+                       cache=None, progresso=None, datas_na_chave=False):
+    """
+    Classifica um chunk e formata a saída (roda no processo principal ou num worker)
+    
+    Retorno: (DataFrame de saída, estatísticas do chunk)
+    """
+    col_descricao, col_valor, col_data = colunas_detectadas
+    resultado = classificar_lote(
+        chunk[col_descricao],
+        chunk[col_valor],
+        tags=chunk['tags'] if 'tags' in chunk.columns else None,
+        classificador_ml=classificador_ml,
+        threshold_confianca=threshold_confianca,
+        datas=chunk[col_data] if col_data else None,
+        progresso=progresso,
+        cache=cache,
+        datas_na_chave=datas_na_chave
+    )
+    saida = formatar(chunk, resultado)
+    
+    dedup = resultado.attrs['deduplicacao']
+    return saida, {
+        'total_rows': len(chunk),
+        'processed_rows': int((resultado['Categoria_ML'] != '').sum()),
+        'valid_rows': dedup['linhas'],
+        'unique_rows': dedup['unicas'],
+        'cached_rows': dedup['cache']
+    }
+
+def _consumir(item, gravar):
+    """
+    Espera (se preciso) o resultado de um chunk em andamento e grava
+    """
+    numero, pendente, concluido = item
+    if concluido is not None:
+        # Chunk já gravado num checkpoint anterior
+        gravar(numero, None, concluido)
+        return
+    saida, concluido = pendente.result() if isinstance(pendente, Future) else pendente
+    gravar(numero, saida, concluido)
+
+def classificar_csv_em_chunks(input_path, output_path, classificador_ml=None, chunksize=TAMANHO_CHUNK,
+                              encoding=None, formatar=adicionar_colunas_resultado, progresso=None,
+                              threshold_confianca=0.7, checkpoint=True, versao=None,
+                              workers=1, inicializador=None, cache=None, datas_na_chave=False,
+                              **opcoes_leitura):
+    """
+    Lê o CSV em chunks, classifica cada chunk com classificar_lote e grava o
+    resultado no arquivo de saída (memória limitada ao chunk)
+    
+    Com checkpoint, cada chunk concluído é gravado em <saida>.parts/ junto com
+    um manifest.json. Se a execução for interrompida, rodar de novo com a mesma
+    entrada retoma do último chunk gravado; rodar de novo depois de concluído
+    não reprocessa nada.
+    
+    Parâmetros:
+    - classificador_ml: mesmo contrato de classificar_lote
+    - chunksize: linhas por chunk
+    - encoding: None = detectar (utf-8 ou latin-1)
+    - formatar: função (chunk, resultado) -> DataFrame que será escrito
+    - progresso: função (linha, processadas=, total=) chamada a cada chunk
+    - checkpoint: gravar/retomar checkpoints por chunk
+    - versao: identifica modelos/config; checkpoints de outra versão são descartados
+    - workers: > 1 classifica os chunks em paralelo num pool de processos; o
+      resultado é gravado na ordem original das linhas
+    - inicializador: função executada uma vez em cada processo worker (ex.: carregar
+      os modelos). classificador_ml e formatar precisam ser funções de módulo
+    - cache: cache por linha repassado a classificar_lote
+    - datas_na_chave: repassado a classificar_lote
+    - opcoes_leitura: repassadas para pd.read_csv (ex.: on_bad_lines='skip')
+    
+    Retorno: resumo com total_rows, processed_rows, unique_rows, cached_rows, dedupe_ratio, chunks
+    """
+    if progresso is None:
+        progresso = _imprimir_progresso
+    
+    encoding_detectado, total_estimado, sha256 = inspecionar_csv(input_path)
+    encoding = encoding or encoding_detectado
+    
+    dir_checkpoint = f'{output_path}.parts'
+    manifesto = None
+    if checkpoint:
+        assinatura = {
+            'input_sha256': sha256,
+            'chunksize': chunksize,
+            'formato': getattr(formatar, '__name__', str(formatar)),
+            'versao': versao
+        }
+        manifesto = _carregar_manifesto(dir_checkpoint, assinatura)
+        if manifesto['concluido'] and os.path.exists(output_path):
+            progresso("Arquivo já processado com esta entrada (checkpoint concluído)",
+                      processadas=manifesto['resumo']['total_rows'], total=manifesto['resumo']['total_rows'])
+            return manifesto['resumo']
+        if manifesto['chunks']:
+            progresso(f"Retomando do checkpoint: {len(manifesto['chunks'])} chunk(s) já concluído(s)")
+    
+    # Detectar colunas pelo cabeçalho
+    colunas = pd.read_csv(input_path, encoding=encoding, nrows=0, **opcoes_leitura).columns
+    col_descricao, col_valor, col_data = detectar_colunas(colunas)
+    if not col_descricao:
+        raise ValueError("Coluna de descrição não encontrada!")
+    if not col_valor:
+        raise ValueError("Coluna de valor não encontrada!")
+    
+    progresso(f"Colunas detectadas: descrição={col_descricao}, valor={col_valor}, data={col_data}",
+              processadas=0, total=total_estimado)
+    
+    resumo = {'total_rows': 0, 'processed_rows': 0, 'valid_rows': 0, 'unique_rows': 0, 'cached_rows': 0, 'chunks': 0}
+    leitor = pd.read_csv(input_path, encoding=encoding, chunksize=chunksize, **opcoes_leitura)
+    colunas_detectadas = (col_descricao, col_valor, col_data)
+    
+    def gravar(numero, saida, concluido):
+        """Grava o resultado de um chunk (sempre chamado na ordem dos chunks)"""
+        if saida is not None:
+            if manifesto is not None:
+                # Gravar a parte e só depois registrar no manifesto (commit do chunk)
+                parte = _caminho_parte(dir_checkpoint, numero)
+                saida.to_csv(f'{parte}.tmp', index=False, encoding='utf-8', header=(numero == 0))
+                os.replace(f'{parte}.tmp', parte)
+                manifesto['chunks'][str(numero)] = concluido
+                _salvar_json_atomico(os.path.join(dir_checkpoint, 'manifest.json'), manifesto)
+            else:
+                saida.to_csv(output_path, index=False, encoding='utf-8-sig',
+                             mode='w' if numero == 0 else 'a', header=(numero == 0))
+        
+        for chave in ('total_rows', 'processed_rows', 'valid_rows', 'unique_rows', 'cached_rows'):
+            resumo[chave] += concluido.get(chave, 0)
+        resumo['chunks'] += 1
+        
+        progresso(f"Processadas {resumo['total_rows']} linhas ({resumo['chunks']} chunks)",
+                  processadas=resumo['total_rows'], total=max(total_estimado, resumo['total_rows']))
+    
+    executor = None
+    if workers > 1:
+        # spawn: cada worker carrega os modelos do zero (fork com TensorFlow carregado não é seguro)
+        executor = pool_workers(workers, inicializador)
+    
+    # Chunks em andamento, consumidos na ordem em que foram lidos (mantém a ordem
+    # original das linhas); no máximo 2 por worker em memória
+    em_andamento = deque()
+    try:
+        for numero, chunk in enumerate(leitor):
+            concluido = manifesto['chunks'].get(str(numero)) if manifesto else None
+            
+            if concluido is not None:
+                em_andamento.append((numero, None, concluido))
+            elif executor is not None:
+                futuro = executor.submit(_classificar_chunk, chunk, colunas_detectadas, classificador_ml,
+                                         formatar, threshold_confianca, cache, None, datas_na_chave)
+                em_andamento.append((numero, futuro, None))
+            else:
+                em_andamento.append((numero, _classificar_chunk(chunk, colunas_detectadas, classificador_ml,
+                                                                formatar, threshold_confianca, cache, progresso,
+                                                                datas_na_chave), None))
+            
+            while len(em_andamento) > 2 * max(workers, 1) or (executor is None and em_andamento):
+                _consumir(em_andamento.popleft(), gravar)
+        
+        while em_andamento:
+            _consumir(em_andamento.popleft(), gravar)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    if resumo['chunks'] == 0:
+        # Arquivo só com cabeçalho: gerar saída vazia com as colunas esperadas
+        vazio = pd.DataFrame(columns=colunas)
+        formatar(vazio, _resultado_vazio(0)).to_csv(output_path, index=False, encoding='utf-8-sig')
+    elif manifesto is not None:
+        _juntar_partes(dir_checkpoint, range(resumo['chunks']), output_path)
+    
+    resumo['dedupe_ratio'] = resumo['valid_rows'] / resumo['unique_rows'] if resumo['unique_rows'] else 1.0
+    
+    if manifesto is not None:
+        # Concluído: as partes não são mais necessárias, só o manifesto
+        for numero in range(resumo['chunks']):
+            os.remove(_caminho_parte(dir_checkpoint, numero))
+        manifesto.update(concluido=True, resumo=resumo)
+        _salvar_json_atomico(os.path.join(dir_checkpoint, 'manifest.json'), manifesto)
+    
+    return resumo
+
+def _imprimir_progresso(linha=None, processadas=None, total=None):
+    """
+    Callback de progresso padrão do modo streaming (imprime no terminal)
+    """
+    if linha:
+        print(linha)
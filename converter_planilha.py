@@ -2,116 +2,95 @@
 Conversor de Planilha Financeira Real
 ======================================
 Converte sua planilha (data/Despesas.csv) para o formato do sistema.
+
+Aceita vários arquivos ou globs de uma vez; o encoding e o separador de
+cada um são detectados, os arquivos são convertidos em blocos e em paralelo
+e o resultado é um único CSV sem duplicatas:
+
+    python converter_planilha.py "extratos/*.csv" data/Despesas.csv -o data/expenses_converted.csv
 """
 
-import pandas as pd
+import argparse
+import csv
+import glob
+import os
 import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
-def limpar_valor(valor_str):
-    """
-    Converte 'R$ 120,00' para 120.00
+import numpy as np
+import pandas as pd
+
+import rotulos
+
+ARQUIVO_ENTRADA = 'data/Despesas.csv'
+ARQUIVO_SAIDA = 'data/expenses_converted.csv'
+
+# Linhas lidas por vez de cada arquivo
+TAMANHO_BLOCO = 50000
+# Bytes do começo do arquivo usados para detectar encoding e separador
+TAMANHO_AMOSTRA = 64 * 1024
+SEPARADORES = ';,\t|'
+
+# Removidos antes da conversão ('\xa0' é o espaço não separável do Excel)
+SIMBOLOS_VALOR = ['R$', '"', ' ', '\xa0']
+# Número já limpo no formato que o cast do Arrow entende
+PADRAO_NUMERO = r'\d+(\.\d+)?'
+
+def limpar_valores(valores):
     """
-    if pd.isna(valor_str) or valor_str == '':
-        return 0.0
+    Converte uma coluna de valores em reais de uma vez: 'R$ 1.500,00' → 1500.0,
+    '-R$ 50,00' → -50.0; vazios e valores inválidos viram 0.0
     
-    # Remover 'R$', espaços e aspas
-    valor_limpo = str(valor_str).replace('R$', '').replace('"', '').replace(' ', '').strip()
+    Cada valor distinto é convertido uma vez (planilhas repetem muito os
+    mesmos valores), com as operações de texto do Arrow, e o resultado é
+    espalhado pelos códigos do pd.factorize.
+    """
+    serie = pd.Series(valores)
+    codigos, unicos = pd.factorize(serie)
+    texto = pd.Series(unicos, dtype=pd.StringDtype('pyarrow'))
+    for simbolo in SIMBOLOS_VALOR:
+        texto = texto.str.replace(simbolo, '', regex=False)
+    texto = texto.str.strip()
     
     # Se tiver sinal negativo, preservar
-    negativo = '-' in valor_limpo
-    valor_limpo = valor_limpo.replace('-', '')
+    negativo = texto.str.contains('-', regex=False).fillna(False).to_numpy(dtype=bool)
     
-    # Trocar vírgula por ponto
-    valor_limpo = valor_limpo.replace('.', '').replace(',', '.')
+    # Tirar o separador de milhar e trocar vírgula por ponto
+    numero = texto.str.replace('-', '', regex=False).str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    simples = numero.str.fullmatch(PADRAO_NUMERO).fillna(False).to_numpy(dtype=bool)
+    valor = np.full(len(numero), np.nan)
+    valor[simples] = numero[simples].astype('float64[pyarrow]').to_numpy(dtype=float)
+    if not simples.all():
+        # Casos raros (notação científica, lixo): conversão lenta, inválidos viram NaN
+        valor[~simples] = pd.to_numeric(numero[~simples], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    valor = np.where(negativo, -valor, valor)
     
-    try:
-        valor_float = float(valor_limpo)
-        return -valor_float if negativo else valor_float
-    except:
-        return 0.0
+    # Código -1 do factorize (valor ausente) cai na última posição
+    valor = np.append(np.nan_to_num(valor, nan=0.0), 0.0)
+    return pd.Series(valor[codigos], index=serie.index)
 
-def mapear_categoria_por_tags(tags):
-    """
-    Mapeia tags para as 7 categorias corretas do sistema
-    """
-    if pd.isna(tags) or tags == '':
-        return 'CATEGORIZAR'
-    
-    tags_lower = str(tags).lower().strip()
-    
-    # Mapeamento direto de tags para categorias
-    if 'custos fixos' in tags_lower:
-        return 'CUSTOS FIXOS'
-    elif 'conforto' in tags_lower:
-        return 'CONFORTO'
-    elif 'prazeres' in tags_lower:
-        return 'PRAZERES'
-    elif 'conhecimento' in tags_lower:
-        return 'CONHECIMENTO'
-    elif 'metas' in tags_lower:
-        return 'METAS'
-    elif 'liberdade financeira' in tags_lower:
-        return 'LIBERDADE FINANCEIRA'
-    elif 'categorizar' in tags_lower:
-        return 'CATEGORIZAR'
-    else:
-        return 'CATEGORIZAR'  # Default
-
-def mapear_categoria(categoria_original, subcategoria='', tags=''):
+def limpar_valor(valor_str):
     """
-    Mapeia as categorias da planilha para as 7 categorias corretas
-    Usa tags como fonte principal de verdade
+    Converte 'R$ 120,00' para 120.00
     """
-    # Se tem tags, usar tags como fonte principal
-    if tags and str(tags).strip() != '':
-        return mapear_categoria_por_tags(tags)
-    
-    # Fallback: usar categoria_original e subcategoria
-    categoria_upper = str(categoria_original).upper()
-    sub_upper = str(subcategoria).upper()
-    
-    # Mapeamento baseado em padrões (fallback)
-    if 'CUSTOS FIXOS' in categoria_upper:
-        return 'CUSTOS FIXOS'
-    elif 'CONFORTO' in categoria_upper:
-        return 'CONFORTO'
-    elif 'PRAZERES' in categoria_upper:
-        return 'PRAZERES'
-    elif 'CONHECIMENTO' in categoria_upper or 'EDUCAÇÃO' in categoria_upper:
-        return 'CONHECIMENTO'
-    elif 'METAS' in categoria_upper:
-        return 'METAS'
-    elif 'LIBERDADE' in categoria_upper:
-        return 'LIBERDADE FINANCEIRA'
-    else:
-        return 'CATEGORIZAR'  # Default
+    return float(limpar_valores([valor_str]).iloc[0])
 
-def converter_planilha():
-    """
-    Converte data/Despesas.csv para o formato do sistema
+def converter_lote(df):
     """
-    print("=== CONVERSOR DE PLANILHA FINANCEIRA ===\n")
-    
-    # Ler arquivo original (com separador ;)
-    print("1. Lendo planilha original...")
-    try:
-        df = pd.read_csv('data/Despesas.csv', sep=';', encoding='utf-8')
-    except:
-        try:
-            df = pd.read_csv('data/Despesas.csv', sep=';', encoding='latin-1')
-        except Exception as e:
-            print(f"Erro ao ler planilha: {e}")
-            return
+    Converte um bloco da planilha original para o formato do sistema
+    (data,descricao,valor,tags,subcategoria,categoria)
     
-    print(f"   Linhas originais: {len(df)}")
-    print(f"   Colunas: {list(df.columns[:6])}")
-    
-    # Remover linhas vazias
-    print("\n2. Limpando dados...")
+    Retorno: (DataFrame convertido, linhas lidas)
+    """
+    lidas = len(df)
     
     # Pegar nome real das colunas (pode ter encoding diferente)
-    col_descricao = [c for c in df.columns if 'DESCRI' in c.upper()][0]
+    colunas_descricao = [c for c in df.columns if 'DESCRI' in c.upper()]
+    if not colunas_descricao or 'VALOR' not in df.columns:
+        raise ValueError(f"colunas de descrição/VALOR não encontradas em {list(df.columns[:6])}")
+    col_descricao = colunas_descricao[0]
     
     # Filtrar apenas linhas válidas (que têm descrição e valor)
     df = df[df[col_descricao].notna()]
@@ -121,17 +100,10 @@ def converter_planilha():
     df = df[df[col_descricao].astype(str).str.strip() != '']
     df = df[~df[col_descricao].astype(str).str.contains('#REF!', na=False)]
     
-    print(f"   Linhas apos limpeza inicial: {len(df)}")
-    
     # Remover linhas com valores vazios ou zero
-    df['VALOR_TEMP'] = df['VALOR'].apply(limpar_valor)
-    df = df[df['VALOR_TEMP'] != 0]
-    
-    print(f"   Linhas validas: {len(df)}")
-    
-    # Criar DataFrame no novo formato
-    # Ordem correta: data,descricao,valor,tags,subcategoria,categoria
-    print("\n3. Convertendo formato...")
+    valor = limpar_valores(df['VALOR'])
+    df = df[valor != 0]
+    valor = valor[valor != 0]
     
     # Tags (usar a coluna tags original se existir, senão usar CATEGORIA)
     col_tags = None
@@ -146,53 +118,177 @@ def converter_planilha():
     novo_df = pd.DataFrame({
         'data': pd.to_datetime('2024-01-01'),  # Data padrão
         'descricao': df[col_descricao].str.strip(),
-        'valor': df['VALOR'].apply(limpar_valor),
+        'valor': valor,
         'tags': tags_source.fillna('').str.lower().str.strip(),
         'subcategoria': df['SubCategoria'].fillna('').str.strip(),
-        'categoria': df.apply(
-            lambda row: mapear_categoria(
-                row.get('CATEGORIA', ''), 
-                row.get('SubCategoria', ''),
-                row.get(col_tags, '') if col_tags else ''
-            ), 
-            axis=1
+        'categoria': rotulos.categorias_planilha(
+            df['CATEGORIA'] if 'CATEGORIA' in df.columns else pd.Series('', index=df.index),
+            df[col_tags] if col_tags else None
         )
     })
+    return novo_df, lidas
+
+def detectar_formato(caminho, tamanho_amostra=TAMANHO_AMOSTRA):
+    """
+    Encoding e separador do CSV a partir do começo do arquivo
+    
+    Retorno: (encoding, separador)
+    """
+    with open(caminho, 'rb') as f:
+        amostra = f.read(tamanho_amostra)
+    
+    if amostra.startswith(b'\xef\xbb\xbf'):
+        encoding = 'utf-8-sig'
+    else:
+        try:
+            amostra.decode('utf-8')
+            encoding = 'utf-8'
+        except UnicodeDecodeError as e:
+            # Caractere cortado no fim da amostra não conta como erro
+            encoding = 'utf-8' if e.start >= len(amostra) - 3 else 'latin-1'
+    
+    texto = amostra.decode(encoding, errors='ignore')
+    linhas = texto.splitlines()[:20]
+    try:
+        separador = csv.Sniffer().sniff('\n'.join(linhas), delimiters=SEPARADORES).delimiter
+    except csv.Error:
+        separador = ';'
+    return encoding, separador
+
+def converter_arquivo(caminho, parte, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Converte um arquivo em blocos de tamanho_bloco linhas, gravando o
+    resultado em parte (CSV); roda em um processo do pool
+    
+    Retorno: {'arquivo', 'encoding', 'separador', 'lidas', 'validas'}
+    """
+    encoding, separador = detectar_formato(caminho)
+    resumo = {'arquivo': caminho, 'encoding': encoding, 'separador': separador, 'lidas': 0, 'validas': 0}
+    
+    blocos = pd.read_csv(caminho, sep=separador, encoding=encoding, dtype=str, chunksize=tamanho_bloco)
+    for numero, bloco in enumerate(blocos):
+        convertido, lidas = converter_lote(bloco)
+        convertido.to_csv(parte, mode='w' if numero == 0 else 'a', header=numero == 0, index=False)
+        resumo['lidas'] += lidas
+        resumo['validas'] += len(convertido)
+    return resumo
+
+def expandir_entradas(entradas):
+    """
+    Arquivos das entradas (caminhos ou globs), na ordem dada e sem repetição
+    """
+    arquivos = []
+    for entrada in entradas:
+        encontrados = sorted(glob.glob(entrada)) if glob.has_magic(entrada) else [entrada]
+        for arquivo in encontrados:
+            if arquivo not in arquivos:
+                arquivos.append(arquivo)
+    return arquivos
+
+def converter_planilha(entradas=None, saida=ARQUIVO_SAIDA, tamanho_bloco=TAMANHO_BLOCO, workers=None):
+    """
+    Converte uma ou mais planilhas (caminhos ou globs; padrão data/Despesas.csv)
+    para o formato do sistema, em um único arquivo sem duplicatas
     
-    # Remover duplicatas exatas
-    print("\n4. Removendo duplicatas...")
-    antes = len(novo_df)
-    novo_df = novo_df.drop_duplicates(subset=['descricao', 'valor'], keep='first')
-    depois = len(novo_df)
-    print(f"   Removidas: {antes - depois} duplicatas")
+    - encoding e separador detectados por arquivo
+    - cada arquivo é lido e convertido em blocos (memória limitada), vários
+      arquivos em paralelo (processos)
+    - a junção mantém a primeira ocorrência de cada (descricao, valor), na
+      ordem das entradas
     
-    # Ordenar por descrição
-    novo_df = novo_df.sort_values('descricao').reset_index(drop=True)
+    Retorno: resumo (despesas, duplicatas, arquivos) ou None se nada foi convertido
+    """
+    print("=== CONVERSOR DE PLANILHA FINANCEIRA ===\n")
+    
+    arquivos = expandir_entradas(entradas or [ARQUIVO_ENTRADA])
+    if not arquivos:
+        print("Nenhum arquivo encontrado")
+        return None
+    workers = max(1, min(workers or os.cpu_count() or 1, len(arquivos)))
+    
+    print(f"1. Convertendo {len(arquivos)} planilha(s) em {workers} processo(s)...")
+    with tempfile.TemporaryDirectory(prefix='conversao_') as temporario:
+        partes = [os.path.join(temporario, f'parte_{i}.csv') for i in range(len(arquivos))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futuros = [
+                executor.submit(converter_arquivo, arquivo, parte, tamanho_bloco)
+                for arquivo, parte in zip(arquivos, partes)
+            ]
+            convertidos = []
+            for futuro, arquivo, parte in zip(futuros, arquivos, partes):
+                try:
+                    resumo = futuro.result()
+                except Exception as e:
+                    print(f"   Erro ao ler {arquivo}: {e}")
+                    continue
+                print(f"   {arquivo}: {resumo['lidas']} linhas, {resumo['validas']} válidas "
+                      f"({resumo['encoding']}, separador {resumo['separador']!r})")
+                if resumo['validas']:
+                    convertidos.append(parte)
+        
+        if not convertidos:
+            print("Nenhuma despesa válida encontrada")
+            return None
+        
+        # Juntar as partes em blocos, removendo duplicatas (descricao, valor)
+        print("\n2. Juntando arquivos e removendo duplicatas...")
+        vistos = set()
+        total = 0
+        duplicatas = 0
+        valor_total = 0.0
+        por_categoria = pd.Series(dtype=int)
+        primeiras = None
+        temporario_saida = f'{saida}.tmp'
+        for parte in convertidos:
+            blocos = pd.read_csv(parte, dtype=str, keep_default_na=False, chunksize=tamanho_bloco)
+            for bloco in blocos:
+                chaves = pd.util.hash_pandas_object(bloco[['descricao', 'valor']], index=False).to_numpy()
+                novos = ~pd.Series(chaves).duplicated().to_numpy()
+                novos &= np.fromiter((chave not in vistos for chave in chaves), dtype=bool, count=len(chaves))
+                vistos.update(chaves[novos].tolist())
+                duplicatas += int((~novos).sum())
+                bloco = bloco[novos]
+                
+                bloco.to_csv(temporario_saida, mode='w' if total == 0 else 'a', header=total == 0, index=False)
+                total += len(bloco)
+                valor_total += bloco['valor'].astype(float).sum()
+                por_categoria = por_categoria.add(bloco['categoria'].value_counts(), fill_value=0)
+                if primeiras is None:
+                    primeiras = bloco.head()
+        os.replace(temporario_saida, saida)
     
-    # Salvar
-    print("\n5. Salvando arquivo convertido...")
-    novo_df.to_csv('data/expenses_converted.csv', index=False)
-    print(f"   Arquivo salvo: data/expenses_converted.csv")
-    print(f"   Total de despesas: {len(novo_df)}")
+    print(f"   Removidas: {duplicatas} duplicatas")
+    print(f"   Arquivo salvo: {saida}")
+    print(f"   Total de despesas: {total}")
     
     # Estatísticas
-    print("\n6. Estatísticas por categoria:")
-    stats = novo_df['categoria'].value_counts()
-    for cat, count in stats.items():
+    print("\n3. Estatísticas por categoria:")
+    for cat, count in por_categoria.astype(int).sort_values(ascending=False).items():
         print(f"   {cat:15s}: {count:4d} despesas")
     
-    print(f"\n7. Valor total: R$ {novo_df['valor'].sum():,.2f}")
+    print(f"\n4. Valor total: R$ {valor_total:,.2f}")
     
     # Mostrar primeiras linhas
-    print("\n8. Primeiras 5 despesas:")
-    print(novo_df[['descricao', 'valor', 'categoria']].head().to_string(index=False))
+    print("\n5. Primeiras 5 despesas:")
+    print(primeiras[['descricao', 'valor', 'categoria']].to_string(index=False))
     
     print("\nOK CONVERSAO CONCLUIDA!")
     print("\nProximo passo:")
-    print("   1. Revise o arquivo: data/expenses_converted.csv")
-    print("   2. Se estiver OK, substitua: cp data/expenses_converted.csv data/expenses.csv")
+    print(f"   1. Revise o arquivo: {saida}")
+    print(f"   2. Se estiver OK, substitua: cp {saida} data/expenses.csv")
     print("   3. Treine o modelo: python train_model.py")
+    return {'despesas': total, 'duplicatas': duplicatas, 'arquivos': len(convertidos)}
 
-if __name__ == "__main__":
-    converter_planilha()
+def main():
+    parser = argparse.ArgumentParser(description='Converte planilhas de despesas para o formato do sistema')
+    parser.add_argument('entradas', nargs='*', default=[ARQUIVO_ENTRADA],
+                        help='arquivos CSV ou globs (ex.: "extratos/*.csv")')
+    parser.add_argument('-o', '--saida', default=ARQUIVO_SAIDA)
+    parser.add_argument('--bloco', type=int, default=TAMANHO_BLOCO, help='linhas lidas por vez')
+    parser.add_argument('--workers', type=int, default=None, help='arquivos convertidos ao mesmo tempo')
+    args = parser.parse_args()
+    
+    converter_planilha(args.entradas, args.saida, args.bloco, args.workers)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""
+Fila de Processamento de Uploads
+================================
+Processa os CSVs enviados em /api/upload-csv em segundo plano, com um pool
+limitado de workers (threads).
+
+O estado de cada job fica em data/uploads/<file_id>_job.json, então jobs que
+estavam na fila (ou foram interrompidos no meio) voltam para a fila quando o
+servidor reinicia. Jobs terminados saem da memória (o estado continua no
+disco).
+
+Com vários processos (workers WSGI), cada job tem um dono ('dono': pid e
+host) que renova 'heartbeat' a cada INTERVALO_HEARTBEAT segundos. Um processo
+só retoma jobs cujo dono morreu (mesmo host) ou parou de renovar há mais de
+PRAZO_HEARTBEAT; a retomada é feita com um lock de arquivo, então dois
+processos nunca pegam o mesmo job. Pedidos de cancelamento vindos de outro
+processo ficam em data/uploads/<file_id>_job.cancel, que o dono consulta.
+
+Cada stream SSE assina o job e recebe a própria fila de eventos, então várias
+abas acompanham o mesmo upload sem roubar eventos umas das outras.
+"""
+
+import glob
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from datetime import datetime
+
+import armazenamento
+
+DIRETORIO_UPLOADS = 'data/uploads'
+CAMINHO_LOCK_FILA = os.path.join(DIRETORIO_UPLOADS, 'fila.lock')
+
+# Renovação do heartbeat dos jobs deste processo e prazo para considerar o dono morto (segundos)
+INTERVALO_HEARTBEAT = 10
+PRAZO_HEARTBEAT = 60
+
+# Quantos uploads são processados ao mesmo tempo
+MAX_WORKERS = int(os.getenv('UPLOAD_WORKERS', '2'))
+
+# Estados em que o job ainda precisa ser processado
+STATUS_PENDENTES = ('queued', 'running')
+STATUS_FINAIS = ('completed', 'error', 'cancelled')
+
+jobs = {}
+_assinantes = {}
+_cancelamentos = {}
+_fila = queue.Queue()
+_lock = threading.Lock()
+_workers = []
+_processador = None
+
+class JobCancelado(Exception):
+    """
+    Levantada pelo callback de progresso quando o job foi cancelado
+    """
+
+def caminho_estado(file_id):
+    """
+    Caminho do arquivo JSON com o estado do job
+    """
+    return os.path.join(DIRETORIO_UPLOADS, f'{file_id}_job.json')
+
+def caminho_cancelamento(file_id):
+    """
+    Arquivo que marca o pedido de cancelamento (feito por qualquer processo)
+    """
+    return os.path.join(DIRETORIO_UPLOADS, f'{file_id}_job.cancel')
+
+def _dono():
+    return {'pid': os.getpid(), 'host': socket.gethostname()}
+
+def _dono_vivo(job):
+    """
+    True se o processo dono do job ainda está rodando e renovando o heartbeat
+    """
+    dono = job.get('dono')
+    if not dono or time.time() - job.get('heartbeat', 0) > PRAZO_HEARTBEAT:
+        return False
+    if dono == _dono():
+        return False
+    # Mesmo host (POSIX): dá para ver se o pid existe sem esperar o prazo
+    if os.name == 'posix' and dono.get('host') == socket.gethostname():
+        try:
+            os.kill(dono['pid'], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+    return True
+
+def _salvar_estado(job):
+    """
+    Persiste o estado do job (escreve em arquivo temporário e renomeia)
+    """
+    caminho = caminho_estado(job['file_id'])
+    temporario = f'{caminho}.tmp'
+    with open(temporario, 'w') as f:
+        json.dump(job, f)
+    os.replace(temporario, caminho)
+
+def _ler_estado(file_id):
+    try:
+        with open(caminho_estado(file_id), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def carregar_estado(file_id):
+    """
+    Retorna o estado do job (memória ou disco) ou None se não existir
+    """
+    with _lock:
+        if file_id in jobs:
+            return dict(jobs[file_id])
+    return _ler_estado(file_id)
+
+def _atualizar(file_id, **campos):
+    """
+    Atualiza campos do job e persiste
+    """
+    with _lock:
+        job = jobs[file_id]
+        job.update(campos)
+        _salvar_estado(job)
+        return dict(job)
+
+def publicar(file_id, linha=None, **campos):
+    """
+    Envia um evento de progresso para o stream SSE do job
+    """
+    evento = dict(campos)
+    if linha is not None:
+        evento['line'] = linha
+    with _lock:
+        filas = list(_assinantes.get(file_id, ()))
+    for fila_eventos in filas:
+        fila_eventos.put(evento)
+
+def assinar(file_id):
+    """
+    Nova fila com os próximos eventos de progresso do job (None se o job não
+    está em andamento neste processo: outro worker WSGI ou já terminado)
+    """
+    with _lock:
+        if file_id not in jobs:
+            return None
+        fila_eventos = queue.Queue()
+        _assinantes[file_id].append(fila_eventos)
+        return fila_eventos
+
+def cancelar_assinatura(file_id, fila_eventos):
+    """
+    Remove a fila de um stream encerrado
+    """
+    with _lock:
+        filas = _assinantes.get(file_id)
+        if filas and fila_eventos in filas:
+            filas.remove(fila_eventos)
+
+def _registrar(job):
+    """
+    Coloca o job na memória (chamar com _lock)
+    """
+    jobs[job['file_id']] = job
+    _assinantes[job['file_id']] = []
+    _cancelamentos[job['file_id']] = threading.Event()
+
+def _descartar(file_id):
+    """
+    Tira da memória um job em estado final (o estado fica no disco)
+    """
+    with _lock:
+        jobs.pop(file_id, None)
+        _assinantes.pop(file_id, None)
+        _cancelamentos.pop(file_id, None)
+    try:
+        os.remove(caminho_cancelamento(file_id))
+    except OSError:
+        pass
+
+def enfileirar(file_id, **dados):
+    """
+    Cria um job para o upload e coloca na fila de processamento
+    """
+    job = {
+        'file_id': file_id,
+        'dono': _dono(),
+        'heartbeat': time.time(),
+        'status': 'queued',
+        'created_at': datetime.now().isoformat(),
+        'started_at': None,
+        'completed_at': None,
+        'processadas': 0,
+        'total': None,
+        'error': None,
+        'resultado': None,
+        **dados
+    }
+    
+    with _lock:
+        _registrar(job)
+        _salvar_estado(job)
+    
+    _fila.put(file_id)
+    publicar(file_id, 'Arquivo na fila de processamento...', status='queued')
+    return dict(job)
+
+def cancelar(file_id):
+    """
+    Pede o cancelamento do job
+    
+    Job de outro processo: grava o pedido em caminho_cancelamento, que o dono
+    verifica a cada progresso (ou ao retomar o job).
+    
+    Retorno: True se o job existia e ainda não tinha terminado
+    """
+    with _lock:
+        job = jobs.get(file_id)
+        if job is None:
+            job = _ler_estado(file_id)
+            if job is None or job['status'] in STATUS_FINAIS:
+                return False
+            with open(caminho_cancelamento(file_id), 'w') as f:
+                f.write(datetime.now().isoformat())
+            return True
+        if job['status'] in STATUS_FINAIS:
+            return False
+        _cancelamentos[file_id].set()
+        
+        # Job ainda na fila: já marca como cancelado
+        na_fila = job['status'] == 'queued'
+        if na_fila:
+            job.update(status='cancelled', completed_at=datetime.now().isoformat())
+            _salvar_estado(job)
+    
+    publicar(file_id, 'Cancelamento solicitado')
+    if na_fila:
+        _descartar(file_id)
+    return True
+
+def _criar_callback_progresso(file_id):
+    """
+    Callback passado ao processador: publica progresso e interrompe o job se cancelado
+    """
+    def progresso(linha=None, processadas=None, total=None):
+        if _cancelamentos[file_id].is_set() or os.path.exists(caminho_cancelamento(file_id)):
+            raise JobCancelado()
+        
+        campos = {}
+        if processadas is not None:
+            campos['processadas'] = processadas
+        if total is not None:
+            campos['total'] = total
+        if campos:
+            job = _atualizar(file_id, **campos)
+            if job['total']:
+                campos['percentual'] = round(100 * job['processadas'] / job['total'], 1)
+        publicar(file_id, linha, **campos)
+    
+    return progresso
+
+def _executar_job(file_id):
+    """
+    Executa um job da fila com o processador registrado
+    """
+    with _lock:
+        job = jobs.get(file_id)
+        if job is None or job['status'] not in STATUS_PENDENTES:
+            return
+        if os.path.exists(caminho_cancelamento(file_id)):
+            job.update(status='cancelled', completed_at=datetime.now().isoformat())
+            _salvar_estado(job)
+            cancelado = True
+        else:
+            job.update(status='running', started_at=datetime.now().isoformat())
+            _salvar_estado(job)
+            job = dict(job)
+            cancelado = False
+    
+    if cancelado:
+        publicar(file_id, 'Processamento cancelado')
+        _descartar(file_id)
+        return
+    
+    publicar(file_id, 'Processamento iniciado', status='running')
+    
+    try:
+        resultado = _processador(job, _criar_callback_progresso(file_id))
+        _atualizar(file_id, status='completed', resultado=resultado,
+                   completed_at=datetime.now().isoformat())
+        publicar(file_id, 'Processamento concluído!')
+    except JobCancelado:
+        _atualizar(file_id, status='cancelled', completed_at=datetime.now().isoformat())
+        publicar(file_id, 'Processamento cancelado')
+    except Exception as e:
+        _atualizar(file_id, status='error', error=str(e), completed_at=datetime.now().isoformat())
+        publicar(file_id, f'ERRO: {str(e)}')
+    finally:
+        _descartar(file_id)
+
+def _worker():
+    """
+    Loop de um worker: pega jobs da fila até o processo terminar
+    """
+    while True:
+        file_id = _fila.get()
+        try:
+            _executar_job(file_id)
+        finally:
+            _fila.task_done()
+
+def _orfao(job):
+    return job is not None and job.get('status') in STATUS_PENDENTES and not _dono_vivo(job)
+
+def _retomar_jobs_pendentes():
+    """
+    Recoloca na fila os jobs persistidos que não terminaram e cujo dono morreu
+    (ex.: servidor reiniciado); jobs de outros processos vivos ficam com eles
+    """
+    retomados = 0
+    for caminho in sorted(glob.glob(os.path.join(DIRETORIO_UPLOADS, '*_job.json'))):
+        file_id = os.path.basename(caminho)[:-len('_job.json')]
+        if file_id in jobs or not _orfao(_ler_estado(file_id)):
+            continue
+        
+        # Reler e assumir o job sob o lock: outro processo pode estar retomando também
+        with armazenamento.bloqueio_arquivo(CAMINHO_LOCK_FILA):
+            job = _ler_estado(file_id)
+            if not _orfao(job):
+                continue
+            job.update(status='queued', dono=_dono(), heartbeat=time.time())
+            with _lock:
+                _registrar(job)
+                _salvar_estado(job)
+        _fila.put(file_id)
+        retomados += 1
+    
+    if retomados:
+        print(f"✓ {retomados} upload(s) pendente(s) recolocado(s) na fila")
+
+def _heartbeat():
+    """
+    Renova o heartbeat dos jobs deste processo e, a cada PRAZO_HEARTBEAT,
+    retoma jobs de processos que morreram
+    """
+    ultima_retomada = time.monotonic()
+    while True:
+        time.sleep(INTERVALO_HEARTBEAT)
+        with _lock:
+            ativos = list(jobs)
+        for file_id in ativos:
+            try:
+                _atualizar(file_id, heartbeat=time.time())
+            except KeyError:
+                # Terminou enquanto isso
+                pass
+        if time.monotonic() - ultima_retomada >= PRAZO_HEARTBEAT:
+            ultima_retomada = time.monotonic()
+            try:
+                _retomar_jobs_pendentes()
+            except Exception as e:
+                print(f"⚠ Erro ao retomar uploads pendentes: {e}")
+
+def iniciar_workers(processador, n_workers=MAX_WORKERS):
+    """
+    Registra o processador de jobs e inicia o pool de workers (apenas uma vez)
+    
+    processador(job, progresso) recebe o estado do job e um callback
+    progresso(linha=None, processadas=None, total=None); retorna o resumo
+    (dict) que fica em job['resultado'].
+    """
+    global _processador
+    
+    with _lock:
+        if _workers:
+            return
+        _processador = processador
+        os.makedirs(DIRETORIO_UPLOADS, exist_ok=True)
+        for i in range(max(1, n_workers)):
+            thread = threading.Thread(target=_worker, name=f'upload-worker-{i}', daemon=True)
+            thread.start()
+            _workers.append(thread)
+        threading.Thread(target=_heartbeat, name='upload-heartbeat', daemon=True).start()
+    
+    _retomar_jobs_pendentes()
@@ -7,8 +7,23 @@ Tenta múltiplos provedores LLM em ordem, com fallback automático.
 from dotenv import load_dotenv
 load_dotenv()
 
+import numpy as np
+import pandas as pd
+
 import llm_fallback
 
+# Provedores externos, na ordem em que são tentados
+PROVIDERS_EXTERNOS = [
+    ("OpenAI", "providers.openai"),
+    ("Anthropic", "providers.anthropic"),
+    ("Gemini", "providers.gemini"),
+    ("Groq", "providers.groq"),
+    ("XAI", "providers.xai"),
+]
+
+# Quantas descrições enviar por chamada aos provedores que suportam lote
+TAMANHO_LOTE_LLM = 25
+
 def classificar_com_llm(descricao: str, threshold_confianca: float = 0.7) -> dict:
     """
     Tenta classificar CATEGORIA usando LLM local primeiro, depois IA externa se necessário.
@@ -35,13 +50,7 @@ def classificar_com_llm(descricao: str, threshold_confianca: float = 0.7) -> dic
     # 3. Se confiança baixa, tentar IA externa
     print(f"AVISO: Confiança do LLM local baixa ({resultado_fallback['confianca']:.2f}), tentando IA externa...")
     
-    providers = [
-        ("OpenAI", "providers.openai"),
-        ("Anthropic", "providers.anthropic"),
-        ("Gemini", "providers.gemini"),
-        ("Groq", "providers.groq"),
-        ("XAI", "providers.xai"),
-    ]
+    providers = PROVIDERS_EXTERNOS
     
     melhor_resultado = resultado_fallback
     melhor_subcategoria = resultado_subcategoria_fallback
@@ -142,6 +151,98 @@ def classificar_hibrido(descricao: str, categoria_ml: str = None, confianca_ml:
     }
 
 
+def _classificar_lote_provider(module, descricoes):
+    """
+    Classifica uma lista de descrições com um provider externo.
+    Usa classificar_categorias_lote (uma chamada) se o provider suportar,
+    senão chama classificar_categoria item a item (itens que falham ficam None).
+    """
+    if hasattr(module, 'classificar_categorias_lote'):
+        return module.classificar_categorias_lote(descricoes)
+    
+    resultados = []
+    for descricao in descricoes:
+        try:
+            resultados.append(module.classificar_categoria(descricao))
+        except Exception:
+            resultados.append(None)
+    return resultados
+
+
+def classificar_com_llm_lote(descricoes, threshold_confianca: float = 0.7,
+                             confianca_ml=None, tamanho_lote: int = TAMANHO_LOTE_LLM,
+                             progresso=None) -> pd.DataFrame:
+    """
+    Versão em lote de classificar_com_llm.
+    1. Fallback local vetorizado para todas as descrições
+    2. IA externa apenas para as linhas com confiança ainda baixa
+       (fallback abaixo do threshold e, se informado, ML também abaixo),
+       enviadas em lotes de `tamanho_lote`
+    
+    progresso (opcional) é chamado com uma mensagem após cada lote enviado
+    
+    Retorno: DataFrame (mesma ordem da entrada) com colunas
+    categoria, confianca, provider, subcategoria, confianca_subcategoria
+    """
+    descricoes = pd.Series(descricoes, dtype=object).fillna('').astype(str).reset_index(drop=True)
+    
+    # 1. Fallback local (vetorizado)
+    resultado = llm_fallback.classificar_categorias_lote(descricoes)
+    subcategorias = llm_fallback.classificar_subcategorias_lote(descricoes)
+    resultado['subcategoria'] = subcategorias['subcategoria']
+    resultado['confianca_subcategoria'] = subcategorias['confianca']
+    
+    # 2. Escalar apenas o que continua com confiança baixa
+    baixa = resultado['confianca'].to_numpy() < threshold_confianca
+    if confianca_ml is not None:
+        baixa &= np.asarray(confianca_ml, dtype=float) < threshold_confianca
+    pendentes = np.flatnonzero(baixa)
+    
+    print(f"LLM em lote: {len(descricoes) - len(pendentes)}/{len(descricoes)} resolvidas localmente, "
+          f"{len(pendentes)} enviadas para IA externa")
+    
+    for provider_name, provider_module in PROVIDERS_EXTERNOS:
+        if len(pendentes) == 0:
+            break
+        try:
+            module = __import__(provider_module, fromlist=['classificar_categoria'])
+        except Exception as e:
+            print(f"ERRO {provider_name} falhou: {str(e)}")
+            continue
+        
+        melhoradas = []
+        for inicio in range(0, len(pendentes), tamanho_lote):
+            lote = pendentes[inicio:inicio + tamanho_lote]
+            try:
+                resultados_lote = _classificar_lote_provider(module, descricoes.iloc[lote].tolist())
+            except Exception as e:
+                resultados_lote = []
+                print(f"ERRO {provider_name} falhou no lote: {str(e)}")
+            
+            # Lote inteiro sem resposta: provider fora do ar, passar para o próximo
+            if not any(resultados_lote):
+                break
+            
+            if progresso is not None:
+                progresso(f"{provider_name}: {min(inicio + tamanho_lote, len(pendentes))}/{len(pendentes)} enviadas")
+            
+            for i, resultado_categoria in zip(lote, resultados_lote):
+                # Se IA externa tem confiança melhor que fallback, usar
+                if resultado_categoria and resultado_categoria['confianca'] > resultado.at[i, 'confianca']:
+                    resultado.at[i, 'categoria'] = resultado_categoria['categoria']
+                    resultado.at[i, 'confianca'] = resultado_categoria['confianca']
+                    resultado.at[i, 'provider'] = resultado_categoria.get('provider', provider_name.lower())
+                    melhoradas.append(i)
+        
+        if melhoradas:
+            # A subcategoria continua a do fallback (nenhum provider externo classifica
+            # subcategoria, e o fallback não depende da categoria escolhida)
+            print(f"OK {len(melhoradas)} classificações melhoradas usando {provider_name}")
+            pendentes = np.setdiff1d(pendentes, melhoradas)
+    
+    return resultado
+
+
 if __name__ == "__main__":
     # Teste rápido
     print("=== TESTE DE CLASSIFICAÇÃO LLM ===\n")
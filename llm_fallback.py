@@ -4,6 +4,9 @@ Fallback LLM - Classificação baseada em palavras-chave
 Funciona sem necessidade de chaves API.
 """
 
+import numpy as np
+import pandas as pd
+
 # Dicionário de palavras-chave para as 7 CATEGORIAS corretas (melhorado)
 KEYWORDS_MAP_CATEGORIA = {
     "CUSTOS FIXOS": [
@@ -161,3 +164,77 @@ def classificar_subcategoria(descricao: str, categoria: str = None) -> dict:
         "provider": "fallback"
     }
 
+
+
+def _contar_matches_lote(descricoes, mapa_keywords):
+    """
+    Conta, para várias descrições de uma vez, quantas palavras-chave de cada
+    classe aparecem em cada descrição.
+    Retorna (nomes_das_classes, matriz n_descricoes x n_classes, total_keywords_por_classe)
+    """
+    descricoes_lower = pd.Series(descricoes, dtype=object).fillna('').astype(str).str.lower()
+    
+    nomes = [nome for nome, keywords in mapa_keywords.items() if keywords]
+    contagens = np.zeros((len(descricoes_lower), len(nomes)), dtype=np.int32)
+    
+    # Uma passada vetorizada por palavra-chave (não por linha)
+    for j, nome in enumerate(nomes):
+        for keyword in mapa_keywords[nome]:
+            contagens[:, j] += descricoes_lower.str.contains(keyword, regex=False).to_numpy(dtype=np.int32)
+    
+    totais = np.array([len(mapa_keywords[nome]) for nome in nomes], dtype=np.float64)
+    return nomes, contagens, totais
+
+def _confianca_lote(max_matches, total_keywords, bonus_a_partir_de):
+    """
+    Versão vetorizada da fórmula de confiança usada em classificar_categoria/classificar_subcategoria
+    """
+    confianca_base = np.minimum(max_matches * 0.25, 0.8)
+    confianca_proporcao = np.minimum(max_matches / np.maximum(total_keywords, 1) * 0.3, 0.2)
+    confianca = np.minimum(confianca_base + confianca_proporcao, 0.95)
+    return np.where(max_matches >= bonus_a_partir_de, np.minimum(confianca + 0.1, 0.95), confianca)
+
+def classificar_categorias_lote(descricoes) -> pd.DataFrame:
+    """
+    Classifica CATEGORIA de várias descrições de uma vez (mesmo resultado de
+    classificar_categoria aplicado linha a linha, mas sem loop por linha)
+    
+    Retorno: DataFrame com colunas categoria, confianca, provider
+    """
+    nomes, contagens, totais = _contar_matches_lote(descricoes, KEYWORDS_MAP_CATEGORIA)
+    
+    # argmax devolve o primeiro máximo, igual ao max() sobre o dicionário
+    idx = contagens.argmax(axis=1)
+    max_matches = contagens[np.arange(len(idx)), idx]
+    encontrou = max_matches > 0
+    
+    categorias = np.where(encontrou, np.array(nomes, dtype=object)[idx], "CATEGORIZAR")
+    confiancas = np.where(encontrou, _confianca_lote(max_matches, totais[idx], 3), 0.3)
+    
+    return pd.DataFrame({
+        "categoria": categorias,
+        "confianca": confiancas.astype(float),
+        "provider": "fallback"
+    })
+
+def classificar_subcategorias_lote(descricoes) -> pd.DataFrame:
+    """
+    Classifica SUBCATEGORIA de várias descrições de uma vez (versão vetorizada
+    de classificar_subcategoria)
+    
+    Retorno: DataFrame com colunas subcategoria, confianca, provider
+    """
+    nomes, contagens, totais = _contar_matches_lote(descricoes, KEYWORDS_MAP_SUBCATEGORIA)
+    
+    idx = contagens.argmax(axis=1)
+    max_matches = contagens[np.arange(len(idx)), idx]
+    encontrou = max_matches > 0
+    
+    subcategorias = np.where(encontrou, np.array(nomes, dtype=object)[idx], "")
+    confiancas = np.where(encontrou, _confianca_lote(max_matches, totais[idx], 2), 0.2)
+    
+    return pd.DataFrame({
+        "subcategoria": subcategorias,
+        "confianca": confiancas.astype(float),
+        "provider": "fallback"
+    })
@@ -0,0 +1,146 @@
+"""
+Loop de Treinamento
+===================
+Loop usado pelos modelos de categoria e subcategoria, no lugar de um número
+fixo de épocas com lotes pequenos:
+
+- early stopping pela loss de validação, restaurando os melhores pesos
+- validação separada das linhas de treino (FRACAO_VALIDACAO, estratificada),
+  para que o conjunto de teste fique só para a avaliação final
+- redução da taxa de aprendizado quando a validação para de melhorar
+- tamanho de lote proporcional ao tamanho da base (potência de 2, com o
+  lote antigo como mínimo), para um número parecido de passos por época
+- relatório de tempo até a acurácia: época e segundos em que a validação
+  chegou a FRACAO_ALVO da melhor acurácia
+
+As épocas de cada script (EPOCAS) viram o máximo permitido.
+"""
+
+import time
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+from tensorflow.keras.callbacks import Callback, EarlyStopping, ReduceLROnPlateau
+
+# Fração das linhas de treino usada como validação (early stopping e LR)
+FRACAO_VALIDACAO = 0.1
+# Early stopping
+PACIENCIA = 10
+# Redução da taxa de aprendizado
+PACIENCIA_LR = 4
+FATOR_LR = 0.5
+LR_MINIMO = 1e-5
+# Lote adaptativo
+PASSOS_POR_EPOCA = 50
+LOTE_MAXIMO = 256
+# Relatório de tempo até a acurácia
+FRACAO_ALVO = 0.99
+
+def tamanho_lote(amostras, minimo, maximo=LOTE_MAXIMO, passos=PASSOS_POR_EPOCA):
+    """
+    Menor potência de 2 que faz a época caber em ~passos lotes, entre minimo e maximo
+    """
+    lote = 1
+    while lote * passos < amostras and lote < maximo:
+        lote *= 2
+    return max(minimo, min(lote, maximo))
+
+def separar_validacao(X, y, fracao=FRACAO_VALIDACAO):
+    """
+    Separa uma fração das linhas de treino para validação, estratificada
+    quando toda classe tem ao menos 2 exemplos e a fração cabe uma de cada
+    
+    Retorno: (X_treino, X_validacao, y_treino, y_validacao)
+    """
+    _, contagens = np.unique(y, return_counts=True)
+    estratificar = contagens.min() >= 2 and int(np.ceil(len(y) * fracao)) >= len(contagens)
+    return train_test_split(X, y, test_size=fracao, random_state=42, stratify=y if estratificar else None)
+
+class TempoAteAcuracia(Callback):
+    """
+    Registra o tempo e a acurácia de validação de cada época
+    """
+    
+    def __init__(self, fracao=FRACAO_ALVO):
+        super().__init__()
+        self.fracao = fracao
+        self.epocas = []
+    
+    def on_train_begin(self, logs=None):
+        self.inicio = time.perf_counter()
+        self.epocas = []
+    
+    def on_epoch_end(self, epoch, logs=None):
+        self.epocas.append((time.perf_counter() - self.inicio, (logs or {}).get('val_accuracy')))
+    
+    def relatorio(self):
+        """
+        Retorno: {'epocas', 'tempo_total', 'melhor_acuracia', 'epoca_melhor',
+                  'acuracia_alvo', 'epoca_alvo', 'tempo_ate_alvo'}
+        """
+        relatorio = {
+            'epocas': len(self.epocas),
+            'tempo_total': self.epocas[-1][0] if self.epocas else 0.0,
+        }
+        acuracias = [acuracia for _, acuracia in self.epocas if acuracia is not None]
+        if not acuracias:
+            return relatorio
+        
+        melhor = max(acuracias)
+        alvo = melhor * self.fracao
+        epoca_alvo, (tempo_alvo, _) = next(
+            (i, epoca) for i, epoca in enumerate(self.epocas) if epoca[1] is not None and epoca[1] >= alvo
+        )
+        relatorio.update(
+            melhor_acuracia=float(melhor),
+            epoca_melhor=[acuracia for _, acuracia in self.epocas].index(melhor) + 1,
+            acuracia_alvo=float(alvo),
+            epoca_alvo=epoca_alvo + 1,
+            tempo_ate_alvo=tempo_alvo,
+        )
+        return relatorio
+
+def descrever(relatorio):
+    """
+    Resumo do relatório em uma linha
+    """
+    texto = f"{relatorio['epocas']} épocas em {relatorio['tempo_total']:.1f}s"
+    if 'melhor_acuracia' in relatorio:
+        texto += (f" | melhor val_accuracy {relatorio['melhor_acuracia']:.4f} na época {relatorio['epoca_melhor']}"
+                  f" | {relatorio['acuracia_alvo']:.4f} atingida na época {relatorio['epoca_alvo']}"
+                  f" ({relatorio['tempo_ate_alvo']:.1f}s)")
+    return texto
+
+def treinar(modelo, X_treino, y_treino, epocas_maximas, lote_minimo,
+            callbacks=None, verbose=1, paciencia=PACIENCIA, paciencia_lr=PACIENCIA_LR,
+            lote_maximo=LOTE_MAXIMO, validacao=None):
+    """
+    Treina com early stopping, redução da taxa de aprendizado e lote adaptativo
+    
+    - lote_maximo: igual a lote_minimo fixa o tamanho do lote
+    - validacao: (X, y) monitorado pelos callbacks; sem ele, separar_validacao
+      tira a validação das próprias linhas de treino. Nunca passe o conjunto
+      usado para medir a acurácia final.
+    
+    Retorno: (History do Keras, relatório de tempo até a acurácia)
+    """
+    if validacao is None:
+        X_treino, X_validacao, y_treino, y_validacao = separar_validacao(X_treino, y_treino)
+        validacao = (X_validacao, y_validacao)
+    
+    tempo = TempoAteAcuracia()
+    callbacks = [
+        EarlyStopping(monitor='val_loss', patience=paciencia, restore_best_weights=True),
+        ReduceLROnPlateau(monitor='val_loss', factor=FATOR_LR, patience=paciencia_lr, min_lr=LR_MINIMO),
+        tempo,
+    ] + list(callbacks or [])
+    
+    resultado = modelo.fit(
+        X_treino, y_treino,
+        validation_data=validacao,
+        epochs=epocas_maximas,
+        batch_size=tamanho_lote(len(X_treino), lote_minimo, lote_maximo),
+        callbacks=callbacks,
+        verbose=verbose
+    )
+    return resultado, tempo.relatorio()
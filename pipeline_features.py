@@ -0,0 +1,221 @@
+"""
+Pipeline de Features
+====================
+Todos os transformadores ajustados dos modelos de categoria e subcategoria
+(TF-IDF, normalizadores, encoders de rótulos, categorias e tags) ficam em um
+único artefato, data/saved_models/feature_pipeline.joblib, acompanhado de um
+manifesto (feature_pipeline.json) com versão do formato, componentes e
+SHA-256 do arquivo.
+
+O mesmo código monta as features no treinamento (train_model_*.py,
+treinamento.py) e na classificação (app.py), então as duas pontas não podem
+divergir. O artefato é gravado sem compressão para que os arrays numéricos
+(idf, médias e escalas) sejam abertos com memory-map.
+
+Modelos salvos antes do artefato (um .pkl por transformador) continuam sendo
+carregados por carregar_legado.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+
+DIRETORIO_MODELOS = 'data/saved_models'
+ARQUIVO_PIPELINE = 'feature_pipeline.joblib'
+ARQUIVO_MANIFESTO = 'feature_pipeline.json'
+
+# Versão do formato do artefato (muda quando os componentes mudam)
+VERSAO_FORMATO = 1
+
+COMPONENTES = [
+    'tfidf_categoria', 'scaler_categoria', 'label_encoder_categoria',
+    'tfidf_subcategoria', 'scaler_subcategoria', 'label_encoder_subcategoria',
+    'categoria_encoder', 'categoria_onehot', 'tags_encoder', 'tags_onehot',
+]
+
+# Arquivos do formato antigo (um por componente)
+ARQUIVOS_LEGADOS = {
+    'tfidf_categoria': 'category_tfidf.pkl',
+    'scaler_categoria': 'category_scaler_X.pkl',
+    'label_encoder_categoria': 'category_label_encoder.pkl',
+    'tfidf_subcategoria': 'subcategoria_tfidf.pkl',
+    'scaler_subcategoria': 'subcategoria_scaler_X.pkl',
+    'label_encoder_subcategoria': 'subcategoria_label_encoder.pkl',
+    'categoria_encoder': 'subcategoria_categoria_encoder.pkl',
+    'categoria_onehot': 'subcategoria_categoria_onehot.pkl',
+    'tags_encoder': 'subcategoria_tags_encoder.pkl',
+    'tags_onehot': 'subcategoria_tags_onehot.pkl',
+}
+
+class PipelineFeatures:
+    """
+    Transformadores ajustados dos dois modelos
+    
+    Componentes ausentes ficam None (ex.: só o modelo de categoria treinado,
+    ou modelo de subcategoria antigo sem tags). Quando os dois modelos são
+    treinados juntos, tfidf_categoria e tfidf_subcategoria são o mesmo objeto.
+    """
+    
+    def __init__(self, **componentes):
+        for nome in COMPONENTES:
+            setattr(self, nome, componentes.get(nome))
+    
+    @property
+    def categoria_disponivel(self):
+        return all(getattr(self, nome) is not None for nome in COMPONENTES[:3])
+    
+    @property
+    def subcategoria_disponivel(self):
+        return all(getattr(self, nome) is not None for nome in COMPONENTES[3:8])
+    
+    @property
+    def tfidf_compartilhado(self):
+        return self.tfidf_categoria is not None and self.tfidf_categoria is self.tfidf_subcategoria
+
+def _sha256(caminho):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+def salvar(pipeline, diretorio=DIRETORIO_MODELOS):
+    """
+    Grava o artefato e o manifesto (temporário + rename; o manifesto por último)
+    
+    Retorno: manifesto
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = os.path.join(diretorio, ARQUIVO_PIPELINE)
+    temporario = f'{caminho}.tmp'
+    # Sem compressão: permite memory-map dos arrays na leitura
+    joblib.dump({nome: getattr(pipeline, nome) for nome in COMPONENTES}, temporario)
+    
+    sha256 = _sha256(temporario)
+    manifesto = {
+        'formato': VERSAO_FORMATO,
+        'versao': sha256[:16],
+        'criado_em': datetime.now().isoformat(),
+        'arquivo': ARQUIVO_PIPELINE,
+        'tamanho': os.path.getsize(temporario),
+        'sha256': sha256,
+        'tfidf_compartilhado': pipeline.tfidf_compartilhado,
+        'componentes': {
+            nome: type(getattr(pipeline, nome)).__name__
+            for nome in COMPONENTES if getattr(pipeline, nome) is not None
+        },
+    }
+    os.replace(temporario, caminho)
+    
+    caminho_manifesto = os.path.join(diretorio, ARQUIVO_MANIFESTO)
+    with open(f'{caminho_manifesto}.tmp', 'w') as f:
+        json.dump(manifesto, f, indent=2)
+    os.replace(f'{caminho_manifesto}.tmp', caminho_manifesto)
+    return manifesto
+
+def carregar(diretorio=DIRETORIO_MODELOS, verificar=True):
+    """
+    Lê o artefato (uma leitura, arrays numéricos com memory-map)
+    
+    Levanta FileNotFoundError sem manifesto e ValueError se o formato ou o
+    checksum não conferem.
+    """
+    with open(os.path.join(diretorio, ARQUIVO_MANIFESTO), 'r') as f:
+        manifesto = json.load(f)
+    if manifesto.get('formato') != VERSAO_FORMATO:
+        raise ValueError(f"Formato do pipeline de features não suportado: {manifesto.get('formato')}")
+    
+    caminho = os.path.join(diretorio, manifesto['arquivo'])
+    if verificar and _sha256(caminho) != manifesto['sha256']:
+        raise ValueError(f"Checksum do pipeline de features não confere: {caminho}")
+    
+    return PipelineFeatures(**joblib.load(caminho, mmap_mode='r'))
+
+def carregar_legado(diretorio=DIRETORIO_MODELOS):
+    """
+    Monta o pipeline a partir dos .pkl do formato antigo (os que existirem)
+    """
+    componentes = {}
+    for nome, arquivo in ARQUIVOS_LEGADOS.items():
+        caminho = os.path.join(diretorio, arquivo)
+        if os.path.exists(caminho):
+            componentes[nome] = joblib.load(caminho)
+    return PipelineFeatures(**componentes)
+
+def carregar_ou_criar(diretorio=DIRETORIO_MODELOS):
+    """
+    Pipeline salvo (artefato ou .pkl antigos) ou um vazio; usado quando um
+    script treina só um dos modelos e precisa manter os componentes do outro
+    """
+    try:
+        return carregar(diretorio)
+    except FileNotFoundError:
+        return carregar_legado(diretorio)
+
+def normalizar_tags(tags, n):
+    """
+    Tags como texto sem espaços nas pontas; vazio/NaN/None viram ''
+    """
+    if tags is None:
+        return pd.Series([''] * n, dtype=object)
+    return pd.Series(list(tags), dtype=object).fillna('').astype(str).str.strip()
+
+def onehot(valores, encoder, onehot_encoder):
+    """
+    One-hot de vários valores de uma vez; valores fora do encoder viram linha de zeros
+    """
+    indice = {classe: i for i, classe in enumerate(encoder.classes_)}
+    codigos = np.array([indice.get(v, -1) for v in valores], dtype=int)
+    features = np.zeros((len(codigos), len(encoder.classes_)))
+    conhecidos = codigos >= 0
+    if conhecidos.any():
+        features[conhecidos] = onehot_encoder.transform(codigos[conhecidos].reshape(-1, 1))
+    return features
+
+def matriz_categoria(pipeline, descricoes, texto=None):
+    """
+    Features (sem normalizar) do modelo de categoria: TF-IDF da descrição
+    
+    - texto: TF-IDF já calculado para as descrições (reaproveitado entre modelos)
+    """
+    if texto is None:
+        texto = pipeline.tfidf_categoria.transform(list(descricoes))
+    return texto.toarray()
+
+def matriz_subcategoria(pipeline, descricoes, valores, categorias, tags=None, texto=None):
+    """
+    Features (sem normalizar) do modelo de subcategoria: TF-IDF da descrição,
+    valor, categoria (one-hot) e tags (one-hot)
+    """
+    if texto is None:
+        texto = pipeline.tfidf_subcategoria.transform(list(descricoes))
+    n = texto.shape[0]
+    
+    numeric_features = np.asarray(valores, dtype=float).reshape(-1, 1)
+    categoria_features = onehot(categorias, pipeline.categoria_encoder, pipeline.categoria_onehot)
+    if pipeline.tags_encoder is not None and pipeline.tags_onehot is not None:
+        tags_features = onehot(normalizar_tags(tags, n), pipeline.tags_encoder, pipeline.tags_onehot)
+    else:
+        # Modelo antigo sem tags - usar zeros
+        tags_features = np.zeros((n, 1))
+    
+    return np.hstack([texto.toarray(), numeric_features, categoria_features, tags_features])
+
+def features_categoria(pipeline, descricoes, texto=None):
+    """
+    Features normalizadas prontas para o modelo de categoria
+    """
+    return pipeline.scaler_categoria.transform(matriz_categoria(pipeline, descricoes, texto))
+
+def features_subcategoria(pipeline, descricoes, valores, categorias, tags=None, texto=None):
+    """
+    Features normalizadas prontas para o modelo de subcategoria
+    """
+    return pipeline.scaler_subcategoria.transform(
+        matriz_subcategoria(pipeline, descricoes, valores, categorias, tags, texto)
+    )
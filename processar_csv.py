@@ -9,8 +9,10 @@ import numpy as np
 import joblib
 from tensorflow.keras.models import load_model
 from datetime import datetime
+import hashlib
 import os
-import llm_classifier
+import cache_classificacao
+import classificacao_lote
 
 # Variáveis globais
 modelo = None
@@ -32,41 +34,77 @@ def carregar_modelo():
     except:
         return False
 
+def versao_modelo(ml_disponivel):
+    """
+    Versão da classificação deste script, gravada nos checkpoints: muda com os
+    artefatos salvos, o código de classificação/providers
+    (cache_classificacao.versao_classificacao), este arquivo e o uso do ML,
+    então checkpoints de um modelo anterior são descartados
+    """
+    with open(os.path.abspath(__file__), 'rb') as f:
+        codigo = hashlib.sha256(f.read()).hexdigest()
+    partes = f"{cache_classificacao.versao_classificacao()}:{codigo}:{ml_disponivel}"
+    return hashlib.sha256(partes.encode()).hexdigest()[:16]
+
 def classificar_ml(descricao, valor, data_despesa=None):
     """Classifica usando ML"""
+    resultado = classificar_ml_lote([descricao], [valor], datas=[data_despesa])
+    if resultado is None:
+        return None
+    return resultado.iloc[0].to_dict()
+
+def classificar_ml_lote(descricoes, valores, tags=None, datas=None):
+    """Classifica várias despesas com ML em uma única chamada ao modelo"""
     if modelo is None:
         return None
     
     try:
-        if data_despesa is None:
-            data_despesa = datetime.now()
-        else:
-            data_despesa = pd.to_datetime(data_despesa)
+        n = len(descricoes)
+        if datas is None:
+            datas = [None] * n
+        datas = pd.to_datetime(pd.Series(list(datas)), errors='coerce').fillna(pd.Timestamp(datetime.now()))
         
-        text_features = tfidf.transform([descricao]).toarray()
-        numeric_features = np.array([[valor]])
-        mes = data_despesa.month
-        dia_semana = data_despesa.dayofweek
-        temporal_features = np.array([[mes, dia_semana]])
+        text_features = tfidf.transform(list(descricoes)).toarray()
+        numeric_features = np.asarray(valores, dtype=float).reshape(-1, 1)
+        temporal_features = np.column_stack([datas.dt.month.to_numpy(), datas.dt.dayofweek.to_numpy()])
         
         features = np.hstack([text_features, numeric_features, temporal_features])
         features_normalized = scaler_X.transform(features)
         
-        predicao = modelo.predict(features_normalized, verbose=0)
-        categoria_idx = np.argmax(predicao[0])
-        confianca = float(predicao[0][categoria_idx])
-        categoria = label_encoder.inverse_transform([categoria_idx])[0]
+        predicao = modelo.predict(features_normalized, batch_size=1024, verbose=0)
+        categoria_idx = np.argmax(predicao, axis=1)
         
-        return {
-            "categoria": categoria,
-            "confianca": confianca
-        }
+        return pd.DataFrame({
+            "categoria": label_encoder.inverse_transform(categoria_idx),
+            "confianca": predicao[np.arange(n), categoria_idx].astype(float)
+        })
     except:
         return None
 
-def processar_csv(input_file, output_file):
+def formatar_saida(df, resultado):
+    """
+    Adiciona as colunas de classificação (confianças em %) ao DataFrame
+    """
+    df['Categoria_ML'] = resultado['Categoria_ML'].to_numpy()
+    df['Confianca_ML'] = [f"{c*100:.1f}%" for c in resultado['Confianca_ML']]
+    df['Categoria_LLM'] = resultado['Categoria_LLM'].to_numpy()
+    df['Confianca_LLM'] = [f"{c*100:.1f}%" for c in resultado['Confianca_LLM']]
+    df['Categoria_OpenAI'] = resultado['Categoria_OpenAI'].to_numpy()
+    df['Confianca_OpenAI'] = [f"{c*100:.1f}%" for c in resultado['Confianca_OpenAI']]
+    return df
+
+def processar_csv(input_file, output_file, chunksize=None, checkpoint=True, workers=1):
     """
     Processa CSV completo e adiciona colunas de classificação
+    
+    Com chunksize, lê e grava o arquivo em chunks (modo streaming): a memória
+    fica limitada ao tamanho do chunk, qualquer que seja o tamanho do arquivo.
+    Nesse modo cada chunk concluído vira um checkpoint em <saida>.parts/, e
+    rodar de novo com a mesma entrada continua de onde parou.
+    
+    Com workers > 1 (implica modo streaming), os chunks são classificados em
+    paralelo por N processos; cada processo carrega o modelo uma única vez e a
+    saída mantém a ordem original das linhas.
     """
     print(f"Processando {input_file}...")
     
@@ -77,6 +115,31 @@ def processar_csv(input_file, output_file):
     else:
         print("Modelo ML não disponível, usando apenas LLM")
     
+    if workers > 1 and not chunksize:
+        chunksize = classificacao_lote.TAMANHO_CHUNK
+    
+    if chunksize:
+        print(f"Modo streaming: chunks de {chunksize} linhas")
+        if workers > 1:
+            print(f"Processos paralelos: {workers}")
+        resumo = classificacao_lote.classificar_csv_em_chunks(
+            input_file,
+            output_file,
+            classificador_ml=classificar_ml_lote if ml_disponivel else None,
+            chunksize=chunksize,
+            formatar=formatar_saida,
+            checkpoint=checkpoint,
+            workers=workers,
+            versao=versao_modelo(ml_disponivel),
+            inicializador=carregar_modelo if ml_disponivel else None,
+            datas_na_chave=True
+        )
+        print("\nProcessamento concluído!")
+        print(f"Arquivo salvo: {output_file}")
+        print(f"Total processado: {resumo['total_rows']} transações")
+        print(f"Deduplicação: {resumo['valid_rows']} linhas -> {resumo['unique_rows']} únicas ({resumo['dedupe_ratio']:.1f}x)")
+        return resumo
+    
     # Ler CSV
     try:
         df = pd.read_csv(input_file, encoding='utf-8')
@@ -86,18 +149,7 @@ def processar_csv(input_file, output_file):
     print(f"Total de linhas: {len(df)}")
     
     # Detectar colunas (flexível)
-    col_descricao = None
-    col_valor = None
-    col_data = None
-    
-    for col in df.columns:
-        col_upper = col.upper()
-        if 'DESCRI' in col_upper or 'DESCRICAO' in col_upper:
-            col_descricao = col
-        if 'VALOR' in col_upper:
-            col_valor = col
-        if 'DATA' in col_upper or 'DATE' in col_upper:
-            col_data = col
+    col_descricao, col_valor, col_data = classificacao_lote.detectar_colunas(df.columns)
     
     if not col_descricao:
         raise ValueError("Coluna de descrição não encontrada!")
@@ -106,86 +158,45 @@ def processar_csv(input_file, output_file):
     
     print(f"Colunas detectadas: descrição={col_descricao}, valor={col_valor}, data={col_data}")
     
-    # Processar cada linha
-    resultados_ml = []
-    resultados_llm = []
-    resultados_openai = []
-    confianca_ml = []
-    confianca_llm = []
-    confianca_openai = []
-    
-    for idx, row in df.iterrows():
-        descricao = str(row[col_descricao]) if pd.notna(row[col_descricao]) else ""
-        valor = float(row[col_valor]) if pd.notna(row[col_valor]) else 0.0
-        data = row[col_data] if col_data and pd.notna(row[col_data]) else None
-        
-        if not descricao or valor <= 0:
-            resultados_ml.append("")
-            resultados_llm.append("")
-            resultados_openai.append("")
-            confianca_ml.append(0.0)
-            confianca_llm.append(0.0)
-            confianca_openai.append(0.0)
-            continue
-        
-        # Classificar com ML
-        resultado_ml = classificar_ml(descricao, valor, data)
-        if resultado_ml:
-            resultados_ml.append(resultado_ml['categoria'])
-            confianca_ml.append(resultado_ml['confianca'])
-        else:
-            resultados_ml.append("")
-            confianca_ml.append(0.0)
-        
-        # Classificar com LLM (todos os providers)
-        try:
-            resultado_llm = llm_classifier.classificar_com_llm(descricao)
-            resultados_llm.append(resultado_llm['categoria'])
-            confianca_llm.append(resultado_llm['confianca'])
-            
-            # Tentar especificamente OpenAI
-            try:
-                from providers import openai as openai_provider
-                resultado_openai = openai_provider.classificar_categoria(descricao)
-                resultados_openai.append(resultado_openai['categoria'])
-                confianca_openai.append(resultado_openai['confianca'])
-            except:
-                resultados_openai.append(resultado_llm['categoria'])
-                confianca_openai.append(resultado_llm['confianca'])
-        except:
-            resultados_llm.append("")
-            confianca_llm.append(0.0)
-            resultados_openai.append("")
-            confianca_openai.append(0.0)
-        
-        if (idx + 1) % 10 == 0:
-            print(f"Processadas {idx + 1}/{len(df)} linhas...")
+    # Classificar em lote: cada (descrição, valor, tags, mês/dia da semana) distinta é classificada uma vez
+    resultado = classificacao_lote.classificar_lote(
+        df[col_descricao],
+        df[col_valor],
+        tags=df['tags'] if 'tags' in df.columns else None,
+        classificador_ml=classificar_ml_lote if ml_disponivel else None,
+        datas=df[col_data] if col_data else None,
+        datas_na_chave=True
+    )
     
     # Adicionar colunas ao DataFrame
-    df['Categoria_ML'] = resultados_ml
-    df['Confianca_ML'] = [f"{c*100:.1f}%" for c in confianca_ml]
-    df['Categoria_LLM'] = resultados_llm
-    df['Confianca_LLM'] = [f"{c*100:.1f}%" for c in confianca_llm]
-    df['Categoria_OpenAI'] = resultados_openai
-    df['Confianca_OpenAI'] = [f"{c*100:.1f}%" for c in confianca_openai]
+    df = formatar_saida(df, resultado)
     
     # Salvar resultado
     df.to_csv(output_file, index=False, encoding='utf-8-sig')
-    print(f"\nProcessamento concluído!")
+    print("\nProcessamento concluído!")
     print(f"Arquivo salvo: {output_file}")
     print(f"Total processado: {len(df)} transações")
+    dedup = resultado.attrs['deduplicacao']
+    print(f"Deduplicação: {dedup['linhas']} linhas -> {dedup['unicas']} únicas ({dedup['taxa']:.1f}x)")
     
     return df
 
 if __name__ == "__main__":
-    import sys
-    
-    if len(sys.argv) < 2:
-        print("Uso: python processar_csv.py <arquivo_entrada.csv> [arquivo_saida.csv]")
-        sys.exit(1)
-    
-    input_file = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else input_file.replace('.csv', '_processado.csv')
-    
-    processar_csv(input_file, output_file)
-
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Classifica todas as transações de um CSV (ML + LLM)")
+    parser.add_argument('arquivo_entrada', help="CSV de entrada")
+    parser.add_argument('arquivo_saida', nargs='?', help="CSV de saída (padrão: <entrada>_processado.csv)")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Modo streaming: processa N linhas por vez (memória limitada)")
+    parser.add_argument('--sem-checkpoint', action='store_true',
+                        help="No modo streaming, não gravar/retomar checkpoints por chunk")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Classifica os chunks em N processos paralelos (ex.: número de núcleos)")
+    args = parser.parse_args()
+    
+    input_file = args.arquivo_entrada
+    output_file = args.arquivo_saida or input_file.replace('.csv', '_processado.csv')
+    
+    processar_csv(input_file, output_file, chunksize=args.chunksize, checkpoint=not args.sem_checkpoint,
+                  workers=args.workers)
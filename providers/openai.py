@@ -39,3 +39,45 @@ def classificar_categoria(descricao: str) -> dict:
     except Exception as e:
         raise Exception(f"Erro OpenAI: {str(e)}")
 
+
+def classificar_categorias_lote(descricoes: list) -> list:
+    """
+    Classifica várias despesas em UMA chamada à OpenAI (uma categoria por linha, na mesma ordem)
+    """
+    try:
+        lista = "\n".join(f"{i + 1}. {descricao}" for i, descricao in enumerate(descricoes))
+        response = openai_Cliente.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {
+                    "role": "system",
+                    "content": "Você é um assistente financeiro. Classifique cada despesa da lista em UMA destas 7 categorias: CUSTOS FIXOS, CONFORTO, METAS, PRAZERES, LIBERDADE FINANCEIRA, CONHECIMENTO, ou CATEGORIZAR. Responda APENAS com uma categoria em MAIÚSCULAS por linha, na mesma ordem da lista, sem numeração."
+                },
+                {
+                    "role": "user",
+                    "content": f"Classifique estas despesas:\n{lista}"
+                }
+            ],
+            temperature=0.3,
+            max_tokens=12 * len(descricoes) + 20
+        )
+        
+        linhas = [l.strip().upper() for l in response.choices[0].message.content.strip().splitlines() if l.strip()]
+        if len(linhas) != len(descricoes):
+            raise Exception(f"resposta com {len(linhas)} linhas para {len(descricoes)} despesas")
+        
+        # Validar que está nas 7 categorias corretas
+        categorias_validas = ['CUSTOS FIXOS', 'CONFORTO', 'METAS', 'PRAZERES', 'LIBERDADE FINANCEIRA', 'CONHECIMENTO', 'CATEGORIZAR']
+        resultados = []
+        for linha in linhas:
+            categoria = linha.lstrip('0123456789.-) ').strip()
+            if categoria not in categorias_validas:
+                categoria = 'CATEGORIZAR'
+            resultados.append({
+                "categoria": categoria,
+                "confianca": 0.9,
+                "provider": "openai"
+            })
+        return resultados
+    except Exception as e:
+        raise Exception(f"Erro OpenAI (lote): {str(e)}")
@@ -0,0 +1,326 @@
+"""
+Quantização dos Modelos
+=======================
+Exporta os modelos Keras (float32, .h5) com os pesos das camadas Dense em
+int8 ou float16 e faz a inferência desses arquivos só com NumPy:
+
+- int8: escala simétrica por canal de saída, escala_j = max|W[:, j]| / 127 e
+  W[:, j] ≈ escala_j * q[:, j]; vieses continuam em float32
+- float16: pesos em meia precisão
+- NumPy não tem multiplicação de matrizes int8/float16 rápida (BLAS), então
+  os pesos são convertidos para float32 (já com a escala) uma vez, ao criar
+  o modelo, e a inferência é um h @ W + vies em float32 por camada
+
+O ganho é no arquivo exportado (4x menor em int8, 2x em float16) e no tempo
+de leitura; a inferência e a memória residente são as de pesos float32
+(mais a cópia quantizada), sem ganho de cache ou latência sobre o float32.
+
+O arquivo exportado (<modelo>.<formato>.npz, ao lado do .h5) guarda o
+SHA-256 do .h5 de origem e o relatório de acurácia: o app (MODELO_QUANTIZADO
+no .env) só usa a versão quantizada enquanto ela corresponde ao modelo
+treinado.
+
+Uso:
+    python quantizacao.py --formato int8
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+from tensorflow.keras.models import load_model
+
+import armazenamento
+import pipeline_features
+import rotulos
+import train_model_categoria
+import train_model_subcategoria
+
+DIRETORIO_MODELOS = 'data/saved_models'
+ARQUIVOS_MODELOS = {
+    'categoria': 'category_model.h5',
+    'subcategoria': 'subcategoria_model.h5',
+}
+FORMATOS = ('int8', 'float16')
+
+# Repetições na medição de latência de uma despesa
+REPETICOES_LATENCIA = 20
+
+def _softmax(x):
+    x = x - x.max(axis=1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=1, keepdims=True)
+    return x
+
+ATIVACOES = {
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'linear': lambda x: x,
+    'softmax': _softmax,
+}
+
+def _sha256(caminho):
+    h = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+class ModeloQuantizado:
+    """
+    Rede Dense com pesos em int8/float16 e o mesmo predict dos modelos Keras
+    
+    - camadas: lista de {'pesos', 'escalas' (só int8), 'vies', 'ativacao'}
+    
+    Os pesos reduzidos ficam em camadas (para salvar); predict usa a cópia
+    float32 desquantizada uma vez no construtor.
+    """
+    
+    def __init__(self, camadas, formato, meta=None):
+        self.camadas = camadas
+        self.formato = formato
+        self.meta = meta or {}
+        self._pesos = [self._desquantizar(camada) for camada in camadas]
+    
+    @staticmethod
+    def _desquantizar(camada):
+        pesos = camada['pesos'].astype(np.float32)
+        if camada['escalas'] is not None:
+            pesos *= camada['escalas']
+        return pesos
+    
+    def _propagar(self, h):
+        for pesos, camada in zip(self._pesos, self.camadas):
+            h = h @ pesos
+            h += camada['vies']
+            h = ATIVACOES[camada['ativacao']](h)
+        return h
+    
+    def predict(self, X, batch_size=None, verbose=0):
+        X = np.asarray(X, dtype=np.float32)
+        lote = batch_size or max(len(X), 1)
+        saidas = [self._propagar(X[inicio:inicio + lote]) for inicio in range(0, len(X), lote)]
+        if not saidas:
+            return np.zeros((0, len(self.camadas[-1]['vies'])), dtype=np.float32)
+        return np.concatenate(saidas)
+    
+    def count_params(self):
+        return sum(camada['pesos'].size + camada['vies'].size for camada in self.camadas)
+    
+    @property
+    def tamanho_bytes(self):
+        """
+        Bytes dos pesos quantizados (tamanho exportado, não a memória em uso)
+        """
+        return sum(
+            valor.nbytes for camada in self.camadas
+            for valor in (camada['pesos'], camada['escalas'], camada['vies']) if valor is not None
+        )
+
+def camadas_dense(modelo):
+    """
+    Pesos, vieses e ativação das camadas Dense (Dropout não tem pesos)
+    
+    Retorno: [(pesos float32, vies float32, ativacao)]
+    """
+    camadas = []
+    for camada in modelo.layers:
+        pesos = camada.get_weights()
+        if not pesos:
+            continue
+        ativacao = camada.get_config().get('activation') or 'linear'
+        if ativacao not in ATIVACOES:
+            raise ValueError(f"Ativação não suportada na quantização: {ativacao}")
+        camadas.append((np.asarray(pesos[0], dtype=np.float32), np.asarray(pesos[1], dtype=np.float32), ativacao))
+    return camadas
+
+def quantizar(modelo, formato='int8'):
+    """
+    Versão quantizada de um modelo Keras (Sequential de camadas Dense/Dropout)
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato não suportado: {formato} (use {', '.join(FORMATOS)})")
+    
+    camadas = []
+    for pesos, vies, ativacao in camadas_dense(modelo):
+        if formato == 'int8':
+            escalas = np.abs(pesos).max(axis=0) / 127
+            escalas[escalas == 0] = 1.0
+            quantizados = np.clip(np.round(pesos / escalas), -127, 127).astype(np.int8)
+            camadas.append({'pesos': quantizados, 'escalas': escalas.astype(np.float32), 'vies': vies, 'ativacao': ativacao})
+        else:
+            camadas.append({'pesos': pesos.astype(np.float16), 'escalas': None, 'vies': vies, 'ativacao': ativacao})
+    return ModeloQuantizado(camadas, formato)
+
+def caminho_quantizado(caminho_modelo, formato):
+    """
+    data/saved_models/category_model.h5 → data/saved_models/category_model.int8.npz
+    """
+    return f"{os.path.splitext(caminho_modelo)[0]}.{formato}.npz"
+
+def salvar(quantizado, caminho):
+    """
+    Grava o modelo quantizado (.npz sem compressão, temporário + rename)
+    """
+    arrays = {}
+    for i, camada in enumerate(quantizado.camadas):
+        arrays[f'pesos_{i}'] = camada['pesos']
+        arrays[f'vies_{i}'] = camada['vies']
+        if camada['escalas'] is not None:
+            arrays[f'escalas_{i}'] = camada['escalas']
+    meta = dict(quantizado.meta, formato=quantizado.formato,
+                ativacoes=[camada['ativacao'] for camada in quantizado.camadas])
+    
+    temporario = f'{caminho}.tmp.npz'
+    np.savez(temporario, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(temporario, caminho)
+
+def carregar(caminho):
+    """
+    Lê um modelo quantizado salvo por salvar
+    """
+    with np.load(caminho) as dados:
+        meta = json.loads(str(dados['meta']))
+        camadas = [
+            {
+                'pesos': dados[f'pesos_{i}'],
+                'escalas': dados[f'escalas_{i}'] if f'escalas_{i}' in dados.files else None,
+                'vies': dados[f'vies_{i}'],
+                'ativacao': ativacao,
+            }
+            for i, ativacao in enumerate(meta['ativacoes'])
+        ]
+    return ModeloQuantizado(camadas, meta['formato'], meta)
+
+def carregar_se_atual(caminho_modelo, formato):
+    """
+    Modelo quantizado de caminho_modelo, se foi exportado do .h5 atual
+    
+    Retorno: ModeloQuantizado ou None (sem exportação ou exportação antiga)
+    """
+    caminho = caminho_quantizado(caminho_modelo, formato)
+    if not os.path.exists(caminho):
+        return None
+    quantizado = carregar(caminho)
+    if quantizado.meta.get('origem_sha256') != _sha256(caminho_modelo):
+        return None
+    return quantizado
+
+def dados_teste(nome, pipeline):
+    """
+    Conjunto de teste do treinamento (mesma divisão 80/20, random_state=42,
+    estratificada) montado com o pipeline de features salvo
+    
+    Retorno: (X_teste, y_teste)
+    """
+    base = armazenamento.ler_despesas_tipadas().reset_index(drop=True)
+    if nome == 'categoria':
+        df = train_model_categoria.carregar_dados(base)
+        df = df[df['categoria'].isin(rotulos.CATEGORIAS_VALIDAS)]
+        valores_rotulo = df['categoria']
+        label_encoder = pipeline.label_encoder_categoria
+    else:
+        df = train_model_subcategoria.carregar_dados(base)
+        valores_rotulo = df['subcategoria']
+        label_encoder = pipeline.label_encoder_subcategoria
+    
+    # Rótulos que o modelo não conhece (despesas novas) ficam de fora
+    conhecidos = valores_rotulo.astype(object).isin(label_encoder.classes_).to_numpy()
+    df = df[conhecidos]
+    y = label_encoder.transform(valores_rotulo[conhecidos].astype(object))
+    
+    indices = np.arange(len(y))
+    try:
+        _, teste = train_test_split(indices, test_size=0.2, random_state=42, stratify=y)
+    except ValueError:
+        _, teste = train_test_split(indices, test_size=0.2, random_state=42)
+    df = df.iloc[teste]
+    
+    if nome == 'categoria':
+        X = pipeline_features.features_categoria(pipeline, df['descricao'])
+    else:
+        X = pipeline_features.features_subcategoria(
+            pipeline, df['descricao'], df['valor'], df['categoria'], df['tags']
+        )
+    return X, y[teste]
+
+def _latencia_ms(modelo, X):
+    uma = X[:1]
+    modelo.predict(uma, verbose=0)
+    tempos = []
+    for _ in range(REPETICOES_LATENCIA):
+        inicio = time.perf_counter()
+        modelo.predict(uma, verbose=0)
+        tempos.append(time.perf_counter() - inicio)
+    return float(np.median(tempos) * 1000)
+
+def relatorio(modelo, quantizado, X_teste, y_teste):
+    """
+    Acurácia do modelo float32 e do quantizado no conjunto de teste, tamanho
+    dos pesos e latência de uma despesa
+    """
+    prob_float = modelo.predict(X_teste, verbose=0)
+    prob_quantizada = quantizado.predict(X_teste)
+    predicao_float = np.argmax(prob_float, axis=1)
+    predicao_quantizada = np.argmax(prob_quantizada, axis=1)
+    
+    acuracia_float = float(np.mean(predicao_float == y_teste))
+    acuracia_quantizada = float(np.mean(predicao_quantizada == y_teste))
+    tamanho_float = sum(pesos.nbytes + vies.nbytes for pesos, vies, _ in camadas_dense(modelo))
+    return {
+        'amostras_teste': int(len(y_teste)),
+        'acuracia_float32': acuracia_float,
+        'acuracia_quantizada': acuracia_quantizada,
+        'delta_acuracia': acuracia_quantizada - acuracia_float,
+        'concordancia': float(np.mean(predicao_float == predicao_quantizada)),
+        'erro_max_probabilidade': float(np.abs(prob_float - prob_quantizada).max()) if len(y_teste) else 0.0,
+        'tamanho_float32_kb': tamanho_float / 1024,
+        'tamanho_quantizado_kb': quantizado.tamanho_bytes / 1024,
+        'latencia_float32_ms': _latencia_ms(modelo, X_teste),
+        'latencia_quantizada_ms': _latencia_ms(quantizado, X_teste),
+    }
+
+def exportar(nome, formato='int8', diretorio=DIRETORIO_MODELOS, progresso=print):
+    """
+    Quantiza o modelo salvo, mede a diferença de acurácia no conjunto de teste
+    e grava <modelo>.<formato>.npz
+    
+    Retorno: relatório (ver relatorio)
+    """
+    caminho_modelo = os.path.join(diretorio, ARQUIVOS_MODELOS[nome])
+    modelo = load_model(caminho_modelo, compile=False)
+    pipeline = pipeline_features.carregar(diretorio)
+    
+    quantizado = quantizar(modelo, formato)
+    X_teste, y_teste = dados_teste(nome, pipeline)
+    resultado = relatorio(modelo, quantizado, X_teste, y_teste)
+    
+    quantizado.meta = {'origem_sha256': _sha256(caminho_modelo), 'relatorio': resultado}
+    caminho = caminho_quantizado(caminho_modelo, formato)
+    salvar(quantizado, caminho)
+    
+    progresso(f"[{nome}] {formato}: acurácia {resultado['acuracia_float32']:.4f} → "
+              f"{resultado['acuracia_quantizada']:.4f} (delta {resultado['delta_acuracia']:+.4f}, "
+              f"{resultado['concordancia']:.2%} das predições iguais, {resultado['amostras_teste']} de teste)")
+    progresso(f"[{nome}] pesos {resultado['tamanho_float32_kb']:.0f} KB → {resultado['tamanho_quantizado_kb']:.0f} KB | "
+              f"1 despesa {resultado['latencia_float32_ms']:.2f} ms → {resultado['latencia_quantizada_ms']:.2f} ms")
+    progresso(f"[{nome}] salvo em {caminho}")
+    return resultado
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporta os modelos com pesos quantizados')
+    parser.add_argument('--formato', choices=FORMATOS, default='int8')
+    parser.add_argument('--modelo', choices=list(ARQUIVOS_MODELOS) + ['todos'], default='todos')
+    args = parser.parse_args()
+    
+    print(f"=== QUANTIZAÇÃO DOS MODELOS ({args.formato}) ===\n")
+    nomes = list(ARQUIVOS_MODELOS) if args.modelo == 'todos' else [args.modelo]
+    for nome in nomes:
+        exportar(nome, args.formato)
+    print("\n💡 Para usar no app: MODELO_QUANTIZADO=" + args.formato + " no .env")
+
+if __name__ == "__main__":
+    main()
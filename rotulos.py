@@ -0,0 +1,138 @@
+"""
+Rótulos de Categoria
+====================
+Mapeamento de tags (e das categorias da planilha original) para as 7
+categorias do sistema e rótulos das bases de treinamento, usados pelos
+scripts de treinamento, pelo aprendizado online e pelo conversor de
+planilha. Só depende de pandas/numpy (o modo online não carrega o
+TensorFlow).
+
+As funções de coluna aplicam as regras só nos valores distintos (uma base
+de despesas tem poucas tags diferentes) e espalham o resultado com os
+códigos do pd.factorize, então o custo em Python não cresce com o número
+de linhas.
+"""
+
+import numpy as np
+import pandas as pd
+
+# As 7 categorias corretas
+CATEGORIAS_VALIDAS = [
+    'CUSTOS FIXOS',
+    'CONFORTO',
+    'METAS',
+    'PRAZERES',
+    'LIBERDADE FINANCEIRA',
+    'CONHECIMENTO',
+    'CATEGORIZAR'
+]
+
+CATEGORIA_PADRAO = 'CATEGORIZAR'
+
+# (trecho da tag em minúsculas, categoria) - a primeira regra que casar vale
+REGRAS_TAGS = [
+    ('custos fixos', 'CUSTOS FIXOS'),
+    ('conforto', 'CONFORTO'),
+    ('prazeres', 'PRAZERES'),
+    ('conhecimento', 'CONHECIMENTO'),
+    ('metas', 'METAS'),
+    ('liberdade financeira', 'LIBERDADE FINANCEIRA'),
+    ('categorizar', 'CATEGORIZAR'),
+]
+
+# (trecho da CATEGORIA da planilha em maiúsculas, categoria) - fallback sem tags
+REGRAS_CATEGORIA_PLANILHA = [
+    ('CUSTOS FIXOS', 'CUSTOS FIXOS'),
+    ('CONFORTO', 'CONFORTO'),
+    ('PRAZERES', 'PRAZERES'),
+    ('CONHECIMENTO', 'CONHECIMENTO'),
+    ('EDUCAÇÃO', 'CONHECIMENTO'),
+    ('METAS', 'METAS'),
+    ('LIBERDADE', 'LIBERDADE FINANCEIRA'),
+]
+
+def mapear_tags_para_categoria(tags):
+    """
+    Categoria de uma tag (uma despesa por vez, ex.: aprendizado online)
+    """
+    if pd.isna(tags) or tags == '':
+        return CATEGORIA_PADRAO
+    
+    tags_lower = str(tags).lower().strip()
+    for trecho, categoria in REGRAS_TAGS:
+        if trecho in tags_lower:
+            return categoria
+    return CATEGORIA_PADRAO
+
+def _aplicar_regras(valores, regras, maiusculas=False):
+    """
+    Primeira regra que casa com cada valor (NaN/None viram CATEGORIA_PADRAO)
+    
+    Retorno: Series (object) com o mesmo índice de valores
+    """
+    serie = pd.Series(valores).astype(object)
+    codigos, unicos = pd.factorize(serie)
+    
+    textos = pd.Index(unicos, dtype=object).astype(str)
+    textos = textos.str.upper() if maiusculas else textos.str.lower().str.strip()
+    mapeados = np.select(
+        [np.asarray(textos.str.contains(trecho, regex=False), dtype=bool) for trecho, _ in regras],
+        [categoria for _, categoria in regras],
+        default=CATEGORIA_PADRAO
+    ).astype(object)
+    
+    # Código -1 do factorize (valor ausente) cai na última posição
+    mapeados = np.append(mapeados, CATEGORIA_PADRAO)
+    return pd.Series(mapeados[codigos], index=serie.index, dtype=object)
+
+def categorias_por_tags(tags):
+    """
+    mapear_tags_para_categoria de uma coluna inteira
+    """
+    return _aplicar_regras(tags, REGRAS_TAGS)
+
+def categorias_planilha(categorias, tags=None):
+    """
+    Categoria de cada linha da planilha original: pelas tags quando a linha
+    tem tag, senão pela CATEGORIA da planilha
+    
+    Como no mapeamento antigo por linha, tag NaN conta como tag (e vira
+    CATEGORIA_PADRAO); só a tag vazia usa a CATEGORIA.
+    """
+    por_categoria = _aplicar_regras(categorias, REGRAS_CATEGORIA_PLANILHA, maiusculas=True)
+    if tags is None:
+        return por_categoria
+    
+    tags = pd.Series(list(tags), index=por_categoria.index, dtype=object)
+    com_tags = tags.isna() | (tags.astype(str).str.strip() != '')
+    return por_categoria.where(~com_tags, categorias_por_tags(tags))
+
+def rotular_categoria(df):
+    """
+    Despesas com a categoria sempre em uma das 7: a categoria válida fica,
+    as outras são mapeadas pelas tags (ou pela própria categoria, sem tags)
+    
+    Retorno: cópia do DataFrame
+    """
+    df = df.copy()
+    categoria = df['categoria'].astype(object)
+    valida = categoria.isin(CATEGORIAS_VALIDAS)
+    mapeada = categorias_por_tags(df['tags'] if 'tags' in df.columns else categoria)
+    df['categoria'] = categoria.where(valida, mapeada)
+    return df
+
+def rotular_subcategoria(df):
+    """
+    Despesas com subcategoria válida (nem vazia nem DESCONHECIDO); categoria
+    vazia é preenchida pelas tags
+    
+    Retorno: cópia do DataFrame (só as linhas com subcategoria)
+    """
+    df = df.copy()
+    if 'tags' in df.columns:
+        categoria = df['categoria'].astype(object)
+        vazia = categoria.isna() | (categoria.astype(str).str.strip() == '')
+        df['categoria'] = categoria.where(~vazia, categorias_por_tags(df['tags']))
+    
+    subcategoria = df['subcategoria'].astype(str).str.strip()
+    return df[df['subcategoria'].notna() & (subcategoria != '') & (subcategoria != 'DESCONHECIDO')]
@@ -6,7 +6,6 @@ Adaptado de esqueleto_treinamento.py para classificação de categorias financei
 Usa TF-IDF para descrições + features numéricas para classificar despesas.
 """
 
-import pandas as pd
 import numpy as np
 try:
     import matplotlib.pyplot as plt
@@ -21,12 +20,13 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.model_selection import train_test_split
 import os
 import joblib
+import armazenamento
 
 def carregar_dados():
     """
-    Carrega o arquivo CSV com despesas financeiras
+    Carrega as despesas financeiras (schema tipado de armazenamento)
     """
-    df = pd.read_csv('data/expenses.csv')
+    df = armazenamento.ler_despesas_tipadas()
     return df
 
 def preparar_dados(df):
@@ -50,8 +50,7 @@ def preparar_dados(df):
     # Features numéricas - valor
     numeric_features = df[['valor']].values
     
-    # Features temporais - extrair mês e dia da semana
-    df['data'] = pd.to_datetime(df['data'])
+    # Features temporais - extrair mês e dia da semana (data já vem em datetime)
     df['mes'] = df['data'].dt.month
     df['dia_semana'] = df['data'].dt.dayofweek
     temporal_features = df[['mes', 'dia_semana']].values
@@ -12,7 +12,6 @@ Treina modelo para classificar nas 7 categorias principais:
 - CATEGORIZAR
 """
 
-import pandas as pd
 import numpy as np
 try:
     import matplotlib.pyplot as plt
@@ -22,83 +21,44 @@ except:
     print("AVISO: Matplotlib nao disponivel - graficos desabilitados")
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense, Dropout
+from tensorflow.keras.optimizers import Adam
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.model_selection import train_test_split
 import os
-import joblib
+import armazenamento
+import pipeline_features
+import rotulos
+import cache_treinamento
+import loop_treinamento
 
-# As 7 categorias corretas
-CATEGORIAS_VALIDAS = [
-    'CUSTOS FIXOS',
-    'CONFORTO',
-    'METAS',
-    'PRAZERES',
-    'LIBERDADE FINANCEIRA',
-    'CONHECIMENTO',
-    'CATEGORIZAR'
-]
+DIRETORIO_MODELOS = 'data/saved_models'
+EPOCAS = 100  # Máximo (early stopping)
+TAMANHO_LOTE = 8  # Mínimo (lote adaptativo)
+MAX_FEATURES = 100  # TF-IDF da descrição
 
-def mapear_tags_para_categoria(tags):
-    """
-    Mapeia tags para categorias corretas
-    """
-    if pd.isna(tags) or tags == '':
-        return 'CATEGORIZAR'
-    
-    tags_lower = str(tags).lower().strip()
-    
-    if 'custos fixos' in tags_lower:
-        return 'CUSTOS FIXOS'
-    elif 'conforto' in tags_lower:
-        return 'CONFORTO'
-    elif 'prazeres' in tags_lower:
-        return 'PRAZERES'
-    elif 'conhecimento' in tags_lower:
-        return 'CONHECIMENTO'
-    elif 'metas' in tags_lower:
-        return 'METAS'
-    elif 'liberdade financeira' in tags_lower:
-        return 'LIBERDADE FINANCEIRA'
-    elif 'categorizar' in tags_lower:
-        return 'CATEGORIZAR'
-    else:
-        return 'CATEGORIZAR'
+# As 7 categorias corretas
+CATEGORIAS_VALIDAS = rotulos.CATEGORIAS_VALIDAS
 
-def carregar_dados():
+def carregar_dados(df=None):
     """
-    Carrega o arquivo CSV e mapeia categorias corretamente
+    Carrega as despesas e mapeia categorias corretamente
     """
-    df = pd.read_csv('data/expenses.csv')
-    
-    # Se a coluna categoria não tem as 7 categorias corretas, mapear usando tags
-    if 'tags' in df.columns:
-        # Mapear usando tags como fonte principal
-        df['categoria_mapeada'] = df['tags'].apply(mapear_tags_para_categoria)
-        
-        # Se categoria atual não está nas válidas, usar a mapeada
-        df['categoria'] = df.apply(
-            lambda row: row['categoria_mapeada'] if row.get('categoria', '') not in CATEGORIAS_VALIDAS 
-            else row['categoria'],
-            axis=1
-        )
-        df = df.drop(columns=['categoria_mapeada'])
-    else:
-        # Se não tem tags, mapear categoria existente
-        df['categoria'] = df['categoria'].apply(
-            lambda x: mapear_tags_para_categoria(x) if x not in CATEGORIAS_VALIDAS else x
-        )
-    
-    # Garantir que todas as categorias estão nas válidas
-    df['categoria'] = df['categoria'].apply(
-        lambda x: x if x in CATEGORIAS_VALIDAS else 'CATEGORIZAR'
-    )
+    if df is None:
+        df = armazenamento.ler_despesas_tipadas()
     
-    return df
+    # Categorias fora das 7 corretas são mapeadas pelas tags
+    return rotulos.rotular_categoria(df)
 
-def preparar_dados(df):
+def preparar_dados(df, diretorio=DIRETORIO_MODELOS, pipeline=None, vetores=None):
     """
     Prepara os dados para classificação de CATEGORIAS (7 classes)
+    
+    Os transformadores ajustados vão para o pipeline de features. Sem pipeline,
+    o salvo é atualizado (mantendo os componentes do modelo de subcategoria) e
+    gravado em diretorio; com pipeline (treinamento.py), quem chama salva.
+    Com vetores (TF-IDF de toda a base, linhas = índice do df), o
+    pipeline.tfidf_categoria já ajustado é reaproveitado.
     """
     print("   Preparando features para categorias...")
     
@@ -118,11 +78,17 @@ def preparar_dados(df):
     y_encoded = label_encoder.fit_transform(y)
     
     # Features de texto - TF-IDF da descrição (ÚNICA FEATURE)
-    tfidf = TfidfVectorizer(max_features=100, stop_words=None)
-    text_features = tfidf.fit_transform(df['descricao']).toarray()
+    salvar = pipeline is None
+    if salvar:
+        pipeline = pipeline_features.carregar_ou_criar(diretorio)
+    if vetores is None:
+        pipeline.tfidf_categoria = TfidfVectorizer(max_features=MAX_FEATURES, stop_words=None).fit(df['descricao'])
+        texto = None
+    else:
+        texto = vetores[df.index.to_numpy()]
     
     # Usar apenas descrição como feature
-    X = text_features
+    X = pipeline_features.matriz_categoria(pipeline, df['descricao'], texto)
     
     # Dividir dados de treino e teste
     X_treino, X_teste, y_treino, y_teste = train_test_split(
@@ -136,10 +102,10 @@ def preparar_dados(df):
     X_teste_scaled = scaler_X.transform(X_teste)
     
     # Salvar recursos
-    os.makedirs('data/saved_models', exist_ok=True)
-    joblib.dump(scaler_X, 'data/saved_models/category_scaler_X.pkl')
-    joblib.dump(label_encoder, 'data/saved_models/category_label_encoder.pkl')
-    joblib.dump(tfidf, 'data/saved_models/category_tfidf.pkl')
+    pipeline.scaler_categoria = scaler_X
+    pipeline.label_encoder_categoria = label_encoder
+    if salvar:
+        pipeline_features.salvar(pipeline, diretorio)
     
     print(f"   Dados X normalizados: média={X_treino_scaled.mean():.3f}, std={X_treino_scaled.std():.3f}")
     print(f"   Categorias únicas: {len(label_encoder.classes_)}")
@@ -166,35 +132,39 @@ def criar_modelo(input_dim, num_classes):
     
     return modelo
 
-def compilar_modelo(modelo):
+def compilar_modelo(modelo, taxa_aprendizado=None):
     """
-    Compila o modelo
+    Compila o modelo (taxa_aprendizado: Adam com outra taxa, ex.: ajuste incremental)
     """
     modelo.compile(
-        optimizer='adam',
+        optimizer=Adam(learning_rate=taxa_aprendizado) if taxa_aprendizado else 'adam',
         loss='sparse_categorical_crossentropy',
         metrics=['accuracy']
     )
 
-def treinar_modelo(modelo, X_treino, y_treino, X_teste, y_teste):
+def treinar_modelo(modelo, X_treino, y_treino, callbacks=None, verbose=1):
     """
-    Treina o modelo
+    Treina o modelo (early stopping, redução da taxa de aprendizado e lote
+    adaptativo; EPOCAS é o máximo e TAMANHO_LOTE o lote mínimo)
+    
+    A validação dos callbacks sai de X_treino; o teste fica para avaliar_modelo.
+    
+    Retorno: (histórico, relatório de tempo até a acurácia)
     """
-    resultado = modelo.fit(
-        X_treino, y_treino,
-        validation_data=(X_teste, y_teste),
-        epochs=100,
-        batch_size=8,
-        verbose=1
+    return loop_treinamento.treinar(
+        modelo, X_treino, y_treino,
+        epocas_maximas=EPOCAS,
+        lote_minimo=TAMANHO_LOTE,
+        callbacks=callbacks,
+        verbose=verbose
     )
-    return resultado
 
-def salvar_modelo(modelo):
+def salvar_modelo(modelo, diretorio=DIRETORIO_MODELOS):
     """
     Salva o modelo treinado
     """
-    os.makedirs('data/saved_models', exist_ok=True)
-    modelo.save('data/saved_models/category_model.h5')
+    os.makedirs(diretorio, exist_ok=True)
+    modelo.save(os.path.join(diretorio, 'category_model.h5'))
 
 def avaliar_modelo(modelo, X_teste, y_teste, label_encoder):
     """
@@ -280,13 +250,15 @@ def main():
     
     # 1. Carregar dados
     print("1. Carregando dados...")
-    df = carregar_dados()
-    print(f"   Dados carregados: {len(df)} amostras")
-    print(f"   Colunas: {list(df.columns)}")
+    base = armazenamento.ler_despesas_tipadas()
+    print(f"   Despesas carregadas: {len(base)}")
+    print(f"   Colunas: {list(base.columns)}")
     
-    # 2. Preparar dados
+    # 2. Preparar dados (reaproveita o cache se a base e as features não mudaram)
     print("\n2. Preparando dados...")
-    X_treino, X_teste, y_treino, y_teste, label_encoder = preparar_dados(df)
+    X_treino, X_teste, y_treino, y_teste, label_encoder = cache_treinamento.preparar_modelo(
+        'categoria', base, carregar_dados, preparar_dados, {'max_features': MAX_FEATURES}, DIRETORIO_MODELOS
+    )
     print(f"   Dados de treino: {X_treino.shape[0]} amostras")
     print(f"   Dados de teste: {X_teste.shape[0]} amostras")
     print(f"   Features totais: {X_treino.shape[1]}")
@@ -305,9 +277,9 @@ def main():
     
     # 5. Treinar modelo
     print("\n5. Treinando modelo...")
-    print("   Isso pode levar alguns minutos...")
-    resultado = treinar_modelo(modelo, X_treino, y_treino, X_teste, y_teste)
+    resultado, relatorio = treinar_modelo(modelo, X_treino, y_treino)
     print("   Treinamento concluído!")
+    print(f"   {loop_treinamento.descrever(relatorio)}")
     
     # 6. Salvar modelo
     print("\n6. Salvando modelo...")
@@ -326,9 +298,7 @@ def main():
     print("OK Modelo de categorias treinado e avaliado com sucesso!")
     print("📁 Arquivos salvos:")
     print("   - data/saved_models/category_model.h5 (modelo treinado)")
-    print("   - data/saved_models/category_scaler_X.pkl (normalizador)")
-    print("   - data/saved_models/category_label_encoder.pkl (codificador)")
-    print("   - data/saved_models/category_tfidf.pkl (vetorizador)")
+    print("   - data/saved_models/feature_pipeline.joblib (pipeline de features + manifesto .json)")
     print("   - resultado_treinamento_categoria.png (gráficos)")
     print("\n💡 DICA: Agora treine o modelo de subcategorias com train_model_subcategoria.py!")
 
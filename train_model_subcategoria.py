@@ -6,7 +6,6 @@ Treina modelo para classificar subcategorias (livre, muitas classes).
 Usa categoria como feature adicional para melhorar precisão.
 """
 
-import pandas as pd
 import numpy as np
 try:
     import matplotlib.pyplot as plt
@@ -16,66 +15,39 @@ except:
     print("AVISO: Matplotlib nao disponivel - graficos desabilitados")
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense, Dropout
+from tensorflow.keras.optimizers import Adam
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.model_selection import train_test_split
 import os
-import joblib
+import armazenamento
+import pipeline_features
+import rotulos
+import cache_treinamento
+import loop_treinamento
 
-def mapear_tags_para_categoria(tags):
-    """
-    Mapeia tags para categorias (mesma função do train_model_categoria)
-    """
-    if pd.isna(tags) or tags == '':
-        return 'CATEGORIZAR'
-    
-    tags_lower = str(tags).lower().strip()
-    
-    if 'custos fixos' in tags_lower:
-        return 'CUSTOS FIXOS'
-    elif 'conforto' in tags_lower:
-        return 'CONFORTO'
-    elif 'prazeres' in tags_lower:
-        return 'PRAZERES'
-    elif 'conhecimento' in tags_lower:
-        return 'CONHECIMENTO'
-    elif 'metas' in tags_lower:
-        return 'METAS'
-    elif 'liberdade financeira' in tags_lower:
-        return 'LIBERDADE FINANCEIRA'
-    elif 'categorizar' in tags_lower:
-        return 'CATEGORIZAR'
-    else:
-        return 'CATEGORIZAR'
+DIRETORIO_MODELOS = 'data/saved_models'
+EPOCAS = 150  # Máximo (early stopping); mais épocas para subcategorias (mais classes)
+TAMANHO_LOTE = 16  # Mínimo (lote adaptativo)
+MAX_FEATURES = 100  # TF-IDF da descrição
 
-def carregar_dados():
+def carregar_dados(df=None):
     """
-    Carrega o arquivo CSV e prepara dados para subcategorias
+    Carrega as despesas e prepara dados para subcategorias
     """
-    df = pd.read_csv('data/expenses.csv')
-    
-    # Mapear categorias corretamente se necessário
-    if 'tags' in df.columns:
-        df['categoria_mapeada'] = df['tags'].apply(mapear_tags_para_categoria)
-        df['categoria'] = df.apply(
-            lambda row: row['categoria_mapeada'] if pd.isna(row.get('categoria', '')) or str(row.get('categoria', '')).strip() == '' 
-            else row['categoria'],
-            axis=1
-        )
-        if 'categoria_mapeada' in df.columns:
-            df = df.drop(columns=['categoria_mapeada'])
-    
-    # Filtrar apenas linhas com subcategoria válida
-    df = df[df['subcategoria'].notna()]
-    df = df[df['subcategoria'].astype(str).str.strip() != '']
-    df = df[df['subcategoria'].astype(str).str.strip() != 'DESCONHECIDO']
-    
-    return df
+    if df is None:
+        df = armazenamento.ler_despesas_tipadas()
+    
+    # Categoria vazia mapeada pelas tags; só linhas com subcategoria válida
+    return rotulos.rotular_subcategoria(df)
 
-def preparar_dados(df):
+def preparar_dados(df, diretorio=DIRETORIO_MODELOS, pipeline=None, vetores=None):
     """
     Prepara os dados para classificação de SUBCATEGORIAS
     Usa categoria como feature adicional!
+    
+    Os transformadores ajustados vão para o pipeline de features (mesmas regras
+    de train_model_categoria.preparar_dados).
     """
     print("   Preparando features para subcategorias...")
     
@@ -90,47 +62,41 @@ def preparar_dados(df):
     print(f"   Primeiras 10: {list(label_encoder.classes_[:10])}")
     
     # Features de texto - TF-IDF da descrição
-    tfidf = TfidfVectorizer(max_features=100, stop_words=None)
-    text_features = tfidf.fit_transform(df['descricao']).toarray()
-    
-    # Features numéricas - valor
-    numeric_features = df[['valor']].values
+    salvar = pipeline is None
+    if salvar:
+        pipeline = pipeline_features.carregar_ou_criar(diretorio)
+    if vetores is None:
+        pipeline.tfidf_subcategoria = TfidfVectorizer(max_features=MAX_FEATURES, stop_words=None).fit(df['descricao'])
+        texto = None
+    else:
+        texto = vetores[df.index.to_numpy()]
     
     # FEATURE ADICIONAL: Categoria (one-hot encoding)
     # Isso ajuda muito na classificação de subcategorias!
-    categoria_encoder = LabelEncoder()
-    categorias_encoded = categoria_encoder.fit_transform(df['categoria'])
-    
-    # One-hot encoding de categoria
     from sklearn.preprocessing import OneHotEncoder
-    categoria_onehot = OneHotEncoder(sparse_output=False)
-    categoria_features = categoria_onehot.fit_transform(categorias_encoded.reshape(-1, 1))
+    pipeline.categoria_encoder = LabelEncoder().fit(df['categoria'])
+    pipeline.categoria_onehot = OneHotEncoder(sparse_output=False).fit(
+        np.arange(len(pipeline.categoria_encoder.classes_)).reshape(-1, 1)
+    )
     
-    print(f"   Categorias únicas: {len(categoria_encoder.classes_)}")
-    print(f"   Features de categoria (one-hot): {categoria_features.shape[1]} dimensões")
+    print(f"   Categorias únicas: {len(pipeline.categoria_encoder.classes_)}")
+    print(f"   Features de categoria (one-hot): {len(pipeline.categoria_encoder.classes_)} dimensões")
     
     # FEATURE ADICIONAL: Tags (one-hot encoding)
     # Processar tags: se vazio/NaN, usar string vazia
-    df['tags_processed'] = df['tags'].fillna('').astype(str).str.strip()
-    
-    # Criar encoder para tags únicas
-    tags_encoder = LabelEncoder()
-    tags_encoded = tags_encoder.fit_transform(df['tags_processed'])
-    
-    # One-hot encoding de tags
-    tags_onehot = OneHotEncoder(sparse_output=False)
-    tags_features = tags_onehot.fit_transform(tags_encoded.reshape(-1, 1))
+    tags = pipeline_features.normalizar_tags(df['tags'], len(df))
+    pipeline.tags_encoder = LabelEncoder().fit(tags)
+    pipeline.tags_onehot = OneHotEncoder(sparse_output=False).fit(
+        np.arange(len(pipeline.tags_encoder.classes_)).reshape(-1, 1)
+    )
     
-    print(f"   Tags únicas: {len(tags_encoder.classes_)}")
-    print(f"   Features de tags (one-hot): {tags_features.shape[1]} dimensões")
+    print(f"   Tags únicas: {len(pipeline.tags_encoder.classes_)}")
+    print(f"   Features de tags (one-hot): {len(pipeline.tags_encoder.classes_)} dimensões")
     
-    # Combinar TODAS as features (sem temporais, com tags)
-    X = np.hstack([
-        text_features,      # TF-IDF da descrição
-        numeric_features,  # Valor
-        categoria_features, # Categoria (one-hot)
-        tags_features      # Tags (one-hot) - NOVO!
-    ])
+    # Combinar TODAS as features (TF-IDF, valor, categoria e tags em one-hot)
+    X = pipeline_features.matriz_subcategoria(
+        pipeline, df['descricao'], df['valor'], df['categoria'], tags, texto
+    )
     
     # Dividir dados de treino e teste
     X_treino, X_teste, y_treino, y_teste = train_test_split(
@@ -144,14 +110,10 @@ def preparar_dados(df):
     X_teste_scaled = scaler_X.transform(X_teste)
     
     # Salvar recursos
-    os.makedirs('data/saved_models', exist_ok=True)
-    joblib.dump(scaler_X, 'data/saved_models/subcategoria_scaler_X.pkl')
-    joblib.dump(label_encoder, 'data/saved_models/subcategoria_label_encoder.pkl')
-    joblib.dump(tfidf, 'data/saved_models/subcategoria_tfidf.pkl')
-    joblib.dump(categoria_encoder, 'data/saved_models/subcategoria_categoria_encoder.pkl')
-    joblib.dump(categoria_onehot, 'data/saved_models/subcategoria_categoria_onehot.pkl')
-    joblib.dump(tags_encoder, 'data/saved_models/subcategoria_tags_encoder.pkl')
-    joblib.dump(tags_onehot, 'data/saved_models/subcategoria_tags_onehot.pkl')
+    pipeline.scaler_subcategoria = scaler_X
+    pipeline.label_encoder_subcategoria = label_encoder
+    if salvar:
+        pipeline_features.salvar(pipeline, diretorio)
     
     print(f"   Dados X normalizados: média={X_treino_scaled.mean():.3f}, std={X_treino_scaled.std():.3f}")
     print(f"   Total de features: {X_treino_scaled.shape[1]}")
@@ -181,35 +143,39 @@ def criar_modelo(input_dim, num_classes):
     
     return modelo
 
-def compilar_modelo(modelo):
+def compilar_modelo(modelo, taxa_aprendizado=None):
     """
-    Compila o modelo
+    Compila o modelo (taxa_aprendizado: Adam com outra taxa, ex.: ajuste incremental)
     """
     modelo.compile(
-        optimizer='adam',
+        optimizer=Adam(learning_rate=taxa_aprendizado) if taxa_aprendizado else 'adam',
         loss='sparse_categorical_crossentropy',
         metrics=['accuracy']
     )
 
-def treinar_modelo(modelo, X_treino, y_treino, X_teste, y_teste):
+def treinar_modelo(modelo, X_treino, y_treino, callbacks=None, verbose=1):
     """
-    Treina o modelo
+    Treina o modelo (early stopping, redução da taxa de aprendizado e lote
+    adaptativo; EPOCAS é o máximo e TAMANHO_LOTE o lote mínimo)
+    
+    A validação dos callbacks sai de X_treino; o teste fica para avaliar_modelo.
+    
+    Retorno: (histórico, relatório de tempo até a acurácia)
     """
-    resultado = modelo.fit(
-        X_treino, y_treino,
-        validation_data=(X_teste, y_teste),
-        epochs=150,  # Mais épocas para subcategorias (mais classes)
-        batch_size=16,
-        verbose=1
+    return loop_treinamento.treinar(
+        modelo, X_treino, y_treino,
+        epocas_maximas=EPOCAS,
+        lote_minimo=TAMANHO_LOTE,
+        callbacks=callbacks,
+        verbose=verbose
     )
-    return resultado
 
-def salvar_modelo(modelo):
+def salvar_modelo(modelo, diretorio=DIRETORIO_MODELOS):
     """
     Salva o modelo treinado
     """
-    os.makedirs('data/saved_models', exist_ok=True)
-    modelo.save('data/saved_models/subcategoria_model.h5')
+    os.makedirs(diretorio, exist_ok=True)
+    modelo.save(os.path.join(diretorio, 'subcategoria_model.h5'))
 
 def avaliar_modelo(modelo, X_teste, y_teste, label_encoder):
     """
@@ -299,13 +265,15 @@ def main():
     
     # 1. Carregar dados
     print("1. Carregando dados...")
-    df = carregar_dados()
-    print(f"   Dados carregados: {len(df)} amostras")
-    print(f"   Colunas: {list(df.columns)}")
+    base = armazenamento.ler_despesas_tipadas()
+    print(f"   Despesas carregadas: {len(base)}")
+    print(f"   Colunas: {list(base.columns)}")
     
-    # 2. Preparar dados
+    # 2. Preparar dados (reaproveita o cache se a base e as features não mudaram)
     print("\n2. Preparando dados...")
-    X_treino, X_teste, y_treino, y_teste, label_encoder = preparar_dados(df)
+    X_treino, X_teste, y_treino, y_teste, label_encoder = cache_treinamento.preparar_modelo(
+        'subcategoria', base, carregar_dados, preparar_dados, {'max_features': MAX_FEATURES}, DIRETORIO_MODELOS
+    )
     print(f"   Dados de treino: {X_treino.shape[0]} amostras")
     print(f"   Dados de teste: {X_teste.shape[0]} amostras")
     print(f"   Features totais: {X_treino.shape[1]}")
@@ -324,9 +292,9 @@ def main():
     
     # 5. Treinar modelo
     print("\n5. Treinando modelo...")
-    print("   Isso pode levar alguns minutos (mais classes = mais tempo)...")
-    resultado = treinar_modelo(modelo, X_treino, y_treino, X_teste, y_teste)
+    resultado, relatorio = treinar_modelo(modelo, X_treino, y_treino)
     print("   Treinamento concluído!")
+    print(f"   {loop_treinamento.descrever(relatorio)}")
     
     # 6. Salvar modelo
     print("\n6. Salvando modelo...")
@@ -345,11 +313,7 @@ def main():
     print("OK Modelo de subcategorias treinado e avaliado com sucesso!")
     print("📁 Arquivos salvos:")
     print("   - data/saved_models/subcategoria_model.h5 (modelo treinado)")
-    print("   - data/saved_models/subcategoria_scaler_X.pkl (normalizador)")
-    print("   - data/saved_models/subcategoria_label_encoder.pkl (codificador)")
-    print("   - data/saved_models/subcategoria_tfidf.pkl (vetorizador)")
-    print("   - data/saved_models/subcategoria_categoria_encoder.pkl (encoder de categoria)")
-    print("   - data/saved_models/subcategoria_categoria_onehot.pkl (one-hot de categoria)")
+    print("   - data/saved_models/feature_pipeline.joblib (pipeline de features + manifesto .json)")
     print("   - resultado_treinamento_subcategoria.png (gráficos)")
     print("\n💡 DICA: Agora você pode usar ambos os modelos no app.py!")
 
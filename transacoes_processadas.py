@@ -0,0 +1,183 @@
+"""
+Transações Processadas
+======================
+Armazena o resultado de cada upload em Parquet e responde consultas paginadas
+(filtro, ordenação e projeção de colunas) lendo só o necessário.
+
+Cada linha recebe a coluna _linha (posição no CSV processado). Como ela é
+crescente, as estatísticas de cada row group permitem que a leitura de uma
+página pule os row groups que não contêm as linhas pedidas.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import armazenamento
+import classificacao_lote
+
+COLUNA_LINHA = '_linha'
+
+# Linhas por row group (e por chunk lido do CSV na conversão)
+TAMANHO_ROW_GROUP = classificacao_lote.TAMANHO_CHUNK
+
+# Colunas com poucos valores distintos, gravadas com dictionary encoding
+COLUNAS_DICIONARIO = armazenamento.COLUNAS_CATEGORICAS + [
+    'Categoria_ML', 'Subcategoria_ML', 'Categoria_LLM', 'Categoria_OpenAI'
+]
+
+POR_PAGINA_PADRAO = 100
+POR_PAGINA_MAX = 1000
+
+def caminho_parquet(caminho_csv):
+    """
+    Caminho do Parquet correspondente ao CSV processado
+    """
+    return os.path.splitext(caminho_csv)[0] + '.parquet'
+
+def _schema(colunas, col_valor):
+    """
+    Schema fixo: valor e confianças numéricos, categorias com dictionary
+    encoding, demais colunas texto (o tipo não depende do conteúdo de cada chunk)
+    """
+    campos = [pa.field(COLUNA_LINHA, pa.int64())]
+    for coluna in colunas:
+        if coluna == col_valor or coluna.startswith('Confianca_'):
+            campos.append(pa.field(coluna, pa.float64()))
+        elif coluna in COLUNAS_DICIONARIO:
+            campos.append(pa.field(coluna, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            campos.append(pa.field(coluna, pa.string()))
+    return pa.schema(campos)
+
+def converter_para_parquet(caminho_csv, destino=None, tamanho_chunk=TAMANHO_ROW_GROUP):
+    """
+    Converte o CSV processado em Parquet, em chunks (um row group por chunk)
+    
+    Retorno: caminho do arquivo Parquet
+    """
+    destino = destino or caminho_parquet(caminho_csv)
+    temporario = f'{destino}.tmp'
+    
+    colunas = pd.read_csv(caminho_csv, encoding='utf-8-sig', nrows=0).columns
+    _, col_valor, _ = classificacao_lote.detectar_colunas(colunas)
+    schema = _schema(colunas, col_valor)
+    
+    inicio = 0
+    with pq.ParquetWriter(temporario, schema, compression='zstd') as writer:
+        for chunk in pd.read_csv(caminho_csv, encoding='utf-8-sig', dtype=str,
+                                 keep_default_na=False, na_values=[''], chunksize=tamanho_chunk):
+            for campo in schema:
+                if campo.name in chunk.columns and pa.types.is_floating(campo.type):
+                    chunk[campo.name] = pd.to_numeric(chunk[campo.name], errors='coerce')
+            chunk.insert(0, COLUNA_LINHA, np.arange(inicio, inicio + len(chunk), dtype=np.int64))
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            inicio += len(chunk)
+    
+    os.replace(temporario, destino)
+    return destino
+
+def abrir(caminho_csv):
+    """
+    Dataset Parquet do CSV processado (converte na primeira vez, para uploads
+    processados antes do armazenamento em Parquet)
+    """
+    destino = caminho_parquet(caminho_csv)
+    if not os.path.exists(destino):
+        converter_para_parquet(caminho_csv, destino)
+    return ds.dataset(destino, format='parquet')
+
+def montar_filtro(dataset, categoria=None, subcategoria=None, busca=None, confianca_min=None):
+    """
+    Expressão de filtro do Arrow a partir dos parâmetros da consulta
+    
+    - categoria: igual a Categoria_ML ou Categoria_LLM
+    - subcategoria: igual a Subcategoria_ML
+    - busca: trecho da descrição (sem diferenciar maiúsculas)
+    - confianca_min: Confianca_ML ou Confianca_LLM maior ou igual
+    """
+    condicoes = []
+    if categoria:
+        condicoes.append((ds.field('Categoria_ML') == categoria) | (ds.field('Categoria_LLM') == categoria))
+    if subcategoria:
+        condicoes.append(ds.field('Subcategoria_ML') == subcategoria)
+    if busca:
+        col_descricao, _, _ = classificacao_lote.detectar_colunas(dataset.schema.names)
+        if col_descricao:
+            condicoes.append(pc.match_substring(ds.field(col_descricao), busca, ignore_case=True))
+    if confianca_min is not None:
+        condicoes.append((ds.field('Confianca_ML') >= confianca_min) | (ds.field('Confianca_LLM') >= confianca_min))
+    
+    if not condicoes:
+        return None
+    filtro = condicoes[0]
+    for condicao in condicoes[1:]:
+        filtro = filtro & condicao
+    return filtro
+
+def consultar(caminho_csv, pagina=1, por_pagina=POR_PAGINA_PADRAO, ordenar_por=None, ordem='asc',
+              colunas=None, **filtros):
+    """
+    Uma página das transações processadas
+    
+    Etapas: (1) lê só _linha (e a coluna de ordenação) das linhas que passam no
+    filtro, (2) ordena e recorta a página, (3) lê as colunas pedidas apenas das
+    linhas da página.
+    
+    Retorno: (pyarrow.Table da página sem a coluna _linha, total de linhas filtradas)
+    """
+    dataset = abrir(caminho_csv)
+    nomes = [nome for nome in dataset.schema.names if nome != COLUNA_LINHA]
+    
+    if colunas:
+        desconhecidas = [coluna for coluna in colunas if coluna not in nomes]
+        if desconhecidas:
+            raise ValueError(f"Colunas desconhecidas: {', '.join(desconhecidas)}")
+    else:
+        colunas = nomes
+    if ordenar_por is not None and ordenar_por not in nomes:
+        raise ValueError(f"Coluna de ordenação desconhecida: {ordenar_por}")
+    
+    filtro = montar_filtro(dataset, **filtros)
+    por_pagina = max(1, min(int(por_pagina), POR_PAGINA_MAX))
+    inicio = (max(1, int(pagina)) - 1) * por_pagina
+    
+    # 1 + 2. Linhas da página
+    leitura = [COLUNA_LINHA] + ([ordenar_por] if ordenar_por else [])
+    indice = dataset.to_table(columns=leitura, filter=filtro)
+    total = indice.num_rows
+    if ordenar_por and pa.types.is_dictionary(indice.schema.field(ordenar_por).type):
+        # Ordenação não suporta dictionary: decodificar só a coluna de ordenação
+        posicao = indice.schema.get_field_index(ordenar_por)
+        indice = indice.set_column(posicao, ordenar_por, pc.cast(indice.column(ordenar_por), pa.string()))
+    chaves_ordem = [(COLUNA_LINHA, 'ascending')]
+    if ordenar_por:
+        chaves_ordem.insert(0, (ordenar_por, 'descending' if ordem == 'desc' else 'ascending'))
+    indice = indice.sort_by(chaves_ordem)
+    linhas = indice.column(COLUNA_LINHA).slice(inicio, por_pagina).combine_chunks()
+    
+    # 3. Só as linhas e colunas da página
+    if len(linhas) == 0:
+        return dataset.schema.empty_table().select(colunas), total
+    
+    pagina_tabela = dataset.to_table(
+        columns=[COLUNA_LINHA] + list(colunas),
+        filter=ds.field(COLUNA_LINHA).isin(linhas)
+    )
+    # Reordenar na ordem da página
+    posicoes = pc.index_in(linhas, value_set=pagina_tabela.column(COLUNA_LINHA))
+    return pagina_tabela.take(posicoes).drop_columns([COLUNA_LINHA]), total
+
+def para_ipc(tabela):
+    """
+    Serializa a tabela no formato Arrow IPC (stream)
+    """
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, tabela.schema) as writer:
+        writer.write_table(tabela)
+    return sink.getvalue().to_pybytes()
@@ -0,0 +1,440 @@
+"""
+Motor de Treinamento
+====================
+Treina os modelos de categoria e subcategoria dentro do processo do servidor,
+sem abrir um novo interpretador (e um novo import do TensorFlow) por modelo:
+
+- a base de despesas é lida uma única vez (snapshot tipado do armazenamento)
+- a descrição é vetorizada (TF-IDF) uma única vez e o mesmo vetorizador é
+  usado pelos dois modelos; todos os transformadores vão para um único
+  pipeline de features (pipeline_features.py)
+- rótulos, transformadores e matrizes preparadas ficam no cache de
+  treinamento (cache_treinamento.py): treinar de novo com a mesma base pula o
+  pré-processamento
+- os dois modelos são treinados ao mesmo tempo (threads)
+- o progresso de cada época é enviado para a função `progresso` (ex.: a fila
+  da sessão de treinamento, lida pelo SSE)
+- os artefatos são gravados em um diretório temporário e só substituem os de
+  data/saved_models quando os dois modelos terminam; o retorno traz os objetos
+  já carregados para o servidor trocar os modelos em uso sem reiniciar
+
+O treinamento incremental (treinar_incremental) parte dos modelos salvos e
+ajusta só com as despesas novas ou editadas (mais um replay de linhas antigas).
+
+Os scripts train_model_categoria.py e train_model_subcategoria.py continuam
+funcionando sozinhos; este módulo reaproveita as funções deles.
+"""
+
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import LabelEncoder
+from tensorflow.keras.callbacks import Callback
+from tensorflow.keras.models import load_model
+
+import armazenamento
+import cache_treinamento
+import loop_treinamento
+import pipeline_features
+import train_model_categoria
+import train_model_subcategoria
+
+DIRETORIO_MODELOS = 'data/saved_models'
+
+# Impressões (hash) das linhas usadas no último treinamento
+ARQUIVO_LINHAS = 'linhas_treinadas.npy'
+COLUNAS_IMPRESSAO = ['data', 'descricao', 'valor', 'tags', 'subcategoria', 'categoria']
+
+# Treinamento incremental
+LIMITE_DRIFT_VOCABULARIO = 0.1
+EPOCAS_INCREMENTAIS = 30
+PACIENCIA_INCREMENTAL = 4
+TAXA_APRENDIZADO_INCREMENTAL = 1e-4
+REPLAY_POR_LINHA_NOVA = 5
+REPLAY_MINIMO = 500
+
+# Um treinamento por vez no processo
+_lock_treinamento = threading.Lock()
+
+class ProgressoEpocas(Callback):
+    """
+    Envia uma linha de progresso por época (loss/accuracy de treino e validação)
+    """
+    
+    def __init__(self, progresso, nome, epocas):
+        super().__init__()
+        self.progresso = progresso
+        self.nome = nome
+        self.epocas = epocas
+    
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        metricas = ' - '.join(f'{chave}: {valor:.4f}' for chave, valor in logs.items())
+        self.progresso(f"[{self.nome}] Época {epoch + 1}/{self.epocas} - {metricas}")
+
+def _treinar(modulo, nome, preparados, diretorio, progresso):
+    """
+    Treina, avalia e salva um modelo usando as funções do script
+    
+    - preparados: retorno de modulo.preparar_dados
+    
+    Retorno: (modelo, acurácia no conjunto de teste)
+    """
+    X_treino, X_teste, y_treino, y_teste, label_encoder = preparados
+    progresso(f"[{nome}] {X_treino.shape[0]} amostras de treino, {X_teste.shape[0]} de teste, "
+              f"{X_treino.shape[1]} features, {len(label_encoder.classes_)} classes")
+    
+    modelo = modulo.criar_modelo(X_treino.shape[1], len(label_encoder.classes_))
+    modulo.compilar_modelo(modelo)
+    _, relatorio = modulo.treinar_modelo(
+        modelo, X_treino, y_treino,
+        callbacks=[ProgressoEpocas(progresso, nome, modulo.EPOCAS)], verbose=0
+    )
+    progresso(f"[{nome}] {loop_treinamento.descrever(relatorio)}")
+    modulo.salvar_modelo(modelo, diretorio)
+    
+    predicoes = np.argmax(modelo.predict(X_teste, verbose=0), axis=1)
+    acuracia = float(np.mean(predicoes == y_teste))
+    progresso(f"[{nome}] Acurácia no teste: {acuracia:.4f} ({acuracia * 100:.2f}%)")
+    return modelo, acuracia
+
+def impressoes_linhas(df):
+    """
+    Hash de cada linha da base (identifica linhas novas ou editadas desde o
+    último treinamento)
+    """
+    colunas = [coluna for coluna in COLUNAS_IMPRESSAO if coluna in df.columns]
+    return pd.util.hash_pandas_object(df[colunas], index=False).to_numpy()
+
+def _promover(temporario, diretorio, base, progresso):
+    """
+    Grava as impressões das linhas treinadas e move os artefatos do diretório
+    temporário para o definitivo (cada arquivo trocado atomicamente; o manifesto
+    do pipeline por último, pois é ele quem aponta para o artefato)
+    """
+    np.save(os.path.join(temporario, ARQUIVO_LINHAS), impressoes_linhas(base))
+    arquivos = sorted(os.listdir(temporario), key=lambda arquivo: arquivo == pipeline_features.ARQUIVO_MANIFESTO)
+    for arquivo in arquivos:
+        os.replace(os.path.join(temporario, arquivo), os.path.join(diretorio, arquivo))
+    progresso(f"✓ Modelos salvos em {diretorio}/")
+
+def _carregar_base(progresso):
+    progresso("Carregando despesas...")
+    base = armazenamento.ler_despesas_tipadas().reset_index(drop=True)
+    progresso(f"✓ {len(base)} despesas")
+    return base
+
+def _rotular(base):
+    """
+    Rótulos de cada modelo (carregar_dados dos scripts)
+    
+    Retorno: (df_categoria, df_subcategoria)
+    """
+    return train_model_categoria.carregar_dados(base), train_model_subcategoria.carregar_dados(base)
+
+def _preparar(base, progresso, rotulados=None):
+    """
+    Rótulos, TF-IDF compartilhado e matrizes de treino/teste dos dois modelos,
+    reaproveitados do cache quando a base e as features não mudaram
+    
+    Retorno: (pipeline sem os modelos, {'categoria': preparados, 'subcategoria': preparados})
+    """
+    def calcular():
+        df_categoria, df_subcategoria = rotulados or _rotular(base)
+        progresso(f"Vetorizando descrições (TF-IDF compartilhado pelos dois modelos, "
+                  f"{len(df_subcategoria)} despesas com subcategoria)...")
+        tfidf = TfidfVectorizer(max_features=train_model_categoria.MAX_FEATURES, stop_words=None)
+        vetores = tfidf.fit_transform(base['descricao'])
+        pipeline = pipeline_features.PipelineFeatures(tfidf_categoria=tfidf, tfidf_subcategoria=tfidf)
+        preparados = {
+            'categoria': train_model_categoria.preparar_dados(df_categoria, pipeline=pipeline, vetores=vetores),
+            'subcategoria': train_model_subcategoria.preparar_dados(df_subcategoria, pipeline=pipeline, vetores=vetores),
+        }
+        return {'pipeline': pipeline, 'preparados': preparados}
+    
+    conteudo, _ = cache_treinamento.obter(
+        'treinamento', base, {'max_features': train_model_categoria.MAX_FEATURES}, calcular, progresso
+    )
+    return conteudo['pipeline'], conteudo['preparados']
+
+def _treinar_completo(progresso, diretorio, paralelo, temporario, base=None, rotulados=None):
+    if base is None:
+        base = _carregar_base(progresso)
+    pipeline, preparados = _preparar(base, progresso, rotulados)
+    
+    progresso("")
+    progresso("=" * 50)
+    progresso("TREINANDO MODELOS DE CATEGORIAS E SUBCATEGORIAS"
+              + (" (em paralelo)" if paralelo else ""))
+    progresso("=" * 50)
+    tarefas = {
+        'categoria': (train_model_categoria, 'Categoria'),
+        'subcategoria': (train_model_subcategoria, 'Subcategoria'),
+    }
+    with ThreadPoolExecutor(max_workers=len(tarefas) if paralelo else 1) as executor:
+        futuros = {
+            chave: executor.submit(_treinar, modulo, nome, preparados[chave], temporario, progresso)
+            for chave, (modulo, nome) in tarefas.items()
+        }
+        treinados = {chave: futuro.result() for chave, futuro in futuros.items()}
+    progresso("✓ Modelos de CATEGORIAS e SUBCATEGORIAS treinados com sucesso!")
+    
+    manifesto = pipeline_features.salvar(pipeline, temporario)
+    progresso(f"✓ Pipeline de features versão {manifesto['versao']}")
+    recursos = {'pipeline': pipeline, 'incremental': False}
+    for chave, (modelo, acuracia) in treinados.items():
+        recursos[chave] = {'modelo': modelo, 'acuracia': acuracia}
+    
+    _promover(temporario, diretorio, base, progresso)
+    return recursos
+
+def _diretorio_temporario(diretorio):
+    temporario = os.path.join(diretorio, f'.treinamento_{os.getpid()}')
+    shutil.rmtree(temporario, ignore_errors=True)
+    os.makedirs(temporario)
+    return temporario
+
+def treinar_modelos(progresso=print, diretorio=DIRETORIO_MODELOS, paralelo=True):
+    """
+    Treina os modelos de categoria e subcategoria no processo atual
+    
+    O modelo de subcategoria só usa os rótulos de categoria da base (não o modelo
+    de categoria treinado), então os dois fits rodam ao mesmo tempo em threads:
+    o TensorFlow libera o GIL durante as operações e usa núcleos diferentes para
+    cada modelo. As linhas de progresso dos dois chegam intercaladas, marcadas
+    com [Categoria] / [Subcategoria].
+    
+    Parâmetros:
+    - progresso: função chamada com cada linha de progresso (thread-safe, ex.: queue.put)
+    - diretorio: onde os artefatos finais são gravados
+    - paralelo: False treina um modelo depois do outro
+    
+    Retorno: {
+        'pipeline': PipelineFeatures,
+        'categoria': {'modelo', 'acuracia'},
+        'subcategoria': {'modelo', 'acuracia'},
+        'incremental': False
+    }
+    """
+    if not _lock_treinamento.acquire(blocking=False):
+        raise RuntimeError('Já existe um treinamento em andamento')
+    
+    temporario = None
+    try:
+        temporario = _diretorio_temporario(diretorio)
+        return _treinar_completo(progresso, diretorio, paralelo, temporario)
+    finally:
+        if temporario:
+            shutil.rmtree(temporario, ignore_errors=True)
+        _lock_treinamento.release()
+
+# ============================================
+# TREINAMENTO INCREMENTAL
+# ============================================
+
+def _drift_vocabulario(tfidf, descricoes):
+    """
+    Fração do vocabulário atual que sairia do TF-IDF se ele fosse reajustado
+    """
+    novo = TfidfVectorizer(max_features=len(tfidf.vocabulary_), stop_words=None).fit(descricoes)
+    return 1 - len(set(novo.vocabulary_) & set(tfidf.vocabulary_)) / len(tfidf.vocabulary_)
+
+def _motivo_retreino_completo(diretorio, pipeline, base, df_subcategoria):
+    """
+    Motivo para não fazer o ajuste incremental (ou None)
+    """
+    if not os.path.exists(os.path.join(diretorio, ARQUIVO_LINHAS)):
+        return 'sem registro das linhas do último treinamento'
+    
+    for tfidf in {id(pipeline.tfidf_categoria): pipeline.tfidf_categoria,
+                  id(pipeline.tfidf_subcategoria): pipeline.tfidf_subcategoria}.values():
+        drift = _drift_vocabulario(tfidf, base['descricao'])
+        if drift > LIMITE_DRIFT_VOCABULARIO:
+            return f'vocabulário mudou {drift:.0%} (limite {LIMITE_DRIFT_VOCABULARIO:.0%})'
+    
+    # Categoria e tags são features de entrada da subcategoria: valor novo muda a camada de entrada
+    categorias = set(df_subcategoria['categoria']) - set(pipeline.categoria_encoder.classes_)
+    if categorias:
+        return f"categorias novas na entrada da subcategoria: {', '.join(sorted(map(str, categorias)))}"
+    if pipeline.tags_encoder is not None:
+        tags = set(pipeline_features.normalizar_tags(df_subcategoria['tags'], len(df_subcategoria)))
+        tags -= set(pipeline.tags_encoder.classes_)
+        if tags:
+            return f"tags novas na entrada da subcategoria: {', '.join(sorted(tags))}"
+    return None
+
+def _estender_saida(modulo, modelo, label_encoder, rotulos, input_dim):
+    """
+    Inclui os rótulos novos no encoder e na camada de saída do modelo
+    
+    LabelEncoder mantém as classes ordenadas, então os pesos das classes
+    existentes são copiados para as novas posições; as classes novas começam
+    com os pesos iniciais de uma camada nova.
+    
+    Retorno: (modelo, label_encoder, rótulos novos)
+    """
+    classes = np.union1d(label_encoder.classes_.astype(str), np.asarray(rotulos, dtype=object).astype(str))
+    classes = classes.astype(object)
+    novos = np.setdiff1d(classes, label_encoder.classes_)
+    if len(novos) == 0:
+        return modelo, label_encoder, novos
+    
+    encoder = LabelEncoder()
+    encoder.classes_ = classes
+    posicoes = np.searchsorted(classes, label_encoder.classes_)
+    
+    estendido = modulo.criar_modelo(input_dim, len(classes))
+    for camada_nova, camada in zip(estendido.layers[:-1], modelo.layers[:-1]):
+        camada_nova.set_weights(camada.get_weights())
+    pesos, vies = modelo.layers[-1].get_weights()
+    pesos_novos, vies_novo = estendido.layers[-1].get_weights()
+    pesos_novos[:, posicoes] = pesos
+    vies_novo[posicoes] = vies
+    estendido.layers[-1].set_weights([pesos_novos, vies_novo])
+    return estendido, encoder, novos
+
+def _ajustar(modulo, nome, modelo, label_encoder, df, rotulos, novas, montar_features, progresso):
+    """
+    Ajuste fino de um modelo com as linhas novas mais linhas antigas repetidas
+    (replay, para não esquecer o que já aprendeu)
+    
+    Retorno: (modelo, label_encoder, acurácia no teste)
+    """
+    antigas = df.index[~novas]
+    replay = min(len(antigas), max(REPLAY_MINIMO, REPLAY_POR_LINHA_NOVA * int(novas.sum())))
+    indices = df.index[novas].append(pd.Index(np.random.default_rng(42).choice(antigas, replay, replace=False)))
+    progresso(f"[{nome}] {int(novas.sum())} linhas novas/editadas + {replay} de replay")
+    
+    X = montar_features(df.loc[indices])
+    modelo, label_encoder, novos = _estender_saida(modulo, modelo, label_encoder, rotulos.loc[indices], X.shape[1])
+    if len(novos):
+        progresso(f"[{nome}] Camada de saída estendida com: {', '.join(novos)}")
+    y = label_encoder.transform(rotulos.loc[indices].astype(str))
+    
+    X_treino, X_teste, y_treino, y_teste = train_test_split(X, y, test_size=0.2, random_state=42)
+    modulo.compilar_modelo(modelo, taxa_aprendizado=TAXA_APRENDIZADO_INCREMENTAL)
+    _, relatorio = loop_treinamento.treinar(
+        modelo, X_treino, y_treino,
+        epocas_maximas=EPOCAS_INCREMENTAIS,
+        lote_minimo=modulo.TAMANHO_LOTE,
+        callbacks=[ProgressoEpocas(progresso, nome, EPOCAS_INCREMENTAIS)],
+        verbose=0,
+        paciencia=PACIENCIA_INCREMENTAL,
+        paciencia_lr=PACIENCIA_INCREMENTAL // 2
+    )
+    progresso(f"[{nome}] {loop_treinamento.descrever(relatorio)}")
+    
+    acuracia = float(np.mean(np.argmax(modelo.predict(X_teste, verbose=0), axis=1) == y_teste))
+    progresso(f"[{nome}] Acurácia no teste: {acuracia:.4f} ({acuracia * 100:.2f}%)")
+    return modelo, label_encoder, acuracia
+
+def treinar_incremental(progresso=print, diretorio=DIRETORIO_MODELOS, paralelo=True):
+    """
+    Atualiza os modelos salvos com as despesas novas ou editadas desde o último
+    treinamento, partindo dos pesos atuais (warm start)
+    
+    - pipeline de features mantido (mesmo TF-IDF, normalizadores e encoders
+      de entrada); rótulos novos estendem a camada de saída
+    - cai para o treinamento completo quando não há registro do último
+      treinamento, quando o vocabulário do TF-IDF mudou mais que
+      LIMITE_DRIFT_VOCABULARIO ou quando aparecem categorias/tags novas na
+      entrada do modelo de subcategoria
+    
+    Retorno: mesmo formato de treinar_modelos ('incremental' indica o caminho
+    usado; modelos sem linhas novas ficam com 'acuracia' None)
+    """
+    if not _lock_treinamento.acquire(blocking=False):
+        raise RuntimeError('Já existe um treinamento em andamento')
+    
+    temporario = None
+    try:
+        temporario = _diretorio_temporario(diretorio)
+        base = _carregar_base(progresso)
+        df_categoria, df_subcategoria = _rotular(base)
+        
+        try:
+            pipeline = pipeline_features.carregar(diretorio)
+            modelos = {
+                'categoria': load_model(os.path.join(diretorio, 'category_model.h5'), compile=False),
+                'subcategoria': load_model(os.path.join(diretorio, 'subcategoria_model.h5'), compile=False),
+            }
+            motivo = _motivo_retreino_completo(diretorio, pipeline, base, df_subcategoria)
+        except (OSError, ValueError) as e:
+            motivo = f'modelos atuais indisponíveis ({e})'
+        if motivo:
+            progresso(f"Treinamento completo: {motivo}")
+            return _treinar_completo(progresso, diretorio, paralelo, temporario, base, (df_categoria, df_subcategoria))
+        
+        treinadas = set(np.load(os.path.join(diretorio, ARQUIVO_LINHAS)).tolist())
+        novas = ~pd.Series(impressoes_linhas(base)).isin(treinadas).to_numpy()
+        if not novas.any():
+            progresso("Nenhuma despesa nova ou editada desde o último treinamento")
+            return None
+        
+        progresso("")
+        progresso("=" * 50)
+        progresso(f"AJUSTE INCREMENTAL ({int(novas.sum())} despesas novas ou editadas)")
+        progresso("=" * 50)
+        tarefas = {
+            'categoria': (
+                train_model_categoria, 'Categoria', df_categoria, df_categoria['categoria'],
+                'label_encoder_categoria',
+                lambda df: pipeline_features.features_categoria(pipeline, df['descricao'])
+            ),
+            'subcategoria': (
+                train_model_subcategoria, 'Subcategoria', df_subcategoria, df_subcategoria['subcategoria'],
+                'label_encoder_subcategoria',
+                lambda df: pipeline_features.features_subcategoria(
+                    pipeline, df['descricao'], df['valor'], df['categoria'], df['tags']
+                )
+            ),
+        }
+        with ThreadPoolExecutor(max_workers=len(tarefas) if paralelo else 1) as executor:
+            futuros = {}
+            for chave, (modulo, nome, df, rotulos, atributo, montar_features) in tarefas.items():
+                novas_modelo = novas[df.index.to_numpy()]
+                if not novas_modelo.any():
+                    progresso(f"[{nome}] Sem linhas novas: modelo mantido")
+                    continue
+                futuros[chave] = executor.submit(
+                    _ajustar, modulo, nome, modelos[chave], getattr(pipeline, atributo),
+                    df, rotulos, novas_modelo, montar_features, progresso
+                )
+            ajustados = {chave: futuro.result() for chave, futuro in futuros.items()}
+        
+        recursos = {'pipeline': pipeline, 'incremental': True}
+        for chave, (modulo, _, _, _, atributo, _) in tarefas.items():
+            if chave in ajustados:
+                modelo, label_encoder, acuracia = ajustados[chave]
+                setattr(pipeline, atributo, label_encoder)
+                modulo.salvar_modelo(modelo, temporario)
+                recursos[chave] = {'modelo': modelo, 'acuracia': acuracia}
+            else:
+                recursos[chave] = {'modelo': modelos[chave], 'acuracia': None}
+        
+        pipeline_features.salvar(pipeline, temporario)
+        _promover(temporario, diretorio, base, progresso)
+        return recursos
+    finally:
+        if temporario:
+            shutil.rmtree(temporario, ignore_errors=True)
+        _lock_treinamento.release()
+
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Treina os modelos de categoria e subcategoria')
+    parser.add_argument('--incremental', action='store_true',
+                        help='ajusta os modelos atuais só com as despesas novas/editadas')
+    args = parser.parse_args()
+    
+    if args.incremental:
+        treinar_incremental()
+    else:
+        treinar_modelos()